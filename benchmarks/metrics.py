@@ -0,0 +1,318 @@
+"""Throughput and latency of the metrics hot path, and scrape time by series count.
+
+    python -m benchmarks.metrics --backend mmap --output results.json
+    python -m benchmarks.metrics --backend mmap --compare results.json
+
+Every operation runs in one thread, in `--workers` threads and in `--workers` forked
+processes (for the `mmap` and `manager` backends). Latencies are measured per batch of
+operations and divided by the batch size, loop overhead included.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from derive.metrics import Counter, ExponentialHistogram, Gauge, Histogram, Summary
+from derive.metrics.exporter import PrometheusExporter
+from derive.metrics.manager import create_backend, set_backend
+
+Operation = Callable[[], Any]
+
+
+def _counter_inc() -> Operation:
+    return Counter("bench_counter", "Benchmark counter").inc
+
+
+def _gauge_set() -> Operation:
+    gauge = Gauge("bench_gauge", "Benchmark gauge")
+    return lambda: gauge.set(1.0)
+
+
+def _histogram_observe() -> Operation:
+    histogram = Histogram("bench_histogram", "Benchmark histogram")
+    return lambda: histogram.observe(0.3)
+
+
+def _summary_observe() -> Operation:
+    summary = Summary("bench_summary", "Benchmark summary")
+    return lambda: summary.observe(0.3)
+
+
+def _summary_quantiles_observe() -> Operation:
+    summary = Summary(
+        "bench_summary_quantiles", "Benchmark summary", quantiles=(0.5, 0.99)
+    )
+    return lambda: summary.observe(0.3)
+
+
+def _exponential_observe() -> Operation:
+    histogram = ExponentialHistogram("bench_exponential", "Benchmark histogram")
+    return lambda: histogram.observe(0.3)
+
+
+def _labels() -> Operation:
+    family = Counter("bench_labels", "Benchmark labels", {"method"})
+    family.labels(method="get")
+    return lambda: family.labels(method="get")
+
+
+def _labels_inc() -> Operation:
+    family = Counter("bench_labels_inc", "Benchmark labels", {"method"})
+    return lambda: family.labels(method="get").inc()
+
+
+OPERATIONS: Dict[str, Callable[[], Operation]] = {
+    "counter.inc": _counter_inc,
+    "gauge.set": _gauge_set,
+    "histogram.observe": _histogram_observe,
+    "summary.observe": _summary_observe,
+    "summary.observe[quantiles]": _summary_quantiles_observe,
+    "exponential_histogram.observe": _exponential_observe,
+    "labels": _labels,
+    "labels.inc": _labels_inc,
+}
+
+
+def _run(operation: Operation, iterations: int, batch: int) -> List[float]:
+    """Nanoseconds per operation of every batch."""
+    latencies = []
+    perf_counter_ns = time.perf_counter_ns
+    for _ in range(max(iterations // batch, 1)):
+        start = perf_counter_ns()
+        for _ in range(batch):
+            operation()
+        latencies.append((perf_counter_ns() - start) / batch)
+    return latencies
+
+
+def _worker(operation, iterations, batch, barrier, results):
+    barrier.wait()
+    results.put(_run(operation, iterations, batch))
+
+
+def _parallel(
+    operation: Operation, mode: str, workers: int, iterations: int, batch: int
+) -> Tuple[float, List[float]]:
+    if mode == "threads":
+        barrier: Any = threading.Barrier(workers + 1)
+        results: Any = queue.Queue()
+        runners: List[Any] = [
+            threading.Thread(
+                target=_worker, args=(operation, iterations, batch, barrier, results)
+            )
+            for _ in range(workers)
+        ]
+    else:
+        context = multiprocessing.get_context("fork")
+        barrier = context.Barrier(workers + 1)
+        results = context.Queue()
+        runners = [
+            context.Process(
+                target=_worker, args=(operation, iterations, batch, barrier, results)
+            )
+            for _ in range(workers)
+        ]
+    for runner in runners:
+        runner.start()
+    barrier.wait()
+    start = time.perf_counter()
+    latencies = [latency for _ in runners for latency in results.get()]
+    elapsed = time.perf_counter() - start
+    for runner in runners:
+        runner.join()
+    return elapsed, latencies
+
+
+def _percentile(values: Sequence[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def bench_operations(
+    names: Sequence[str],
+    modes: Sequence[str],
+    workers: int,
+    iterations: int,
+    batch: int,
+) -> List[Dict[str, Any]]:
+    results = []
+    for name in names:
+        operation = OPERATIONS[name]()
+        # warm up, creates the values before forking
+        _run(operation, batch * 10, batch)
+        for mode in modes:
+            if mode == "single":
+                start = time.perf_counter()
+                latencies = _run(operation, iterations, batch)
+                elapsed, count = time.perf_counter() - start, 1
+            else:
+                elapsed, latencies = _parallel(
+                    operation, mode, workers, iterations, batch
+                )
+                count = workers
+            ops = len(latencies) * batch
+            results.append(
+                {
+                    "operation": name,
+                    "mode": mode,
+                    "workers": count,
+                    "ops": ops,
+                    "seconds": elapsed,
+                    "ops_per_second": ops / elapsed,
+                    "ns_per_op_mean": statistics.mean(latencies),
+                    "ns_per_op_p50": _percentile(latencies, 0.5),
+                    "ns_per_op_p99": _percentile(latencies, 0.99),
+                }
+            )
+    return results
+
+
+def bench_scrape(series: Sequence[int], repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for count in series:
+        family = Counter(f"bench_scrape_{count}", "Benchmark scrape", {"id"})
+        for i in range(count):
+            family.labels(id=str(i)).inc()
+        PrometheusExporter.generate_latest()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            PrometheusExporter.generate_latest()
+            timings.append(time.perf_counter() - start)
+        family.clear()
+        results.append(
+            {
+                "series": count,
+                "repeat": repeat,
+                "ms_p50": statistics.median(timings) * 1e3,
+                "ms_min": min(timings) * 1e3,
+                "ms_max": max(timings) * 1e3,
+            }
+        )
+    return results
+
+
+def _version() -> str:
+    try:
+        from importlib.metadata import version
+
+        return version("derive")
+    except Exception:
+        return "unknown"
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], threshold: float
+) -> List[str]:
+    """Lines comparing `results` with `baseline`, regressions over `threshold` are marked."""
+    lines = []
+    previous = {
+        (r["operation"], r["mode"], r["workers"]): r for r in baseline["operations"]
+    }
+    for r in results["operations"]:
+        old = previous.get((r["operation"], r["mode"], r["workers"]))
+        if old is not None:
+            ratio = r["ns_per_op_p50"] / old["ns_per_op_p50"]
+            mark = "  REGRESSION" if ratio > 1 + threshold else ""
+            lines.append(
+                f"{r['operation']:<32}{r['mode']:<10}{old['ns_per_op_p50']:>10.0f}"
+                f"{r['ns_per_op_p50']:>10.0f} ns/op  x{ratio:.2f}{mark}"
+            )
+    scrapes = {r["series"]: r for r in baseline["scrape"]}
+    for r in results["scrape"]:
+        old = scrapes.get(r["series"])
+        if old is not None:
+            ratio = r["ms_p50"] / old["ms_p50"]
+            mark = "  REGRESSION" if ratio > 1 + threshold else ""
+            lines.append(
+                f"{'scrape ' + str(r['series']) + ' series':<42}{old['ms_p50']:>10.2f}"
+                f"{r['ms_p50']:>10.2f} ms     x{ratio:.2f}{mark}"
+            )
+    return lines
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--backend", default="inprocess", choices=("inprocess", "mmap", "manager")
+    )
+    parser.add_argument("--buffer-interval", type=float, default=0.0)
+    parser.add_argument("--operations", nargs="*", default=list(OPERATIONS))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument(
+        "--series", type=int, nargs="*", default=[10, 100, 1000, 10_000]
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="slowdown over which --compare reports a regression and exits with 1",
+    )
+    args = parser.parse_args(argv)
+
+    modes = ["single", "threads"]
+    if args.backend != "inprocess":
+        # values of forked processes are only shared by multiprocess backends
+        modes.append("processes")
+    with tempfile.TemporaryDirectory() as directory:
+        backend = create_backend(args.backend, directory, args.buffer_interval)
+        set_backend(backend)
+        try:
+            results: Dict[str, Any] = {
+                "meta": {
+                    "derive": _version(),
+                    "python": platform.python_version(),
+                    "implementation": platform.python_implementation(),
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                    "backend": args.backend,
+                    "buffer_interval": args.buffer_interval,
+                    "batch": args.batch,
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                },
+                "operations": bench_operations(
+                    args.operations, modes, args.workers, args.iterations, args.batch
+                ),
+                "scrape": bench_scrape(args.series, args.repeat),
+            }
+        finally:
+            if hasattr(backend, "close"):
+                backend.close()
+
+    for r in results["operations"]:
+        print(
+            f"{r['operation']:<32}{r['mode']:<10}{r['workers']:>3}"
+            f"{r['ops_per_second']:>14,.0f} ops/s"
+            f"{r['ns_per_op_p50']:>10.0f} ns p50{r['ns_per_op_p99']:>10.0f} ns p99"
+        )
+    for r in results["scrape"]:
+        print(f"scrape {r['series']:>7} series{r['ms_p50']:>12.2f} ms p50")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            lines = compare(results, json.load(f), args.threshold)
+        print("\n".join(lines))
+        if any(line.endswith("REGRESSION") for line in lines):
+            sys.exit(1)
+    return results
+
+
+if __name__ == "__main__":
+    main()
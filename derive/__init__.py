@@ -1,3 +1,4 @@
+import multiprocessing.util
 import os
 import sys
 import typing
@@ -15,23 +16,41 @@ from derive.integrations import BaseIntegration
 _installer_lock = Lock()
 _installed_integrations: typing.Set[str] = set()
 _global_resources: Resource = Resource.create()
+# attributes of `_global_resources` as strings, built on first use after every update
+_global_resource_attributes: typing.Optional[typing.Dict[str, str]] = None
 
 
 def update_global_resources(resource: Resource) -> None:
-    global _global_resources
+    global _global_resources, _global_resource_attributes
     _global_resources = _global_resources.merge(resource)
+    _global_resource_attributes = None
 
 
 def get_global_resources() -> Resource:
     return _global_resources
 
 
+def get_global_resource_attributes() -> typing.Dict[str, str]:
+    """Attributes of the global resources as strings, shared until the next
+    `update_global_resources`, so they must not be modified."""
+    global _global_resource_attributes
+    attributes = _global_resource_attributes
+    if attributes is None:
+        attributes = _global_resource_attributes = {
+            k: str(v) for k, v in _global_resources.attributes.items()
+        }
+    return attributes
+
+
 def init(
     config: DefaultConfig,
     integrations: typing.Optional[typing.Iterable[BaseIntegration]] = None,
 ):
     update_global_resources(Resource({resources.SERVICE_NAME: config.SERVICE_NAME}))
     update_global_resources(Resource(config.STATIC_RESOURCES))
+    from derive.metrics.manager import configure
+
+    configure(config)
     with _installer_lock:
         for integration in integrations or []:
             if integration.identifier not in _installed_integrations:
@@ -48,3 +67,28 @@ def register_after_fork(f: typing.Callable[..., typing.Any]) -> None:
         uwsgidecorators.postfork(f)
     if not sys.platform.startswith("win"):
         os.register_at_fork(after_in_child=f)
+
+
+_exit_functions: typing.List[typing.Tuple[typing.Callable[[], typing.Any], int]] = []
+
+
+def register_at_exit(f: typing.Callable[[], typing.Any], priority: int) -> None:
+    """Call `f` at the exit of this process and of its forked children, with the exit
+    functions of `multiprocessing` by decreasing `priority` (its `Manager` is shut down
+    at 0)."""
+    _exit_functions.append((f, priority))
+    multiprocessing.util.Finalize(None, f, exitpriority=priority)
+
+
+def _register_exit_functions(*_: typing.Any) -> None:
+    # finalizers only run in the process which registered them
+    for f, priority in _exit_functions:
+        multiprocessing.util.Finalize(None, f, exitpriority=priority)
+
+
+register_after_fork(_register_exit_functions)
+# `multiprocessing` children drop finalizers registered before their bootstrap, also
+# those of `register_after_fork`, so they are registered again after it
+multiprocessing.util.register_after_fork(
+    _register_exit_functions, _register_exit_functions
+)
@@ -6,3 +6,15 @@ class DefaultConfig(BaseConfig):
     SERVICE_NAME = "derive"
 
     STATIC_RESOURCES: Attributes = {}
+
+    # `inprocess`, `mmap` or `manager`, empty to keep the default (a `Manager` unless
+    # `DERIVE_METRICS_BACKEND` is set)
+    METRICS_BACKEND = ""
+    # directory of the memory-mapped files of the `mmap` backend
+    METRICS_DIRECTORY = ""
+    # keep the values of the `mmap` backend across restarts, in `METRICS_DIRECTORY`
+    METRICS_PERSISTENT = False
+    # batch metric updates every this many seconds, 0 to apply them immediately
+    METRICS_BUFFER_INTERVAL = 0.0
+    # limit of metrics (every labeled child counts), 0 for no limit
+    METRICS_MAX_SERIES = 0
@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import logging
+import time
+import typing
+from threading import Event, Lock, Thread
+from typing import Any, Dict, List, Optional, Tuple
+
+from configalchemy import BaseConfig
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.util.instrumentation import InstrumentationScope
+
+try:
+    from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import (
+        OTLPMetricExporter,
+    )
+    from opentelemetry.sdk.metrics.export import (
+        AggregationTemporality,
+        Buckets,
+        ExponentialHistogram,
+        ExponentialHistogramDataPoint,
+        Gauge,
+        Histogram,
+        HistogramDataPoint,
+        Metric,
+        MetricExporter,
+        MetricExportResult,
+        MetricsData,
+        NumberDataPoint,
+        ResourceMetrics,
+        ScopeMetrics,
+        Sum,
+    )
+except ImportError as e:
+    # derive itself runs with older versions of the SDK
+    raise ImportError(
+        "The otlp-metrics integration needs derive[otlp-metrics] "
+        "and opentelemetry-sdk 1.15 or later"
+    ) from e
+
+import derive
+from derive.integrations import BaseIntegration
+from derive.metrics.collector import GlobalCollector
+from derive.metrics.metric.base import ExponentialHistogram as _ExponentialHistogram
+from derive.metrics.metric.base import Histogram as _Histogram
+from derive.metrics.metric.base import Metric as _Metric
+from derive.metrics.snapshot import collecting
+
+logger = logging.getLogger(__name__)
+
+NaN = float("NaN")
+DELTA = AggregationTemporality.DELTA
+SCOPE = InstrumentationScope("derive.metrics")
+
+
+class DefaultConfig(BaseConfig):
+    ENABLE = False
+    OTLP_ENDPOINT = ""
+    EXPORT_INTERVAL = 10.0
+
+
+def _buckets(counts: Dict[int, float]) -> Buckets:
+    if not counts:
+        return Buckets(offset=0, bucket_counts=[])
+    # derive bucket `i` is `(base ** (i - 1), base ** i]`, OTLP bucket `i` is
+    # `(base ** i, base ** (i + 1)]`
+    low, high = min(counts), max(counts)
+    return Buckets(
+        offset=low - 1,
+        bucket_counts=[int(counts.get(i, 0)) for i in range(low, high + 1)],
+    )
+
+
+def _subtract(
+    current: Dict[int, float], previous: Dict[int, float]
+) -> Dict[int, float]:
+    delta = {}
+    for index, count in current.items():
+        count -= previous.get(index, 0.0)
+        if count:
+            delta[index] = count
+    return delta
+
+
+class DeltaMetricsBridge:
+    """Exports the registry through an OpenTelemetry `MetricExporter` every `interval`
+    seconds from a background thread, and once more at exit, with delta temporality.
+
+    The cumulative values of every series at the last successful export are kept, only
+    series that changed since then become data points, with the difference as value.
+    Counters are exported as monotonic sums, gauges with their current value, histograms
+    and the count and sum of summaries as histograms, exponential histograms with their
+    buckets. Quantiles of summaries have no delta and are not exported.
+
+    Values of a multiprocess backend are merged at collection, so a single process should
+    export them: forked children do not run the bridge of their parent.
+    """
+
+    def __init__(
+        self,
+        exporter: MetricExporter,
+        interval: float = 10.0,
+        resource: Optional[Resource] = None,
+        start: bool = True,
+    ):
+        self.exporter = exporter
+        self.interval = interval
+        self.resource = resource if resource is not None else Resource.create({})
+        self._lock = Lock()
+        # cumulative state and time of the last exported point of every series
+        self._last: Dict[Tuple[str, str], Tuple[int, Any]] = {}
+        self._start_time = time.time_ns()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+        if start:
+            self._thread = Thread(
+                target=self._run, name="derive.metrics.DeltaMetricsBridge", daemon=True
+            )
+            self._thread.start()
+            derive.register_at_exit(self.close, 10)
+            derive.register_after_fork(self._after_fork)
+
+    def _after_fork(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.export()
+            except Exception:
+                logger.warning("Exporting metrics failed", exc_info=True)
+
+    def _counter(self, metric: _Metric, last, start: int, now: int):
+        (value,) = metric.sample_values()
+        delta = value - last if last is not None and value >= last else value
+        if not delta:
+            return None, value
+        return NumberDataPoint(metric._labels, start, now, delta), value
+
+    def _gauge(self, metric: _Metric, last, start: int, now: int):
+        (value,) = metric.sample_values()
+        if value == last:
+            return None, value
+        return NumberDataPoint(metric._labels, start, now, value), value
+
+    def _histogram(self, metric: _Metric, last, start: int, now: int):
+        values = metric.sample_values()
+        if isinstance(metric, _Histogram):
+            bounds = metric._upper_bounds
+            cumulative = values[: len(bounds)]
+            counts = [b - a for a, b in zip([0.0] + cumulative, cumulative)]
+            total = values[len(bounds)]
+            sum_ = values[-1] if bounds[0] >= 0 else 0.0
+            bounds = bounds[:-1]
+        else:
+            # summary, only the count and sum have deltas
+            total, sum_ = values[-2:]
+            counts, bounds = [total], []
+        state = (counts, total, sum_)
+        if last is not None and total >= last[1]:
+            if total == last[1]:
+                return None, state
+            counts = [a - b for a, b in zip(counts, last[0])]
+            total -= last[1]
+            sum_ -= last[2]
+        elif not total:
+            return None, state
+        point = HistogramDataPoint(
+            attributes=metric._labels,
+            start_time_unix_nano=start,
+            time_unix_nano=now,
+            count=int(total),
+            sum=sum_,
+            bucket_counts=[int(count) for count in counts],
+            explicit_bounds=list(bounds),
+            min=NaN,
+            max=NaN,
+        )
+        return point, state
+
+    def _exponential(self, metric: _Metric, last, start: int, now: int):
+        histogram = typing.cast(_ExponentialHistogram, metric)
+        schema, positive, negative = histogram.native()
+        total, sum_ = histogram.sample_values()[-2:]
+        zero = histogram._zero.get()
+        state = (schema, positive, negative, zero, total, sum_)
+        if last is not None and total >= last[4]:
+            if total == last[4]:
+                return None, state
+            last_schema, last_positive, last_negative = last[:3]
+            # buckets of both collections at the lower schema
+            schema = min(schema, last_schema)
+            positive, negative = [
+                _subtract(
+                    self._downscaled(current, state[0] - schema),
+                    self._downscaled(previous, last_schema - schema),
+                )
+                for current, previous in (
+                    (positive, last_positive),
+                    (negative, last_negative),
+                )
+            ]
+            zero -= last[3]
+            total -= last[4]
+            sum_ -= last[5]
+        elif not total:
+            return None, state
+        point = ExponentialHistogramDataPoint(
+            attributes=metric._labels,
+            start_time_unix_nano=start,
+            time_unix_nano=now,
+            count=int(total),
+            sum=sum_,
+            scale=schema,
+            zero_count=int(zero),
+            positive=_buckets(positive),
+            negative=_buckets(negative),
+            flags=0,
+            min=NaN,
+            max=NaN,
+        )
+        return point, state
+
+    @staticmethod
+    def _downscaled(counts: Dict[int, float], delta: int) -> Dict[int, float]:
+        if not delta:
+            return counts
+        result: Dict[int, float] = {}
+        for index, count in counts.items():
+            index = _ExponentialHistogram._downscale(index, delta)
+            result[index] = result.get(index, 0.0) + count
+        return result
+
+    _converters = {
+        "counter": (_counter, Sum),
+        "gauge": (_gauge, Gauge),
+        "histogram": (_histogram, Histogram),
+        "summary": (_histogram, Histogram),
+        "exponential_histogram": (_exponential, ExponentialHistogram),
+    }
+
+    def _collect(self, now: int) -> Tuple[List[Metric], Dict[Tuple[str, str], Any]]:
+        families: Dict[Tuple[str, str], Tuple[_Metric, List]] = {}
+        updates: Dict[Tuple[str, str], Any] = {}
+        # the same collected metrics are refreshed by snapshots of exporters
+        with collecting():
+            for metric in GlobalCollector.collect():
+                converter = self._converters.get(metric._type)
+                if converter is None:
+                    continue
+                key = (metric._type, metric.identity)
+                last_time, last = self._last.get(key, (self._start_time, None))
+                point, state = converter[0](self, metric, last, last_time, now)
+                if point is None:
+                    continue
+                updates[key] = (now, state)
+                family = families.get((metric._type, metric.name))
+                if family is None:
+                    family = families[(metric._type, metric.name)] = (metric, [])
+                family[1].append(point)
+        metrics = []
+        for (_type, name), (metric, points) in families.items():
+            data_type = self._converters[_type][1]
+            if data_type is Sum:
+                data: Any = Sum(points, DELTA, is_monotonic=True)
+            elif data_type is Gauge:
+                data = Gauge(points)
+            else:
+                data = data_type(points, DELTA)
+            metrics.append(
+                Metric(
+                    name=name,
+                    description=metric.parameters["document"],
+                    unit="",
+                    data=data,
+                )
+            )
+        return metrics, updates
+
+    def export(self) -> int:
+        """Exports the series changed since the last export now, returns how many."""
+        with self._lock:
+            metrics, updates = self._collect(time.time_ns())
+            if not metrics:
+                return 0
+            data = MetricsData(
+                [ResourceMetrics(self.resource, [ScopeMetrics(SCOPE, metrics, "")], "")]
+            )
+            result = self.exporter.export(data)
+            if result is not MetricExportResult.SUCCESS:
+                raise RuntimeError(f"Exporting metrics failed with {result}")
+            # failed exports are covered by the next delta
+            self._last.update(updates)
+            return len(updates)
+
+    def close(self):
+        """Stops the background thread after a last export."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.export()
+        except Exception:
+            logger.warning("Exporting metrics failed", exc_info=True)
+        self.exporter.shutdown()
+
+
+class Integration(BaseIntegration):
+    bridge: Optional[DeltaMetricsBridge] = None
+
+    @property
+    def identifier(self) -> str:
+        return "otlp-metrics"
+
+    def __init__(self, config: DefaultConfig) -> None:
+        self.config = config
+
+    def setup(self):
+        if self.config.ENABLE:
+            exporter = OTLPMetricExporter(endpoint=self.config.OTLP_ENDPOINT or None)
+            self.bridge = DeltaMetricsBridge(
+                exporter,
+                interval=self.config.EXPORT_INTERVAL,
+                resource=derive.get_global_resources(),
+            )
@@ -1,4 +1,5 @@
 import logging
+import operator
 import typing
 
 from derive.log.types import ArgsType, SysExcInfoType
@@ -24,9 +25,32 @@ class DeriveLogRecord(logging.LogRecord):
             "stack_info",
         )
     )
+    # `builtin_{attribute}` keys and a getter of all the builtin attributes at once
+    _builtin_keys: typing.Tuple[str, ...]
+    _builtin_getter: typing.ClassVar[
+        typing.Callable[[logging.LogRecord], typing.Tuple[typing.Any, ...]]
+    ]
     trace_id: typing.Optional[str]
     attributes: typing.Dict[str, str]
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile_builtin_attrs()
+
+    @classmethod
+    def _compile_builtin_attrs(cls):
+        attributes = sorted(cls.BUILTIN_RECORD_ATTRS)
+        cls._builtin_keys = tuple(f"builtin_{attribute}" for attribute in attributes)
+        if len(attributes) > 1:
+            getter = operator.attrgetter(*attributes)
+        else:
+            # attrgetter only returns a tuple of several attributes
+            def getter(record):
+                return tuple(getattr(record, attribute) for attribute in attributes)
+
+        # called through the class, so that a function is not bound to the record
+        cls._builtin_getter = getter
+
     def __init__(
         self,
         name: str,
@@ -54,22 +78,25 @@ class DeriveLogRecord(logging.LogRecord):
 
     def to_log_data(self) -> dict:
         # reference: https://opentelemetry.io/docs/reference/specification/logs/data-model/
-        attributes: typing.Dict[str, str] = {}
-        for attribute in self.BUILTIN_RECORD_ATTRS:
-            attr_value = getattr(self, attribute)
-            if attr_value:
-                attributes[f"builtin_{attribute}"] = str(attr_value)
+        attributes = {
+            key: value if value.__class__ is str else str(value)
+            for key, value in zip(self._builtin_keys, type(self)._builtin_getter(self))
+            if value
+        }
+        if self.attributes:
+            attributes.update(self.attributes)
 
         data = {
             "SeverityText": self.levelname,
             "SeverityNumber": self.levelno,
             "Body": self.msg,
             "Timestamp": self.created,
-            "Attributes": {**attributes, **self.attributes},
-            "Resource": {
-                k: str(v) for k, v in derive.get_global_resources().attributes.items()
-            },
+            "Attributes": attributes,
+            "Resource": dict(derive.get_global_resource_attributes()),
         }
-        if getattr(self, "trace_id") is not None:
+        if self.trace_id is not None:
             data["TraceId"] = self.trace_id
         return data
+
+
+DeriveLogRecord._compile_builtin_attrs()
@@ -3,5 +3,16 @@ from derive.metrics.metric import (
     Summary,
     Gauge,
     Histogram,
+    ExponentialHistogram,
+    Meter,
 )
-from derive.metrics.manager import metrics_mapping, manager
+from typing import Any
+
+
+def __getattr__(name: str) -> Any:
+    # created on first use by `derive.metrics.manager.get_backend`
+    if name == "metrics_mapping":
+        from derive.metrics.manager import get_backend
+
+        return get_backend().metrics_mapping
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
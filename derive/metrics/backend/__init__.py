@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+import typing
+from abc import ABC, abstractmethod
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from derive.metrics.metric.base import EXEMPLAR_FIELD, Metric, MetricValue, MetricVector
+
+SEPARATOR = "\n"
+
+# `(value, set_value, delta)`, the set value and delta of a vector are lists with one item
+# per element
+Update = Tuple[Any, Optional[Union[float, List[float]]], Union[float, List[float]]]
+
+
+def encode_key(metric: Metric, field: str) -> str:
+    """Key of one value of `metric`, carrying everything needed to rebuild the metric.
+
+    json.dumps never emits a raw newline, so the field is split off the metric spec with it.
+    """
+    spec = json.dumps([metric._type, metric.parameters, metric._labels], sort_keys=True)
+    return f"{spec}{SEPARATOR}{field}"
+
+
+def decode_key(key: str) -> Tuple[str, str]:
+    spec, _, field = key.rpartition(SEPARATOR)
+    return spec, field
+
+
+def merge_values(key: str, total: List[float], values: Sequence[float]) -> None:
+    """Merge `values` of `key` from another process into `total`, the latest exemplar
+    of all processes wins."""
+    if decode_key(key)[1].startswith(EXEMPLAR_FIELD):
+        if values[1] > total[1]:
+            total[:] = values
+        return
+    for i, value in enumerate(values):
+        total[i] += value
+
+
+class Backend(ABC):
+    """Storage of metric values.
+
+    Every value is addressed by a key built from its metric and field, so the registry of
+    metric objects stays process-local and the backend alone knows every series.
+    A value is stored as a sequence of doubles, with a single item for a `MetricValue`.
+    """
+
+    # whether the processes of `pid/{pid}` fields run on this host
+    local = True
+
+    def __init__(self) -> None:
+        self.metrics_mapping: Dict[str, Metric] = {}
+        # metrics rebuilt by the previous collection, only their values are refreshed
+        self._restored: Dict[str, Metric] = {}
+
+    @abstractmethod
+    def value(self, metric: Metric, field: str) -> MetricValue:
+        """Create (or attach to) the value of `field` for `metric`."""
+
+    @abstractmethod
+    def vector(self, metric: Metric, field: str, size: int) -> MetricVector:
+        """Create (or attach to) the vector of `size` values of `field` for `metric`."""
+
+    @abstractmethod
+    def remove(self, values: Iterable[Union[MetricValue, MetricVector]]) -> None:
+        """Stop exporting `values`. Values shared by all processes are exported again by
+        their next update, e.g. from a process which still holds their metric."""
+
+    def apply(self, updates: Iterable[Update]) -> None:
+        """Apply `(value, set_value, delta)` updates: `value` is set to `set_value`
+        (unless it is None) and then incremented by `delta`."""
+        for value, set_value, delta in updates:
+            if isinstance(delta, list):
+                if isinstance(set_value, list):
+                    value.set([s + d for s, d in zip(set_value, delta)])
+                else:
+                    value.inc([(i, amount) for i, amount in enumerate(delta) if amount])
+            elif set_value is not None:
+                value.set(typing.cast(float, set_value) + delta)
+            else:
+                value.inc(delta)
+
+    def forget(self, values: Iterable[Union[MetricValue, MetricVector]]) -> None:
+        """Drop `values` inherited from the parent in a forked child, the parent keeps
+        exporting them."""
+        self.remove(values)
+
+    def after_fork(self) -> None:
+        """Called in the child process after a fork."""
+
+    def mark_process_dead(self, pid: int) -> None:
+        """Called once process `pid` exited, e.g. from the worker exit callback of a
+        pre-fork server: values kept for that process alone are dropped."""
+
+    @abstractmethod
+    def items(self) -> Iterable[Tuple[str, Sequence[float]]]:
+        """Yields `(key, values)` of every value, aggregated over all processes."""
+
+    def fields(self, metric: Metric) -> List[str]:
+        """Fields of every value of `metric` stored by any process."""
+        prefix = encode_key(metric, "")
+        return [key[len(prefix) :] for key, _ in self.items() if key.startswith(prefix)]
+
+    def field_values(self, metric: Metric) -> Dict[str, Sequence[float]]:
+        """Values of every field of `metric`, aggregated over all processes."""
+        prefix = encode_key(metric, "")
+        return {
+            key[len(prefix) :]: values
+            for key, values in self.items()
+            if key.startswith(prefix)
+        }
+
+    def collect(self) -> Iterator[Metric]:
+        specs: Dict[str, Dict[str, Sequence[float]]] = {}
+        for key, values in self.items():
+            spec, field = decode_key(key)
+            specs.setdefault(spec, {})[field] = values
+        previous, restored = self._restored, {}
+        for spec, fields in specs.items():
+            metric = previous.get(spec)
+            if metric is None:
+                _type, parameters, labels = json.loads(spec)
+                metric = Metric.restore(
+                    _type, parameters, labels, FrozenBackend(fields)
+                )
+            else:
+                metric.init(FrozenBackend(fields))
+            restored[spec] = metric
+        self._restored = restored
+        return iter(restored.values())
+
+
+class FrozenBackend(Backend):
+    """Read-only values of a single metric, used to rebuild metrics at collection time."""
+
+    def __init__(self, fields: Mapping[str, Sequence[float]], local: bool = True):
+        self._fields = fields
+        self.local = local
+
+    def value(self, metric: Metric, field: str) -> MetricValue:
+        values = self._fields.get(field)
+        return MetricValue(values[0] if values else 0.0)
+
+    def vector(self, metric: Metric, field: str, size: int) -> MetricVector:
+        return MetricVector(self._fields.get(field) or [0.0] * size)
+
+    def remove(self, values: Iterable[Union[MetricValue, MetricVector]]) -> None:
+        pass
+
+    def fields(self, metric: Metric) -> List[str]:
+        return list(self._fields)
+
+    def field_values(self, metric: Metric) -> Dict[str, Sequence[float]]:
+        return dict(self._fields)
+
+    def items(self) -> Iterable[Tuple[str, Sequence[float]]]:
+        return ()
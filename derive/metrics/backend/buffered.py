@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+from threading import Event, Lock, Thread
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+import derive
+from derive.metrics.backend import Backend
+from derive.metrics.metric.base import Metric, MetricValue, MetricVector
+
+
+class BufferedValue(MetricValue):
+    """Accumulates updates of `value` in its backend until the next flush."""
+
+    def __init__(self, backend: BufferedBackend, value: MetricValue):
+        self._backend = backend
+        self._value = value
+
+    def inc(self, amount: Union[float, int]):
+        backend = self._backend
+        with backend.lock:
+            update = backend.pending.get(self._value)
+            if update is None:
+                backend.pending[self._value] = [None, amount]
+            else:
+                update[1] += amount
+
+    def set(self, value: Union[float, int]):
+        backend = self._backend
+        with backend.lock:
+            backend.pending[self._value] = [value, 0.0]
+
+    def get(self) -> float:
+        with self._backend.lock:
+            update = self._backend.pending.get(self._value)
+        if update is None:
+            return self._value.get()
+        set_value, delta = update
+        if set_value is None:
+            return self._value.get() + delta
+        return set_value + delta
+
+
+class BufferedVector(MetricVector):
+    """Accumulates updates of `vector` in its backend until the next flush."""
+
+    def __init__(self, backend: BufferedBackend, vector: MetricVector, size: int):
+        self._backend = backend
+        self._vector = vector
+        self._size = size
+
+    def inc(self, updates: Iterable[Tuple[int, Union[float, int]]]):
+        backend = self._backend
+        with backend.lock:
+            update = backend.pending.get(self._vector)
+            if update is None:
+                update = backend.pending[self._vector] = [None, [0.0] * self._size]
+            deltas = update[1]
+            for index, amount in updates:
+                deltas[index] += amount
+
+    def set(self, values: Sequence[float]):
+        backend = self._backend
+        with backend.lock:
+            backend.pending[self._vector] = [list(values), [0.0] * self._size]
+
+    def get(self) -> List[float]:
+        with self._backend.lock:
+            update = self._backend.pending.get(self._vector)
+            if update is not None:
+                set_values = None if update[0] is None else list(update[0])
+                deltas = list(update[1])
+        if update is None:
+            return self._vector.get()
+        values = self._vector.get() if set_values is None else set_values
+        for index, delta in enumerate(deltas):
+            values[index] += delta
+        return values
+
+
+class BufferedBackend(Backend):
+    """Buffers updates in process and pushes them to `backend` in one batched call
+    every `interval` seconds, before collection and at exit.
+
+    Values of other processes are at most `interval` seconds stale at collection time.
+    Updates not flushed yet are lost if the process is killed.
+    """
+
+    def __init__(self, backend: Backend, interval: float = 0.1):
+        super().__init__()
+        self.backend = backend
+        self.interval = interval
+        self.lock = Lock()
+        self.pending: Dict[Union[MetricValue, MetricVector], List] = {}
+        # held while pending updates are applied, so a removal cannot interleave
+        self._flush_lock = Lock()
+        self._stopped = Event()
+        self._start()
+        # runs before proxies and the `Manager` are shut down
+        derive.register_at_exit(self.close, 20)
+
+    def _start(self):
+        self._thread = Thread(
+            target=self._run, name="derive.metrics.BufferedBackend", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if pending:
+                self.backend.apply(
+                    (value, set_value, delta)
+                    for value, (set_value, delta) in pending.items()
+                )
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+
+    def after_fork(self) -> None:
+        # the parent flushes what it buffered before the fork
+        self.lock = Lock()
+        self._flush_lock = Lock()
+        self.pending = {}
+        self.backend.after_fork()
+        if not self._stopped.is_set():
+            self._stopped = Event()
+            self._start()
+
+    def mark_process_dead(self, pid: int) -> None:
+        self.backend.mark_process_dead(pid)
+
+    def value(self, metric: Metric, field: str) -> MetricValue:
+        return BufferedValue(self, self.backend.value(metric, field))
+
+    def vector(self, metric: Metric, field: str, size: int) -> MetricVector:
+        return BufferedVector(self, self.backend.vector(metric, field, size), size)
+
+    def _unwrap(
+        self, values: Iterable[Union[MetricValue, MetricVector]]
+    ) -> List[Union[MetricValue, MetricVector]]:
+        inner = [
+            value._value if isinstance(value, BufferedValue) else value._vector
+            for value in values
+            if isinstance(value, (BufferedValue, BufferedVector))
+        ]
+        with self.lock:
+            for value in inner:
+                self.pending.pop(value, None)
+        return inner
+
+    def remove(self, values: Iterable[Union[MetricValue, MetricVector]]) -> None:
+        # updates of this process pending for `values` are dropped, not applied after
+        with self._flush_lock:
+            self.backend.remove(self._unwrap(values))
+
+    def forget(self, values: Iterable[Union[MetricValue, MetricVector]]) -> None:
+        self.backend.forget(self._unwrap(values))
+
+    def items(self) -> Iterable[Tuple[str, Sequence[float]]]:
+        self.flush()
+        return self.backend.items()
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import typing
+from threading import Lock
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+from derive.metrics.backend import Backend, encode_key
+from derive.metrics.metric.base import Metric, MetricValue, MetricVector
+
+
+class LockedValue(MetricValue):
+    def __init__(self, key: str):
+        super().__init__()
+        self.key = key
+        self._lock = Lock()
+
+    def inc(self, amount: Union[float, int]):
+        with self._lock:
+            self._value += amount
+
+    def set(self, value: Union[float, int]):
+        self._value = value
+
+
+class LockedVector(MetricVector):
+    def __init__(self, key: str, size: int):
+        super().__init__([0.0] * size)
+        self.key = key
+        self._lock = Lock()
+
+    def inc(self, updates: Iterable[Tuple[int, Union[float, int]]]):
+        with self._lock:
+            for index, amount in updates:
+                self._values[index] += amount
+
+    def set(self, values: Sequence[float]):
+        with self._lock:
+            self._values = list(values)
+
+    def get(self) -> List[float]:
+        with self._lock:
+            return list(self._values)
+
+
+class InProcessBackend(Backend):
+    """Values live in this process only, updates are plain in-memory operations.
+
+    For single-process services, child processes do not share values with their parent.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._values: Dict[str, Union[LockedValue, LockedVector]] = {}
+        self._lock = Lock()
+
+    def value(self, metric: Metric, field: str) -> MetricValue:
+        key = encode_key(metric, field)
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                value = self._values[key] = LockedValue(key)
+        return typing.cast(LockedValue, value)
+
+    def vector(self, metric: Metric, field: str, size: int) -> MetricVector:
+        key = encode_key(metric, field)
+        with self._lock:
+            vector = self._values.get(key)
+            if vector is None:
+                vector = self._values[key] = LockedVector(key, size)
+        return typing.cast(LockedVector, vector)
+
+    def remove(self, values: Iterable[Union[MetricValue, MetricVector]]) -> None:
+        with self._lock:
+            for value in values:
+                self._values.pop(getattr(value, "key"), None)
+
+    def items(self) -> List[Tuple[str, List[float]]]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            (key, value.get() if isinstance(value, LockedVector) else [value.get()])
+            for key, value in values
+        ]
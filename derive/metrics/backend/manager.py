@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import typing
+from multiprocessing.managers import BaseProxy, SyncManager
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from derive.metrics.backend import Backend, Update, decode_key, encode_key
+from derive.metrics.metric.base import PID_FIELD, Metric, MetricValue, MetricVector
+
+
+class MetricStore:
+    """All metric values of the `Manager` server process, addressed by key.
+
+    Values are shared by all processes, so a series removed by one process is exported
+    again, from zero, as soon as any process writes to it.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, List[float]] = {}
+        self._lock = Lock()
+
+    def setdefault(self, key: str, size: int = 1):
+        with self._lock:
+            self._values.setdefault(key, [0.0] * size)
+
+    def inc(self, key: str, amount: Union[float, int]):
+        with self._lock:
+            self._values.setdefault(key, [0.0])[0] += amount
+
+    def set(self, key: str, value: Union[float, int]):
+        with self._lock:
+            self._values[key] = [value]
+
+    def get(self, key: str) -> float:
+        values = self._values.get(key)
+        return values[0] if values else 0.0
+
+    def inc_vector(
+        self, key: str, size: int, updates: Iterable[Tuple[int, Union[float, int]]]
+    ):
+        with self._lock:
+            values = self._values.setdefault(key, [0.0] * size)
+            for index, amount in updates:
+                values[index] += amount
+
+    def set_vector(self, key: str, values: List[float]):
+        with self._lock:
+            self._values[key] = list(values)
+
+    def get_vector(self, key: str, size: int) -> List[float]:
+        with self._lock:
+            return list(self._values.get(key) or [0.0] * size)
+
+    def remove(self, keys: List[str]):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+
+    def apply(
+        self,
+        updates: List[Tuple[str, Optional[Union[float, List]], Union[float, List]]],
+    ):
+        with self._lock:
+            for key, set_value, delta in updates:
+                if isinstance(delta, list) and isinstance(set_value, list):
+                    self._values[key] = [s + d for s, d in zip(set_value, delta)]
+                elif isinstance(delta, list):
+                    values = self._values.setdefault(key, [0.0] * len(delta))
+                    for index, amount in enumerate(delta):
+                        values[index] += amount
+                elif set_value is not None:
+                    self._values[key] = [typing.cast(float, set_value) + delta]
+                else:
+                    self._values.setdefault(key, [0.0])[0] += delta
+
+    def items(self) -> List[Tuple[str, List[float]]]:
+        with self._lock:
+            return [(key, list(values)) for key, values in self._values.items()]
+
+
+class MetricStoreProxy(BaseProxy):
+    _exposed_ = (
+        "setdefault",
+        "inc",
+        "set",
+        "get",
+        "inc_vector",
+        "set_vector",
+        "get_vector",
+        "remove",
+        "apply",
+        "items",
+    )
+
+    def setdefault(self, key: str, size: int = 1):
+        self._callmethod("setdefault", (key, size))
+
+    def inc(self, key: str, amount: Union[float, int]):
+        self._callmethod("inc", (key, amount))
+
+    def set(self, key: str, value: Union[float, int]):
+        self._callmethod("set", (key, value))
+
+    def get(self, key: str) -> float:
+        return self._callmethod("get", (key,))  # type: ignore[func-returns-value,return-value]
+
+    def inc_vector(
+        self, key: str, size: int, updates: Iterable[Tuple[int, Union[float, int]]]
+    ):
+        self._callmethod("inc_vector", (key, size, updates))
+
+    def set_vector(self, key: str, values: List[float]):
+        self._callmethod("set_vector", (key, values))
+
+    def get_vector(self, key: str, size: int) -> List[float]:
+        return self._callmethod("get_vector", (key, size))  # type: ignore[func-returns-value,return-value]
+
+    def remove(self, keys: List[str]):
+        self._callmethod("remove", (keys,))
+
+    def apply(
+        self,
+        updates: List[Tuple[str, Optional[Union[float, List]], Union[float, List]]],
+    ):
+        self._callmethod("apply", (updates,))
+
+    def items(self) -> List[Tuple[str, List[float]]]:
+        return self._callmethod("items")  # type: ignore[func-returns-value,return-value]
+
+
+SyncManager.register("MetricStore", MetricStore, MetricStoreProxy)
+
+
+class StoreValue(MetricValue):
+    def __init__(self, store: MetricStoreProxy, key: str):
+        self._store = store
+        self.key = key
+
+    def inc(self, amount: Union[float, int]):
+        self._store.inc(self.key, amount)
+
+    def set(self, value: Union[float, int]):
+        self._store.set(self.key, value)
+
+    def get(self) -> float:
+        return self._store.get(self.key)
+
+
+class StoreVector(MetricVector):
+    def __init__(self, store: MetricStoreProxy, key: str, size: int):
+        self._store = store
+        self.key = key
+        self.size = size
+
+    def inc(self, updates: Iterable[Tuple[int, Union[float, int]]]):
+        self._store.inc_vector(self.key, self.size, updates)
+
+    def set(self, values: Sequence[float]):
+        self._store.set_vector(self.key, list(values))
+
+    def get(self) -> List[float]:
+        return self._store.get_vector(self.key, self.size)
+
+
+class ManagerBackend(Backend):
+    """Values live in one `MetricStore` of a `multiprocessing.Manager` server.
+
+    Every update is an IPC round-trip to the server process.
+    """
+
+    def __init__(self, manager: SyncManager):
+        super().__init__()
+        self.store: MetricStoreProxy = getattr(manager, "MetricStore")()
+
+    def value(self, metric: Metric, field: str) -> MetricValue:
+        key = encode_key(metric, field)
+        self.store.setdefault(key)
+        return StoreValue(self.store, key)
+
+    def vector(self, metric: Metric, field: str, size: int) -> MetricVector:
+        key = encode_key(metric, field)
+        self.store.setdefault(key, size)
+        return StoreVector(self.store, key, size)
+
+    def remove(self, values: Iterable[Union[MetricValue, MetricVector]]) -> None:
+        self.store.remove([getattr(value, "key") for value in values])
+
+    def forget(self, values: Iterable[Union[MetricValue, MetricVector]]) -> None:
+        # the values of the parent are shared with the child, not copied
+        pass
+
+    def mark_process_dead(self, pid: int) -> None:
+        # counts are shared by all processes, only gauges keep values per process
+        field = f"{PID_FIELD}{pid}"
+        self.store.remove(
+            [key for key, _ in self.store.items() if decode_key(key)[1] == field]
+        )
+
+    def apply(self, updates: Iterable[Update]) -> None:
+        self.store.apply(
+            [
+                (getattr(value, "key"), set_value, delta)
+                for value, set_value, delta in updates
+            ]
+        )
+
+    def items(self) -> List[Tuple[str, List[float]]]:
+        return self.store.items()
@@ -0,0 +1,443 @@
+from __future__ import annotations
+
+import glob
+import json
+import mmap
+import os
+import struct
+import typing
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Sequence, Set, Tuple, Union
+
+from derive.metrics.backend import (
+    SEPARATOR,
+    Backend,
+    decode_key,
+    encode_key,
+    merge_values,
+)
+from derive.metrics.metric.base import (
+    EXEMPLAR_FIELD,
+    Metric,
+    MetricValue,
+    MetricVector,
+    process_alive,
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+_used = struct.Struct("i")
+_entry = struct.Struct("ii")
+_double = struct.Struct("d")
+
+
+def _padding(key_length: int) -> int:
+    # keep the doubles that follow the key 8-byte aligned
+    return -key_length % 8
+
+
+def _entries(data) -> Iterator[Tuple[str, int, int]]:
+    """Yields `(key, size, offset)` of every entry, removed entries have a negative size.
+
+    File layout: a 4-byte used size and 4 bytes of padding, followed by entries of
+    4-byte key length, 4-byte number of doubles, padded utf-8 key and the doubles.
+    """
+    if len(data) < 8:
+        return
+    used = _used.unpack_from(data, 0)[0]
+    pos = 8
+    while pos < used:
+        key_length, size = _entry.unpack_from(data, pos)
+        pos += _entry.size
+        key = bytes(data[pos : pos + key_length]).decode("utf-8")
+        pos += key_length + _padding(key_length)
+        yield key, size, pos
+        pos += abs(size) * _double.size
+
+
+def read_file(path: str) -> Iterator[Tuple[str, Tuple[float, ...]]]:
+    """Yields `(key, values)` of every entry of a metrics file which is not removed."""
+    with open(path, "rb") as f:
+        data = f.read()
+    for key, size, pos in _entries(data):
+        if size > 0:
+            yield key, struct.unpack_from(f"{size}d", data, pos)
+
+
+class MmapedDict:
+    """A dict of doubles backed by a memory-mapped file, written by a single process.
+
+    Entries are only ever appended, and the used size is written after the entry, so other
+    processes can read the file at any time.
+    """
+
+    INITIAL_SIZE = 1024 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+        self._f = open(path, "a+b")
+        capacity = os.fstat(self._f.fileno()).st_size
+        if capacity == 0:
+            self._f.truncate(self.INITIAL_SIZE)
+            capacity = self.INITIAL_SIZE
+        self._capacity = capacity
+        self._m = mmap.mmap(self._f.fileno(), capacity)
+        self._positions: Dict[str, int] = {}
+        # offsets of removed entries by key length and number of doubles
+        self._free: Dict[Tuple[int, int], List[int]] = {}
+        self._used = _used.unpack_from(self._m, 0)[0]
+        if self._used == 0:
+            self._used = 8
+            _used.pack_into(self._m, 0, self._used)
+        else:
+            for key, size, pos in _entries(self._m):
+                if size > 0:
+                    self._positions[key] = pos
+                else:
+                    self._release(len(key.encode("utf-8")), pos, -size)
+
+    def _grow(self, size: int):
+        capacity = self._capacity
+        while capacity < size:
+            capacity *= 2
+        self._m.close()
+        self._f.truncate(capacity)
+        self._capacity = capacity
+        self._m = mmap.mmap(self._f.fileno(), capacity)
+
+    def position(self, key: str, size: int = 1) -> int:
+        """Offset of the `size` doubles of `key`, allocating zeroed ones on first use."""
+        pos = self._positions.get(key)
+        if pos is not None:
+            return pos
+        encoded = key.encode("utf-8")
+        free = self._free.get((len(encoded), size))
+        if free:
+            # entries are never moved, a removed entry of the same shape is reused in
+            # place, so rotating keys do not grow the file
+            pos = free.pop()
+            entry = self._entry_offset(len(encoded), pos)
+            self._m[entry + _entry.size : entry + _entry.size + len(encoded)] = encoded
+            self._m[pos : pos + size * _double.size] = bytes(size * _double.size)
+            _entry.pack_into(self._m, entry, len(encoded), size)
+            self._positions[key] = pos
+            return pos
+        pos = self._used + _entry.size + len(encoded) + _padding(len(encoded))
+        used = pos + size * _double.size
+        if used > self._capacity:
+            self._grow(used)
+        _entry.pack_into(self._m, self._used, len(encoded), size)
+        self._m[
+            self._used + _entry.size : self._used + _entry.size + len(encoded)
+        ] = encoded
+        self._m[pos:used] = bytes(size * _double.size)
+        self._used = used
+        _used.pack_into(self._m, 0, used)
+        self._positions[key] = pos
+        return pos
+
+    @staticmethod
+    def _entry_offset(key_length: int, pos: int) -> int:
+        return pos - _padding(key_length) - key_length - _entry.size
+
+    def _release(self, key_length: int, pos: int, size: int):
+        self._free.setdefault((key_length, size), []).append(pos)
+
+    def remove(self, key: str, size: int = 1):
+        pos = self._positions.pop(key, None)
+        if pos is not None:
+            key_length = len(key.encode("utf-8"))
+            _entry.pack_into(
+                self._m, self._entry_offset(key_length, pos), key_length, -size
+            )
+            self._release(key_length, pos, size)
+
+    def read(self, pos: int, size: int = 1) -> Tuple[float, ...]:
+        return struct.unpack_from(f"{size}d", self._m, pos)
+
+    def write(self, pos: int, value: float):
+        _double.pack_into(self._m, pos, value)
+
+    def close(self):
+        self._m.close()
+        self._f.close()
+
+
+class _Detached:
+    """Stands in for the file of removed values, whose entries may be reused by others."""
+
+    lock = Lock()
+
+    def write(self, pos: int, value: float):
+        pass
+
+
+_detached = _Detached()
+
+
+class MmapValue(MetricValue):
+    """A value of this process, updated in place in its memory-mapped file."""
+
+    size = 1
+
+    def __init__(self, file: MmapedDict, key: str):
+        self.key = key
+        self.attach(file)
+
+    def attach(self, file: MmapedDict):
+        self._file: Union[MmapedDict, _Detached] = file
+        with file.lock:
+            self._pos = file.position(self.key)
+            self._value = file.read(self._pos)[0]
+
+    def detach(self):
+        # updates of a removed value, e.g. a labeled child still held, are dropped
+        self._file = _detached
+
+    def inc(self, amount: Union[float, int]):
+        with self._file.lock:
+            self._value += amount
+            self._file.write(self._pos, self._value)
+
+    def set(self, value: Union[float, int]):
+        with self._file.lock:
+            self._value = value
+            self._file.write(self._pos, value)
+
+    def get(self) -> float:
+        return self._value
+
+
+class MmapVector(MetricVector):
+    """A vector of this process, updated in place in its memory-mapped file."""
+
+    def __init__(self, file: MmapedDict, key: str, size: int):
+        self.key = key
+        self.size = size
+        self.attach(file)
+
+    def attach(self, file: MmapedDict):
+        self._file: Union[MmapedDict, _Detached] = file
+        with file.lock:
+            self._pos = file.position(self.key, self.size)
+            self._values = list(file.read(self._pos, self.size))
+
+    def detach(self):
+        self._file = _detached
+
+    def inc(self, updates: Iterable[Tuple[int, Union[float, int]]]):
+        values = self._values
+        with self._file.lock:
+            for index, amount in updates:
+                values[index] += amount
+                self._file.write(self._pos + index * _double.size, values[index])
+
+    def set(self, values: Sequence[float]):
+        with self._file.lock:
+            self._values = list(values)
+            for index, value in enumerate(self._values):
+                self._file.write(self._pos + index * _double.size, value)
+
+    def get(self) -> List[float]:
+        return list(self._values)
+
+
+def _survives_exit(specs: Dict[str, bool], key: str) -> bool:
+    spec, field = decode_key(key)
+    if field.startswith(EXEMPLAR_FIELD):
+        field = ""
+    cached = specs.get(spec + field)
+    if cached is None:
+        _type, parameters, _ = json.loads(spec)
+        cached = specs[spec + field] = Metric._types[_type].survives_exit(
+            parameters, field
+        )
+    return cached
+
+
+class MmapBackend(Backend):
+    """Every process writes its values to its own memory-mapped file in `directory`.
+
+    Updates are plain memory writes, the files of all processes are summed up at
+    collection time (the latest exemplar is kept). The directory should be emptied before the application starts.
+
+    Files of exited processes are folded into a single archive file, with
+    `mark_process_dead` or in every forked child, so counts never go backwards and the
+    number of files stays bounded. Values of gauges are dropped with their process.
+
+    With `persistent`, the directory is kept across restarts instead: the files left by
+    the previous run are archived on start, so counters, histograms and summaries carry on
+    from their last values. Archived series are matched by type, name and labels: those of
+    a metric whose help changed carry on under the new one, those whose other parameters
+    changed, e.g. the buckets, are dropped. Dirty pages are written back by the kernel,
+    also when the process is killed.
+    """
+
+    ARCHIVE = "metrics_archive.db"
+
+    def __init__(self, directory: str, persistent: bool = False):
+        super().__init__()
+        self.directory = directory
+        self.persistent = persistent
+        self._values: Dict[str, Union[MmapValue, MmapVector]] = {}
+        # `(type, name)` of metrics whose archived series were matched
+        self._migrated: Set[Tuple[str, str]] = set()
+        if persistent:
+            # a file of this pid was left by the previous run
+            self.mark_process_dead(os.getpid())
+            self.cleanup()
+        self._file = self._open()
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"metrics_{pid}.db")
+
+    def _open(self) -> MmapedDict:
+        return MmapedDict(self._path(os.getpid()))
+
+    @contextmanager
+    def _archive_lock(self, operation: int) -> Iterator[None]:
+        # held exclusively while a file is archived, so no collection reads its values
+        # in both files
+        with open(os.path.join(self.directory, "metrics_archive.lock"), "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), operation)
+            yield
+
+    def _archive(self, path: str):
+        if not os.path.exists(path):
+            return
+        archive = MmapedDict(os.path.join(self.directory, self.ARCHIVE))
+        try:
+            specs: Dict[str, bool] = {}
+            for key, size, pos in list(_entries(archive._m)):
+                if size > 0 and not _survives_exit(specs, key):
+                    archive.remove(key, size)
+            for key, values in read_file(path):
+                if not _survives_exit(specs, key):
+                    continue
+                pos = archive.position(key, len(values))
+                total = list(archive.read(pos, len(values)))
+                merge_values(key, total, values)
+                for index, value in enumerate(total):
+                    archive.write(pos + index * _double.size, value)
+        finally:
+            archive.close()
+        os.remove(path)
+
+    def _migrate(self, metric: Metric):
+        """Move archived series of `metric` left by a previous run with another document
+        to its spec, and drop those with other parameters."""
+        self._migrated.add((metric._type, metric.name))
+        path = os.path.join(self.directory, self.ARCHIVE)
+        # parameters as they are stored in keys
+        parameters = json.loads(json.dumps(metric.parameters))
+        name = f'"name": {json.dumps(metric.name)}'
+        with self._archive_lock(getattr(fcntl, "LOCK_EX", 0)):
+            if not os.path.exists(path):
+                return
+            archive = MmapedDict(path)
+            try:
+                for key, size, pos in list(_entries(archive._m)):
+                    if size <= 0 or name not in key:
+                        continue
+                    spec, field = decode_key(key)
+                    _type, key_parameters, labels = json.loads(spec)
+                    if (
+                        _type != metric._type
+                        or key_parameters["name"] != metric.name
+                        or key_parameters == parameters
+                    ):
+                        continue
+                    values = archive.read(pos, size)
+                    archive.remove(key, size)
+                    if (
+                        dict(key_parameters, document=parameters["document"])
+                        != parameters
+                    ):
+                        continue
+                    spec = json.dumps(
+                        [_type, metric.parameters, labels], sort_keys=True
+                    )
+                    key = f"{spec}{SEPARATOR}{field}"
+                    pos = archive.position(key, size)
+                    total = list(archive.read(pos, size))
+                    merge_values(key, total, values)
+                    for index, value in enumerate(total):
+                        archive.write(pos + index * _double.size, value)
+            finally:
+                archive.close()
+
+    def mark_process_dead(self, pid: int) -> None:
+        """Fold the file of exited process `pid` into the archive file."""
+        with self._archive_lock(getattr(fcntl, "LOCK_EX", 0)):
+            self._archive(self._path(pid))
+
+    def cleanup(self) -> List[int]:
+        """Fold the files of every process which exited into the archive file, returns
+        their pids."""
+        pids = []
+        for path in glob.glob(os.path.join(self.directory, "metrics_*.db")):
+            pid = os.path.basename(path)[len("metrics_") : -len(".db")]
+            if (
+                pid.isdigit()
+                and int(pid) != os.getpid()
+                and not process_alive(int(pid))
+            ):
+                self.mark_process_dead(int(pid))
+                pids.append(int(pid))
+        return pids
+
+    def after_fork(self):
+        self._file.close()
+        # a file of this pid was left by an exited process which had the same pid
+        self.mark_process_dead(os.getpid())
+        self.cleanup()
+        self._file = self._open()
+        for value in self._values.values():
+            value.attach(self._file)
+
+    def value(self, metric: Metric, field: str) -> MetricValue:
+        key = encode_key(metric, field)
+        value = self._values.get(key)
+        if value is None:
+            if self.persistent and (metric._type, metric.name) not in self._migrated:
+                self._migrate(metric)
+            value = self._values[key] = MmapValue(self._file, key)
+        return typing.cast(MmapValue, value)
+
+    def vector(self, metric: Metric, field: str, size: int) -> MetricVector:
+        key = encode_key(metric, field)
+        vector = self._values.get(key)
+        if vector is None:
+            if self.persistent and (metric._type, metric.name) not in self._migrated:
+                self._migrate(metric)
+            vector = self._values[key] = MmapVector(self._file, key, size)
+        return typing.cast(MmapVector, vector)
+
+    def remove(self, values: Iterable[Union[MetricValue, MetricVector]]) -> None:
+        """Remove the values of this process, other processes keep exporting theirs."""
+        with self._file.lock:
+            for value in values:
+                removed = self._values.pop(getattr(value, "key"), None)
+                if removed is not None:
+                    # its entry can be reused by a new value
+                    removed.detach()
+                    self._file.remove(removed.key, removed.size)
+
+    def items(self) -> List[Tuple[str, List[float]]]:
+        totals: Dict[str, List[float]] = {}
+        with self._archive_lock(getattr(fcntl, "LOCK_SH", 0)):
+            paths = sorted(glob.glob(os.path.join(self.directory, "*.db")))
+            for path in paths:
+                for key, values in read_file(path):
+                    total = totals.get(key)
+                    if total is None:
+                        totals[key] = list(values)
+                    else:
+                        merge_values(key, total, values)
+        return list(totals.items())
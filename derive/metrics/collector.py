@@ -1,32 +1,85 @@
 from __future__ import annotations
 
-from multiprocessing import Lock
-from typing import TYPE_CHECKING, Iterator
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, List, Optional
+from weakref import WeakSet
 
 if TYPE_CHECKING:
     from derive.metrics.metric.base import Metric
 
 
+class Collector(ABC):
+    """Metrics computed at collection time, e.g. from state the application keeps anyway.
+
+    Register it with `GlobalCollector.register_collector`, and build its metrics with
+    `Metric.detached` so they stay out of the registry.
+    """
+
+    @abstractmethod
+    def collect(self) -> Iterable[Metric]:
+        pass
+
+
 class GlobalCollector(type):
+    # limit of metrics in the registry, labeled metrics past it get no new children
+    max_series: Optional[int] = None
+    # labeled metrics with a ttl, their stale children are removed before collection
+    _expiring: WeakSet = WeakSet()
+    # collectors of this process, called after the metrics of the backend are collected
+    _collectors: List[Collector] = []
+    _collectors_lock = Lock()
+
     def __init__(cls, *args, **kwargs):
         super().__init__(*args, **kwargs)
         cls._lock = Lock()
 
     def __call__(cls, *args, **kwargs):
-        from derive.metrics.manager import metrics_mapping, manager
+        from derive.metrics.manager import get_backend
 
+        backend = get_backend()
+        metrics_mapping = backend.metrics_mapping
         m: Metric = super().__call__(*args, **kwargs)
         with cls._lock:
             if m.identity in metrics_mapping:
                 return metrics_mapping[m.identity]
             else:
-                m.init(manager)
+                m.init(backend)
                 metrics_mapping[m.identity] = m
                 return metrics_mapping[m.identity]
 
+    @classmethod
+    def unregister(mcs, metric: Metric) -> None:
+        """Remove `metric` from the registry and stop exporting its values."""
+        from derive.metrics.manager import get_backend
+
+        backend = get_backend()
+        with type(metric)._lock:  # type: ignore[attr-defined]
+            if backend.metrics_mapping.pop(metric.identity, None) is not None:
+                backend.remove(metric.values())
+
+    @classmethod
+    def register_collector(mcs, collector: Collector) -> None:
+        with mcs._collectors_lock:
+            mcs._collectors = [*mcs._collectors, collector]
+
+    @classmethod
+    def unregister_collector(mcs, collector: Collector) -> None:
+        with mcs._collectors_lock:
+            mcs._collectors = [c for c in mcs._collectors if c is not collector]
+
+    @classmethod
+    def track_expiry(mcs, family: Any) -> None:
+        """Call `family.expire()` before every collection."""
+        mcs._expiring.add(family)
+
     @classmethod
     def collect(mcs) -> Iterator[Metric]:
         """Yields metrics from the collectors in the registry."""
-        from derive.metrics.manager import metrics_mapping
+        from derive.metrics.manager import get_backend
 
-        yield from metrics_mapping.values()
+        for family in list(mcs._expiring):
+            family.expire()
+        yield from get_backend().collect()
+        for collector in mcs._collectors:
+            yield from collector.collect()
@@ -1,7 +1,19 @@
-from derive.metrics.collector import GlobalCollector
+from __future__ import annotations
+
 import typing
+import weakref
+from typing import Collection, Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+from derive.metrics.metric.base import Exemplar, Metric, Sample, float_to_string
+from derive.metrics.snapshot import Entry, Snapshot
+
+if typing.TYPE_CHECKING:
+    from derive.metrics.view import Views
 
 CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+CONTENT_TYPE_OPENMETRICS = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+CHUNK_SIZE = 64 * 1024
 
 
 class Exporter:
@@ -9,12 +21,172 @@ class Exporter:
     def generate_latest(cls) -> str:
         pass
 
+    @classmethod
+    def stream(
+        cls,
+        chunk_size: int = CHUNK_SIZE,
+        names: Optional[Collection[str]] = None,
+        snapshot: Optional[Snapshot] = None,
+    ) -> Iterator[bytes]:
+        """Yields the encoded exposition in chunks of about `chunk_size` bytes."""
+        yield cls.generate_latest().encode("utf-8")
+
+    @classmethod
+    def write(
+        cls,
+        fp: typing.Any,
+        chunk_size: int = CHUNK_SIZE,
+        names: Optional[Collection[str]] = None,
+        snapshot: Optional[Snapshot] = None,
+    ) -> None:
+        """Write the exposition to a binary file object or a connected socket."""
+        send = fp.sendall if hasattr(fp, "sendall") else fp.write
+        for chunk in cls.stream(chunk_size, names, snapshot):
+            send(chunk)
+
 
 class PrometheusExporter(Exporter):
+    content_type = CONTENT_TYPE_LATEST
+    footer = b""
+    # whether samples are followed by their exemplar
+    exemplars = False
+    # aggregation of series applied to every snapshot before rendering
+    views: Optional[Views] = None
+    # rendered `# HELP`/`# TYPE` lines, `name{labels} ` prefix and name of every sample,
+    # collected metrics are reused between collections so only values are formatted
+    _rendered: weakref.WeakKeyDictionary[
+        Metric, Tuple[bytes, List[bytes], FrozenSet[str]]
+    ] = weakref.WeakKeyDictionary()
+
     @classmethod
-    def generate_latest(cls) -> str:
-        output: typing.List[str] = []
-        for metric in GlobalCollector.collect():
-            output.extend(metric.export())
+    def header(cls, metric: Metric) -> str:
+        return f"{metric.help()}\n{metric.type()}\n"
+
+    @classmethod
+    def _render(
+        cls, metric: Metric, samples: List[Sample]
+    ) -> Tuple[bytes, List[bytes], FrozenSet[str]]:
+        prefixes = [
+            sample.data().rpartition(" ")[0].encode("utf-8") + b" "
+            for sample in samples
+        ]
+        names = frozenset([metric.name, *(sample.name for sample in samples)])
+        return cls.header(metric).encode("utf-8"), prefixes, names
+
+    @classmethod
+    def _lines(
+        cls,
+        metric: Metric,
+        values: List[float],
+        samples: Optional[List[Sample]],
+        names: Optional[Collection[str]],
+        exemplars: Optional[Dict[int, Exemplar]] = None,
+    ) -> Optional[Tuple[bytes, List[bytes]]]:
+        """The header and sample lines of `metric`, None if `names` filters it out."""
+        rendered = cls._rendered.get(metric) if samples is None else None
+        if rendered is None or len(rendered[1]) != len(values):
+            # only names and labels of the samples are rendered, values are the snapshot's
+            rendered = cls._render(
+                metric, samples if samples is not None else list(metric.samples())
+            )
+            if metric.fixed_samples:
+                cls._rendered[metric] = rendered
+        header, prefixes, sample_names = rendered
+        if names is not None and sample_names.isdisjoint(names):
+            return None
+        lines = [
+            b"%s%s\n" % (prefix, float_to_string(value).encode("ascii"))
+            for prefix, value in zip(prefixes, values)
+        ]
+        if exemplars and cls.exemplars:
+            for index, exemplar in exemplars.items():
+                if index < len(lines):
+                    lines[index] = b"%s # %s\n" % (
+                        lines[index][:-1],
+                        exemplar.data().encode("utf-8"),
+                    )
+        return header, lines
+
+    @classmethod
+    def families(
+        cls,
+        names: Optional[Collection[str]] = None,
+        snapshot: Optional[Snapshot] = None,
+    ) -> Iterator[Tuple[str, bytes]]:
+        """Yields `(name, block)` of every metric family, the block holds the `# HELP` and
+        `# TYPE` lines once and the samples of every series of the family.
+
+        With `names`, only metrics with a matching metric or sample name are exported.
+        Values are rendered from `snapshot`, or from a snapshot taken now, aggregated by
+        the `views` of the exporter.
+        """
+        if snapshot is None:
+            snapshot = Snapshot.take()
+        if cls.views is not None:
+            snapshot = cls.views.apply(snapshot)
+        families: Dict[str, List[Entry]] = {}
+        for entry in snapshot:
+            families.setdefault(entry[0].name, []).append(entry)
+        for name, entries in families.items():
+            block: List[bytes] = []
+            for metric, values, samples, exemplars in entries:
+                lines = cls._lines(metric, values, samples, names, exemplars)
+                if lines is not None:
+                    if not block:
+                        block.append(lines[0])
+                    block.extend(lines[1])
+            if block:
+                yield name, b"".join(block)
+
+    @classmethod
+    def stream(
+        cls,
+        chunk_size: int = CHUNK_SIZE,
+        names: Optional[Collection[str]] = None,
+        snapshot: Optional[Snapshot] = None,
+    ) -> Iterator[bytes]:
+        """Yields the encoded exposition in chunks of about `chunk_size` bytes.
+
+        With `names`, only metrics with a matching metric or sample name are exported.
+        """
+        chunk: List[bytes] = []
+        size = 0
+        for _, block in cls.families(names, snapshot):
+            chunk.append(block)
+            size += len(block)
+            if size >= chunk_size:
+                yield b"".join(chunk)
+                chunk, size = [], 0
+        if cls.footer:
+            chunk.append(cls.footer)
+        if chunk:
+            yield b"".join(chunk)
 
-        return "\n".join(output)
+    @classmethod
+    def generate_latest(
+        cls,
+        names: Optional[Collection[str]] = None,
+        snapshot: Optional[Snapshot] = None,
+    ) -> str:
+        return b"".join(cls.stream(names=names, snapshot=snapshot)).decode("utf-8")
+
+
+class OpenMetricsExporter(PrometheusExporter):
+    """The OpenMetrics text format, counters are typed by their name without `_total`,
+    and counters and histogram buckets carry their exemplar."""
+
+    content_type = CONTENT_TYPE_OPENMETRICS
+    footer = b"# EOF\n"
+    exemplars = True
+    _rendered: weakref.WeakKeyDictionary[
+        Metric, Tuple[bytes, List[bytes], FrozenSet[str]]
+    ] = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def header(cls, metric: Metric) -> str:
+        if metric._type != "counter":
+            return super().header(metric)
+        return (
+            f"# HELP {metric.name} {metric.document}\n"
+            f"# TYPE {metric.name} counter\n"
+        )
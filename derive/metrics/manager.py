@@ -1,19 +1,151 @@
 from __future__ import annotations
 
+import os
 import sys
 from multiprocessing import Manager, process, set_start_method
 from multiprocessing.managers import SyncManager
-from typing import MutableMapping
+from threading import RLock
+from typing import TYPE_CHECKING, Any, Optional, Tuple
 
 import derive
-from derive.metrics.metric.base import Metric, MetricValue, MetricValueProxy
+from derive.metrics.backend import Backend
+from derive.metrics.collector import GlobalCollector
+from derive.metrics.metric.base import MetricValue, MetricValueProxy
+
+if TYPE_CHECKING:
+    from derive.config import DefaultConfig
 
 if sys.platform == "darwin":
     set_start_method("fork", force=True)
 
 SyncManager.register("MetricValue", MetricValue, MetricValueProxy)
-manager = Manager()
-metrics_mapping: MutableMapping[str, Metric] = manager.dict()
+
+BACKENDS = ("inprocess", "mmap", "manager")
+
+# the `Manager` server process and the default backend are only started on first use
+_lock = RLock()
+_manager: Optional[SyncManager] = None
+_backend: Optional[Backend] = None
+_backend_options: Optional[Tuple[str, str, float, bool]] = None
+
+
+def get_manager() -> SyncManager:
+    """The `multiprocessing.Manager` of metrics, started on the first call."""
+    global _manager
+    with _lock:
+        if _manager is None:
+            _manager = Manager()
+        return _manager
+
+
+def create_backend(
+    kind: str, directory: str = "", buffer_interval: float = 0, persistent: bool = False
+) -> Backend:
+    """A backend by name: `inprocess` for a single process, `mmap` for memory-mapped files
+    of every process in `directory`, or `manager` for a `multiprocessing.Manager` server.
+    Updates are batched every `buffer_interval` seconds when it is not zero. With
+    `persistent`, values of the `mmap` backend are kept across restarts."""
+    backend: Backend
+    if persistent and kind != "mmap":
+        raise ValueError("Only the mmap backend can be persistent")
+    if kind == "inprocess":
+        from derive.metrics.backend.inprocess import InProcessBackend
+
+        backend = InProcessBackend()
+    elif kind == "mmap":
+        from derive.metrics.backend.multiprocess import MmapBackend
+
+        if not directory:
+            raise ValueError("The mmap backend needs a directory")
+        backend = MmapBackend(directory, persistent)
+    elif kind == "manager":
+        from derive.metrics.backend.manager import ManagerBackend
+
+        backend = ManagerBackend(get_manager())
+    else:
+        raise ValueError(
+            f"Unknown metrics backend {kind!r}, expected one of {BACKENDS}"
+        )
+    if buffer_interval:
+        from derive.metrics.backend.buffered import BufferedBackend
+
+        backend = BufferedBackend(backend, buffer_interval)
+    return backend
+
+
+def get_backend() -> Backend:
+    """The backend of metrics, created on first use from the `DERIVE_METRICS_BACKEND`,
+    `DERIVE_METRICS_DIRECTORY` and `DERIVE_METRICS_PERSISTENT` environment variables (a
+    `Manager` by default)."""
+    global _backend_options
+    backend = _backend
+    if backend is None:
+        with _lock:
+            if _backend is None:
+                options = (
+                    os.environ.get("DERIVE_METRICS_BACKEND", "manager"),
+                    os.environ.get("DERIVE_METRICS_DIRECTORY", ""),
+                    0.0,
+                    os.environ.get("DERIVE_METRICS_PERSISTENT", "").lower()
+                    in ("1", "true", "yes"),
+                )
+                set_backend(create_backend(*options))
+                _backend_options = options
+            backend = _backend
+    return backend  # type: ignore[return-value]
+
+
+def set_backend(value: Backend, migrate: bool = False) -> None:
+    """Store the values of metrics created from now on in `value`,
+    e.g. `set_backend(MmapBackend("/tmp/metrics"))` for per-process memory-mapped files.
+    Should be called before any metric is created.
+
+    With `migrate`, metrics already created are moved to `value` and start over from zero."""
+    global _backend, _backend_options
+    with _lock:
+        previous, _backend = _backend, value
+        _backend_options = None
+        if migrate and previous is not None and previous is not value:
+            for metric in previous.metrics_mapping.values():
+                metric.init(value)
+            value.metrics_mapping.update(previous.metrics_mapping)
+
+
+def configure(config: DefaultConfig) -> None:
+    """Select the backend of `config.METRICS_BACKEND`, unless it is empty.
+    Metrics created before, e.g. at import time, are moved to it."""
+    if config.METRICS_MAX_SERIES:
+        GlobalCollector.max_series = config.METRICS_MAX_SERIES
+    if not config.METRICS_BACKEND:
+        return
+    options = (
+        config.METRICS_BACKEND,
+        config.METRICS_DIRECTORY,
+        float(config.METRICS_BUFFER_INTERVAL),
+        bool(config.METRICS_PERSISTENT),
+    )
+    global _backend_options
+    with _lock:
+        if options != _backend_options:
+            set_backend(create_backend(*options), migrate=True)
+            _backend_options = options
+
+
+def mark_process_dead(pid: int) -> None:
+    """Archive or drop the values of exited process `pid`, to be called from the worker
+    exit callback of a pre-fork server, e.g. `child_exit` of gunicorn."""
+    get_backend().mark_process_dead(pid)
+
+
+def __getattr__(name: str) -> Any:
+    # `manager` and `metrics_mapping` used to be created at import
+    if name == "manager":
+        return get_manager()
+    if name == "metrics_mapping":
+        return get_backend().metrics_mapping
+    if name == "backend":
+        return get_backend()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def _reset_children():
@@ -22,4 +154,12 @@ def _reset_children():
     process._children = set()
 
 
+def _after_fork():
+    if _backend is not None:
+        _backend.after_fork()
+        for metric in list(_backend.metrics_mapping.values()):
+            metric.after_fork()
+
+
 derive.register_after_fork(_reset_children)
+derive.register_after_fork(_after_fork)
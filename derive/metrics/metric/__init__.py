@@ -1,8 +1,9 @@
 import typing
-from typing import overload, Set, Optional, Tuple
+from typing import overload, Set, Optional, Sequence, Tuple
 
 from derive.metrics.metric import base
 from derive.metrics.metric import label
+from derive.metrics.metric.meter import Meter
 
 
 class Counter:
@@ -38,16 +39,34 @@ class Counter:
     """
 
     @overload
-    def __new__(cls, name: str, document: str, labels: Set[str]) -> label.Counter:  # type: ignore[misc]
+    def __new__(  # type: ignore[misc]
+        cls,
+        name: str,
+        document: str,
+        labels: Set[str],
+        *,
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+    ) -> label.Counter:
         ...
 
     @overload
     def __new__(cls, name: str, document: str) -> base.Counter:  # type: ignore[misc]
         ...
 
-    def __new__(cls, name: str, document: str, labels: Optional[Set[str]] = None):
+    def __new__(
+        cls,
+        name: str,
+        document: str,
+        labels: Optional[Set[str]] = None,
+        *,
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+    ):
         if labels:
-            return label.Counter(name, document, labels)
+            return label.Counter(name, document, labels, max_series, on_limit, ttl)
         else:
             return base.Counter(name, document)
 
@@ -82,21 +101,77 @@ class Summary:
 
         with REQUEST_TIME.time():
             pass  # Logic to be timed
+
+    Quantiles are estimated over the last `max_age_seconds`, within `relative_accuracy`
+    of the values between `min_value` and `max_value`:
+
+        s = Summary('response_latency_seconds', 'Response latency', quantiles=(0.5, 0.99))
     """
 
     @overload
-    def __new__(cls, name: str, document: str, labels: Set[str]) -> label.Summary:  # type: ignore[misc]
+    def __new__(  # type: ignore[misc]
+        cls,
+        name: str,
+        document: str,
+        labels: Set[str],
+        *,
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        quantiles: Sequence[float] = (),
+        max_age_seconds: float = 600,
+        age_buckets: int = 5,
+        relative_accuracy: float = 0.01,
+        min_value: float = 1e-6,
+        max_value: float = 1e4,
+    ) -> label.Summary:
         ...
 
     @overload
-    def __new__(cls, name: str, document: str) -> base.Summary:  # type: ignore[misc]
+    def __new__(  # type: ignore[misc]
+        cls,
+        name: str,
+        document: str,
+        *,
+        quantiles: Sequence[float] = (),
+        max_age_seconds: float = 600,
+        age_buckets: int = 5,
+        relative_accuracy: float = 0.01,
+        min_value: float = 1e-6,
+        max_value: float = 1e4,
+    ) -> base.Summary:
         ...
 
-    def __new__(cls, name: str, document: str, labels: Optional[Set[str]] = None):
+    def __new__(
+        cls,
+        name: str,
+        document: str,
+        labels: Optional[Set[str]] = None,
+        *,
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        quantiles: Sequence[float] = (),
+        max_age_seconds: float = 600,
+        age_buckets: int = 5,
+        relative_accuracy: float = 0.01,
+        min_value: float = 1e-6,
+        max_value: float = 1e4,
+    ):
+        options: typing.Dict[str, typing.Any] = dict(
+            quantiles=quantiles,
+            max_age_seconds=max_age_seconds,
+            age_buckets=age_buckets,
+            relative_accuracy=relative_accuracy,
+            min_value=min_value,
+            max_value=max_value,
+        )
         if labels:
-            return label.Summary(name, document, labels)
+            return label.Summary(
+                name, document, labels, max_series, on_limit, ttl, **options
+            )
         else:
-            return base.Summary(name, document)
+            return base.Summary(name, document, **options)
 
 
 class Gauge:
@@ -128,21 +203,63 @@ class Gauge:
 
         with g.track_inprogress():
             pass
+
+    With a `multiprocess_mode`, every process keeps its own value and they are combined
+    at collection with `sum`, `max`, `min` or `mostrecent`. `livesum`, `livemax`,
+    `livemin` and `livemostrecent` leave out processes which exited. Without one,
+    processes of the `manager` backend write to the same value, while every process of
+    the `mmap` backend writes to its own file and the values are summed like `sum`.
+
+        g = Gauge('inprogress_requests', 'Requests in progress', multiprocess_mode='livesum')
     """
 
     @overload
-    def __new__(cls, name: str, document: str, labels: Set[str]) -> label.Gauge:  # type: ignore[misc]
+    def __new__(  # type: ignore[misc]
+        cls,
+        name: str,
+        document: str,
+        labels: Set[str],
+        *,
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        multiprocess_mode: Optional[str] = None,
+    ) -> label.Gauge:
         ...
 
     @overload
-    def __new__(cls, name: str, document: str) -> base.Gauge:  # type: ignore[misc]
+    def __new__(  # type: ignore[misc]
+        cls,
+        name: str,
+        document: str,
+        *,
+        multiprocess_mode: Optional[str] = None,
+    ) -> base.Gauge:
         ...
 
-    def __new__(cls, name: str, document: str, labels: Optional[Set[str]] = None):
+    def __new__(
+        cls,
+        name: str,
+        document: str,
+        labels: Optional[Set[str]] = None,
+        *,
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        multiprocess_mode: Optional[str] = None,
+    ):
         if labels:
-            return label.Gauge(name, document, labels)
+            return label.Gauge(
+                name,
+                document,
+                labels,
+                max_series,
+                on_limit,
+                ttl,
+                multiprocess_mode=multiprocess_mode,
+            )
         else:
-            return base.Gauge(name, document)
+            return base.Gauge(name, document, multiprocess_mode=multiprocess_mode)
 
 
 class Histogram:
@@ -170,7 +287,10 @@ class Histogram:
         document: str,
         labels: Set[str],
         *,
-        buckets: Tuple[float, ...] = base.Histogram.DEFAULT_BUCKETS
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        buckets: Tuple[float, ...] = base.Histogram.DEFAULT_BUCKETS,
     ) -> label.Histogram:
         ...
 
@@ -180,7 +300,7 @@ class Histogram:
         name: str,
         document: str,
         *,
-        buckets: Tuple[float, ...] = base.Histogram.DEFAULT_BUCKETS
+        buckets: Tuple[float, ...] = base.Histogram.DEFAULT_BUCKETS,
     ) -> base.Histogram:
         ...
 
@@ -190,9 +310,88 @@ class Histogram:
         document: str,
         labels: Optional[Set[str]] = None,
         *,
-        buckets: Tuple[float, ...] = base.Histogram.DEFAULT_BUCKETS
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        buckets: Tuple[float, ...] = base.Histogram.DEFAULT_BUCKETS,
     ):
         if labels:
-            return label.Histogram(name, document, labels, buckets=buckets)
+            return label.Histogram(
+                name, document, labels, max_series, on_limit, ttl, buckets=buckets
+            )
         else:
             return base.Histogram(name, document, buckets=buckets)
+
+
+class ExponentialHistogram:
+    """
+    A sparse histogram of exponential buckets, with the resolution of Prometheus native
+    histograms: with `schema` n, every bucket is `2 ** (2 ** -n)` times wider than the
+    previous one. Only touched buckets are stored, and the schema is lowered when there are
+    more than `max_buckets` of them.
+
+        from derive.metrics import ExponentialHistogram
+
+        h = ExponentialHistogram('response_latency_seconds', 'Response latency', schema=3)
+        h.observe(0.25)
+
+    The touched buckets are exported as classic buckets, or summed into the given
+    `buckets` for scrapers expecting stable bucket boundaries.
+    """
+
+    @overload
+    def __new__(  # type: ignore[misc]
+        cls,
+        name: str,
+        document: str,
+        labels: Set[str],
+        *,
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        schema: int = 3,
+        max_buckets: int = 160,
+        zero_threshold: float = 0.0,
+        buckets: Optional[Sequence[float]] = None,
+    ) -> label.ExponentialHistogram:
+        ...
+
+    @overload
+    def __new__(  # type: ignore[misc]
+        cls,
+        name: str,
+        document: str,
+        *,
+        schema: int = 3,
+        max_buckets: int = 160,
+        zero_threshold: float = 0.0,
+        buckets: Optional[Sequence[float]] = None,
+    ) -> base.ExponentialHistogram:
+        ...
+
+    def __new__(
+        cls,
+        name: str,
+        document: str,
+        labels: Optional[Set[str]] = None,
+        *,
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        schema: int = 3,
+        max_buckets: int = 160,
+        zero_threshold: float = 0.0,
+        buckets: Optional[Sequence[float]] = None,
+    ):
+        options: typing.Dict[str, typing.Any] = dict(
+            schema=schema,
+            max_buckets=max_buckets,
+            zero_threshold=zero_threshold,
+            buckets=buckets,
+        )
+        if labels:
+            return label.ExponentialHistogram(
+                name, document, labels, max_series, on_limit, ttl, **options
+            )
+        else:
+            return base.ExponentialHistogram(name, document, **options)
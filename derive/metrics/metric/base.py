@@ -1,18 +1,63 @@
 from __future__ import annotations
 
+import itertools
 import math
+import os
+import threading
+import time
 import typing
+from bisect import bisect_left
 from dataclasses import dataclass
-from multiprocessing.managers import BaseProxy, SyncManager
-from typing import Union, Iterable, Mapping, Optional, Sequence
-
-from derive.metrics.collector import GlobalCollector
+from time import monotonic
+from multiprocessing.managers import BaseProxy
+from typing import (
+    Callable,
+    Union,
+    Iterable,
+    Mapping,
+    Optional,
+    Sequence,
+    Dict,
+    Type,
+    List,
+    Tuple,
+)
+
+from derive.metrics.collector import Collector, GlobalCollector
 from derive.metrics.context_manger import InprogressTracker, Timer, ExceptionCounter
+from derive.metrics.metric.sketch import DDSketch
+from derive.trace import trace
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # type: ignore[assignment]
+
+if typing.TYPE_CHECKING:
+    from derive.metrics.backend import Backend
 
 INF = float("inf")
 MINUS_INF = float("-inf")
 NaN = float("NaN")
 
+# exemplars are stored as vectors of `[value, timestamp, *trace_id]` in fields named
+# `exemplar/{sample index}`, the trace id split into 32-bit parts
+EXEMPLAR_FIELD = "exemplar/"
+EXEMPLAR_SIZE = 6
+
+# gauges with a multiprocess mode store the value of every process in `pid/{pid}`
+PID_FIELD = "pid/"
+MULTIPROCESS_MODES = (
+    "sum",
+    "max",
+    "min",
+    "mostrecent",
+    "livesum",
+    "livemax",
+    "livemin",
+    "livemostrecent",
+)
+
 
 def float_to_string(d: float) -> str:
     d = float(d)
@@ -49,6 +94,25 @@ class MetricValue:
     value = property(get, set)
 
 
+class MetricVector:
+    """A fixed-size array of values, updated and read as a whole."""
+
+    def __init__(self, values: Sequence[float]):
+        self._values = list(values)
+
+    def inc(self, updates: Iterable[Tuple[int, Union[float, int]]]):
+        """Increment `values[index]` by `amount` for every `(index, amount)` at once."""
+        for index, amount in updates:
+            self._values[index] += amount
+
+    def set(self, values: Sequence[float]):
+        """Replace all values at once."""
+        self._values = list(values)
+
+    def get(self) -> List[float]:
+        return list(self._values)
+
+
 class MetricValueProxy(BaseProxy):
     _exposed_ = ("get", "set", "inc")
 
@@ -64,6 +128,36 @@ class MetricValueProxy(BaseProxy):
     value = property(get, set)
 
 
+@dataclass
+class Exemplar:
+    trace_id: str
+    value: float
+    timestamp: float
+
+    @classmethod
+    def encode(cls, value: float, trace_id: int) -> List[float]:
+        return [
+            value,
+            time.time(),
+            *(float(trace_id >> shift & 0xFFFFFFFF) for shift in (96, 64, 32, 0)),
+        ]
+
+    @classmethod
+    def decode(cls, values: Sequence[float]) -> Optional[Exemplar]:
+        if not values[1]:
+            return None
+        trace_id = 0
+        for part in values[2:]:
+            trace_id = trace_id << 32 | int(part)
+        return cls(format(trace_id, "032x"), values[0], values[1])
+
+    def data(self) -> str:
+        return (
+            f'{{trace_id="{self.trace_id}"}} '
+            f"{float_to_string(self.value)} {self.timestamp:.3f}"
+        )
+
+
 @dataclass
 class Sample:
     name: str
@@ -82,6 +176,19 @@ class Sample:
 
 class Metric(metaclass=GlobalCollector):
     _type: str
+    _types: Dict[str, Type[Metric]] = {}
+    # names and labels of `samples()` are the same at every collection
+    fixed_samples = True
+    # seconds between exemplars of a sample, None when the metric records none
+    exemplar_interval: Optional[float] = None
+    _backend: Backend
+    _exemplars: Dict[int, MetricVector]
+    _exemplar_due: List[float]
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "_type" in cls.__dict__:
+            Metric._types[cls._type] = cls
 
     def __init__(
         self,
@@ -90,6 +197,7 @@ class Metric(metaclass=GlobalCollector):
         labels: Optional[Mapping[str, str]] = None,
     ):
         self.name = name
+        self.parameters: Dict[str, typing.Any] = dict(name=name, document=document)
         if labels:
             self.identity = self.name + "{{{0}}}".format(
                 ",".join([f'{k}="{v}"' for k, v in sorted(labels.items())])
@@ -109,25 +217,109 @@ class Metric(metaclass=GlobalCollector):
     def samples(self) -> Iterable[Sample]:
         yield from []
 
+    def sample_values(self) -> List[float]:
+        """Values of `samples()` in the same order, without building the samples."""
+        return [sample.value for sample in self.samples()]
+
+    def sample_exemplars(self) -> Dict[int, Exemplar]:
+        """Latest exemplars of `samples()` by index."""
+        if self.exemplar_interval is None:
+            return {}
+        exemplars = {}
+        for field in self._backend.fields(self):
+            if field.startswith(EXEMPLAR_FIELD):
+                values = self._backend.vector(self, field, EXEMPLAR_SIZE).get()
+                exemplar = Exemplar.decode(values)
+                if exemplar is not None:
+                    exemplars[int(field[len(EXEMPLAR_FIELD) :])] = exemplar
+        return exemplars
+
+    def _init_exemplars(self, backend: Backend, size: int):
+        self._backend = backend
+        self._exemplars = {}
+        # monotonic time from which the next exemplar of every sample is recorded
+        due = 0.0 if self.exemplar_interval is not None else INF
+        self._exemplar_due = [due] * size
+
+    def _record_exemplar(self, index: int, value: float):
+        """Record `value` with the trace id of the current span, if there is one.
+
+        Without a span the next attempt is also delayed, so updates outside of traces
+        look up the current span at most once per interval.
+        """
+        self._exemplar_due[index] = time.monotonic() + typing.cast(
+            float, self.exemplar_interval
+        )
+        context = trace.get_current_span_context()
+        if context is None or not context.is_valid:
+            return
+        vector = self._exemplars.get(index)
+        if vector is None:
+            vector = self._exemplars[index] = self._backend.vector(
+                self, f"{EXEMPLAR_FIELD}{index}", EXEMPLAR_SIZE
+            )
+        vector.set(Exemplar.encode(value, context.trace_id))
+
     def export(self) -> Iterable[str]:
         yield self.help()
         yield self.type()
         for sample in self.samples():
             yield sample.data()
 
-    def init(self, m: SyncManager):
+    def init(self, backend: Backend):
         pass
 
+    def values(self) -> Iterable[Union[MetricValue, MetricVector]]:
+        """Values created by `init`."""
+        return ()
+
+    def after_fork(self):
+        """Called in the child process after a fork, once the backend is re-attached."""
+
+    @classmethod
+    def detached(cls, *args, **kwargs) -> Metric:
+        """A metric outside of the registry with in-memory values, for a `Collector`."""
+        from derive.metrics.backend import FrozenBackend
+
+        metric = cls.__new__(cls)
+        metric.__init__(*args, **kwargs)  # type: ignore[misc]
+        metric.init(FrozenBackend({}))
+        return metric
+
+    @classmethod
+    def restore(
+        cls,
+        _type: str,
+        parameters: Mapping[str, typing.Any],
+        labels: Mapping[str, str],
+        backend: Backend,
+    ) -> Metric:
+        """Rebuild a metric outside of the registry, reading values from `backend`."""
+        metric_cls = cls._types[_type]
+        metric = metric_cls.__new__(metric_cls)
+        metric.__init__(labels=labels, **parameters)  # type: ignore[misc]
+        metric.init(backend)
+        return metric
+
+    @classmethod
+    def survives_exit(cls, parameters: Mapping[str, typing.Any], field: str) -> bool:
+        """Whether the value of `field` is still exported once the process which wrote it
+        exited, e.g. counts are while the value of a gauge is not."""
+        return True
+
 
 class Counter(Metric):
     _type = "counter"
     _count: MetricValue
+    exemplar_interval: Optional[float] = 1.0
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     def inc(self, mount: Union[float, int] = 1):
         self._count.inc(mount)
+        if monotonic() >= self._exemplar_due[0]:
+            self._record_exemplar(0, mount)
 
     def help(self) -> str:
         return f"# HELP {self.name}_total {self.document}"
@@ -140,6 +332,9 @@ class Counter(Metric):
             name=f"{self.name}_total", labels=self._labels, value=self._count.get()
         )
 
+    def sample_values(self) -> List[float]:
+        return [self._count.get()]
+
     def count_exceptions(self, exception=Exception):
         """Count exceptions in a block of code or function.
 
@@ -149,12 +344,75 @@ class Counter(Metric):
         """
         return ExceptionCounter(self, exception)
 
-    def init(self, m: SyncManager):
-        self._count = getattr(m, "MetricValue")()
+    def init(self, backend: Backend):
+        self._count = backend.value(self, "count")
+        self._init_exemplars(backend, 1)
+
+    def values(self) -> Iterable[Union[MetricValue, MetricVector]]:
+        return (self._count, *self._exemplars.values())
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def process_values(
+    fields: Mapping[str, Sequence[float]], live: bool = False
+) -> List[Sequence[float]]:
+    """Values of the `pid/{pid}` fields, of running processes only when `live`."""
+    return [
+        value
+        for field, value in fields.items()
+        if field.startswith(PID_FIELD)
+        and (not live or process_alive(int(field[len(PID_FIELD) :])))
+    ]
+
+
+class _MostRecentValue(MetricValue):
+    """A value stored as `[value, timestamp]`, the timestamp of its last update."""
+
+    def __init__(self, vector: MetricVector):
+        self._vector = vector
+        self._lock = threading.Lock()
+
+    def inc(self, amount: Union[float, int]):
+        with self._lock:
+            self._vector.set([self._vector.get()[0] + amount, time.time()])
+
+    def set(self, value: Union[float, int]):
+        self._vector.set([value, time.time()])
+
+    def get(self) -> float:
+        return self._vector.get()[0]
 
 
 class Gauge(Counter):
+    """With a `multiprocess_mode`, every process keeps its own value and they are combined
+    at collection: `sum`, `max`, `min` or `mostrecent` (the value set last). The `live`
+    variants, e.g. `livesum`, leave out the values of processes which exited.
+    """
+
     _type = "gauge"
+    exemplar_interval = None
+    _function_collector: Optional[FunctionCollector] = None
+    _stored: Union[MetricValue, MetricVector]
+
+    def __init__(self, *args, multiprocess_mode: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if multiprocess_mode is not None:
+            if multiprocess_mode not in MULTIPROCESS_MODES:
+                raise ValueError(
+                    f"Unknown multiprocess mode {multiprocess_mode!r}, "
+                    f"expected one of {MULTIPROCESS_MODES}"
+                )
+            self.parameters.update(multiprocess_mode=multiprocess_mode)
+        self._mode = multiprocess_mode
 
     def dec(self, amount: Union[float, int] = 1):
         """Decrement gauge by the given amount."""
@@ -173,6 +431,18 @@ class Gauge(Counter):
         """
         return InprogressTracker(self)
 
+    def set_function(self, f: Callable[[], float]) -> None:
+        """Export the result of `f()` at collection time instead of a stored value.
+
+        Only the process which collects metrics calls `f`, so it should read state which
+        that process can see.
+        """
+        GlobalCollector.unregister(self)
+        if self._function_collector is not None:
+            GlobalCollector.unregister_collector(self._function_collector)
+        self._function_collector = FunctionCollector(self, f)
+        GlobalCollector.register_collector(self._function_collector)
+
     def time(self):
         """Time a block of code or function, and set the duration in seconds.
 
@@ -187,7 +457,76 @@ class Gauge(Counter):
         return f"# TYPE {self.name} {self._type}"
 
     def samples(self) -> Iterable[Sample]:
-        yield Sample(name=self.name, labels=self._labels, value=self._count.get())
+        yield Sample(name=self.name, labels=self._labels, value=self.sample_values()[0])
+
+    def sample_values(self) -> List[float]:
+        if self._mode is None:
+            return [self._count.get()]
+        mode = self._mode
+        live = mode.startswith("live")
+        if live:
+            mode = mode[4:]
+        values = process_values(
+            self._backend.field_values(self), live and self._backend.local
+        )
+        if not values:
+            return [0.0]
+        if mode == "sum":
+            return [math.fsum(value[0] for value in values)]
+        elif mode == "max":
+            return [max(value[0] for value in values)]
+        elif mode == "min":
+            return [min(value[0] for value in values)]
+        # the value with the latest timestamp
+        return [max(values, key=lambda value: value[1])[0]]
+
+    def _bind(self):
+        field = f"{PID_FIELD}{os.getpid()}"
+        if self._mode is not None and self._mode.endswith("mostrecent"):
+            vector = self._backend.vector(self, field, 2)
+            self._count, self._stored = _MostRecentValue(vector), vector
+        else:
+            self._count = self._stored = self._backend.value(self, field)
+
+    def init(self, backend: Backend):
+        if self._mode is None:
+            super().init(backend)
+            return
+        self._init_exemplars(backend, 1)
+        self._bind()
+
+    def values(self) -> Iterable[Union[MetricValue, MetricVector]]:
+        if self._mode is None:
+            return super().values()
+        return (self._stored,)
+
+    @classmethod
+    def survives_exit(cls, parameters: Mapping[str, typing.Any], field: str) -> bool:
+        return False
+
+    def after_fork(self):
+        if self._mode is None:
+            return
+        # the child starts from zero in a field of its own, the parent keeps its value
+        self._backend.forget([self._stored])
+        self._bind()
+
+
+class FunctionCollector(Collector):
+    """Collects a gauge with the value of a function."""
+
+    def __init__(self, gauge: Gauge, f: Callable[[], float]):
+        self._gauge = typing.cast(
+            Gauge,
+            type(gauge).detached(
+                gauge.name, gauge.parameters["document"], gauge._labels
+            ),
+        )
+        self._f = f
+
+    def collect(self) -> Iterable[Metric]:
+        self._gauge._count.set(self._f())
+        yield self._gauge
 
 
 class Summary(Metric):
@@ -195,11 +534,119 @@ class Summary(Metric):
     _type = "summary"
     _count: MetricValue
     _sum: MetricValue
+    _backend: Backend
+    _windows: Dict[int, MetricVector]
+    _current: MetricVector
+    _generation: int
+    _rotation_lock: threading.Lock
+
+    def __init__(
+        self,
+        *args,
+        quantiles: Sequence[float] = (),
+        max_age_seconds: float = 600,
+        age_buckets: int = 5,
+        relative_accuracy: float = 0.01,
+        min_value: float = 1e-6,
+        max_value: float = 1e4,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._quantiles = [float(q) for q in quantiles]
+        if any(not 0 <= q <= 1 for q in self._quantiles):
+            raise ValueError("Quantiles must be between 0 and 1")
+        self._sketch: Optional[DDSketch] = None
+        if self._quantiles:
+            if max_age_seconds <= 0 or age_buckets < 1:
+                raise ValueError("Must have a positive window")
+            # observations of the last `age_buckets` windows of `max_age_seconds /
+            # age_buckets` seconds each, one sketch per window
+            self._sketch = DDSketch(relative_accuracy, min_value, max_value)
+            self._window_seconds = max_age_seconds / age_buckets
+            self._age_buckets = age_buckets
+            self.parameters.update(
+                quantiles=self._quantiles,
+                max_age_seconds=max_age_seconds,
+                age_buckets=age_buckets,
+                relative_accuracy=relative_accuracy,
+                min_value=min_value,
+                max_value=max_value,
+            )
 
     def observe(self, amount):
-        """Observe the given amount."""
+        """Observe the given amount, NaN raises a `ValueError`."""
+        if amount != amount:
+            raise ValueError("Cannot observe NaN in a summary")
+        if self._sketch is None:
+            self._count.inc(1)
+            self._sum.inc(amount)
+            return
+        index = self._sketch.index(amount)
         self._count.inc(1)
         self._sum.inc(amount)
+        self._current_window().inc(((index, 1),))
+
+    def observe_many(self, amounts: Union[Sequence[float], numpy.ndarray]):
+        """Observe every amount of a sequence or NumPy array, NaN raises a `ValueError`
+        before any of them is observed."""
+        # without NumPy there is no array type to match
+        if isinstance(amounts, getattr(numpy, "ndarray", ())):
+            array = typing.cast("numpy.ndarray", amounts)
+            nan = bool(numpy.isnan(array).any())
+            count, total = array.size, float(array.sum())
+        else:
+            nan = any(amount != amount for amount in amounts)
+            count, total = len(amounts), math.fsum(amounts)
+        if nan:
+            raise ValueError("Cannot observe NaN in a summary")
+        if count:
+            counts = None if self._sketch is None else self._sketch.counts(amounts)
+            self._count.inc(count)
+            self._sum.inc(total)
+            if counts is not None:
+                self._current_window().inc(counts)
+
+    def _window(self, generation: int) -> MetricVector:
+        window = self._windows.get(generation)
+        if window is None:
+            window = self._windows[generation] = self._backend.vector(
+                self, f"window_{generation}", typing.cast(DDSketch, self._sketch).size
+            )
+        return window
+
+    @classmethod
+    def survives_exit(cls, parameters: Mapping[str, typing.Any], field: str) -> bool:
+        if not field.startswith("window_"):
+            return True
+        # windows which no longer count for the quantiles are dropped
+        age_buckets = parameters["age_buckets"]
+        generation = int(time.time() // (parameters["max_age_seconds"] / age_buckets))
+        return int(field[len("window_") :]) > generation - age_buckets
+
+    def _current_window(self) -> MetricVector:
+        generation = int(time.time() // self._window_seconds)
+        if generation != self._generation:
+            with self._rotation_lock:
+                if generation != self._generation:
+                    expired = [
+                        self._windows.pop(g)
+                        for g in list(self._windows)
+                        if g <= generation - self._age_buckets
+                    ]
+                    if expired:
+                        self._backend.remove(expired)
+                    self._current = self._window(generation)
+                    self._generation = generation
+        return self._current
+
+    def _quantile_values(self) -> List[float]:
+        sketch = typing.cast(DDSketch, self._sketch)
+        generation = int(time.time() // self._window_seconds)
+        counts = [0.0] * sketch.size
+        for g in range(generation - self._age_buckets + 1, generation + 1):
+            for i, count in enumerate(self._window(g).get()):
+                counts[i] += count
+        return sketch.quantiles(counts, self._quantiles)
 
     def time(self):
         """Time a block of code or function, and observe the duration in seconds.
@@ -215,6 +662,13 @@ class Summary(Metric):
         return f"# TYPE {self.name} {self._type}"
 
     def samples(self) -> Iterable[Sample]:
+        if self._sketch is not None:
+            for q, value in zip(self._quantiles, self._quantile_values()):
+                yield Sample(
+                    name=self.name,
+                    labels={**self._labels, "quantile": float_to_string(q)},
+                    value=value,
+                )
         yield Sample(
             name=f"{self.name}_count", labels=self._labels, value=self._count.get()
         )
@@ -222,9 +676,25 @@ class Summary(Metric):
             name=f"{self.name}_sum", labels=self._labels, value=self._sum.get()
         )
 
-    def init(self, m: SyncManager):
-        self._count = getattr(m, "MetricValue")()
-        self._sum = getattr(m, "MetricValue")()
+    def sample_values(self) -> List[float]:
+        values = self._quantile_values() if self._sketch is not None else []
+        values.append(self._count.get())
+        values.append(self._sum.get())
+        return values
+
+    def init(self, backend: Backend):
+        self._count = backend.value(self, "count")
+        self._sum = backend.value(self, "sum")
+        if self._sketch is not None:
+            self._backend = backend
+            self._windows = {}
+            self._generation = -1
+            self._rotation_lock = threading.Lock()
+
+    def values(self) -> Iterable[Union[MetricValue, MetricVector]]:
+        if self._sketch is not None:
+            return (self._count, self._sum, *self._windows.values())
+        return (self._count, self._sum)
 
 
 class Histogram(Metric):
@@ -246,8 +716,8 @@ class Histogram(Metric):
         10.0,
         INF,
     )
-    _buckets: Sequence[MetricValue]
-    _sum: MetricValue
+    _vector: MetricVector
+    exemplar_interval: Optional[float] = 1.0
 
     def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
         super().__init__(*args, **kwargs)
@@ -261,14 +731,53 @@ class Histogram(Metric):
         if len(buckets) < 2:
             raise ValueError("Must have at least two buckets")
         self._upper_bounds = buckets
+        self.parameters.update(buckets=buckets)
 
     def observe(self, amount: float):
-        """Observe the given amount."""
-        self._sum.inc(amount)
-        for i, bound in enumerate(self._upper_bounds):
-            if amount <= bound:
-                self._buckets[i].inc(1)
-                break
+        """Observe the given amount, NaN raises a `ValueError`."""
+        # the vector holds the count of each bucket followed by the sum
+        index = bisect_left(self._upper_bounds, amount)
+        if not index and amount != amount:
+            # NaN compares lower than every bound
+            raise ValueError("Cannot observe NaN in a histogram")
+        self._vector.inc(((index, 1), (len(self._upper_bounds), amount)))
+        if monotonic() >= self._exemplar_due[index]:
+            self._record_exemplar(index, amount)
+
+    def observe_many(self, amounts: Union[Sequence[float], numpy.ndarray]):
+        """Observe every amount of a sequence or NumPy array with a single update, NaN
+        raises a `ValueError` before any of them is observed.
+
+        Buckets are counted with NumPy when it is installed.
+        """
+        size = len(self._upper_bounds)
+        # bucket counts, then the sum
+        updates: List[Tuple[int, float]]
+        if numpy is not None:
+            array = numpy.asarray(amounts, dtype=float).ravel()
+            if not array.size:
+                return
+            if numpy.isnan(array).any():
+                raise ValueError("Cannot observe NaN in a histogram")
+            counts = numpy.bincount(
+                numpy.searchsorted(self._upper_bounds, array, side="left"),
+                minlength=size,
+            )
+            updates = [(i, int(count)) for i, count in enumerate(counts) if count]
+            total = float(array.sum())
+        else:
+            if not len(amounts):
+                return
+            buckets = [0] * size
+            for amount in amounts:
+                index = bisect_left(self._upper_bounds, amount)
+                if not index and amount != amount:
+                    raise ValueError("Cannot observe NaN in a histogram")
+                buckets[index] += 1
+            updates = [(i, count) for i, count in enumerate(buckets) if count]
+            total = math.fsum(amounts)
+        updates.append((size, total))
+        self._vector.inc(updates)
 
     def time(self):
         """Time a block of code or function, and observe the duration in seconds.
@@ -284,19 +793,240 @@ class Histogram(Metric):
         return f"# TYPE {self.name} {self._type}"
 
     def samples(self) -> Iterable[Sample]:
+        values = self._vector.get()
         acc = 0.0
         for i, bound in enumerate(self._upper_bounds):
-            acc += self._buckets[i].get()
+            acc += values[i]
 
             yield Sample(
                 name=f"{self.name}_bucket",
                 labels={**self._labels, "le": float_to_string(bound)},
                 value=acc,
             )
-        yield Sample(name=f"{self.name}_count", labels={}, value=acc)
+        yield Sample(name=f"{self.name}_count", labels=self._labels, value=acc)
         if self._upper_bounds[0] >= 0:
-            yield Sample(name=f"{self.name}_sum", labels={}, value=self._sum.get())
+            yield Sample(name=f"{self.name}_sum", labels=self._labels, value=values[-1])
+
+    def sample_values(self) -> List[float]:
+        values = self._vector.get()
+        result = list(itertools.accumulate(values[:-1]))
+        result.append(result[-1])
+        if self._upper_bounds[0] >= 0:
+            result.append(values[-1])
+        return result
+
+    def init(self, backend: Backend):
+        self._vector = backend.vector(self, "buckets", len(self._upper_bounds) + 1)
+        self._init_exemplars(backend, len(self._upper_bounds))
+
+    def values(self) -> Iterable[Union[MetricValue, MetricVector]]:
+        return (self._vector, *self._exemplars.values())
+
+
+class ExponentialHistogram(Metric):
+    """A sparse histogram of exponential buckets, like Prometheus native histograms.
+
+    Bucket `i` holds values in `(base ** (i - 1), base ** i]` with `base = 2 ** (2 ** -schema)`,
+    negative values are counted in mirrored buckets and values within `zero_threshold` of
+    zero in a zero bucket. Only touched buckets are stored, and the schema is lowered
+    (merging pairs of adjacent buckets) when there are more than `max_buckets` of them.
+    Infinity and NaN have no bucket, observing them raises a `ValueError`.
+    """
+
+    _type = "exponential_histogram"
+    MIN_SCHEMA = -4
+    MAX_SCHEMA = 8
+    _backend: Backend
+    _count: MetricValue
+    _sum: MetricValue
+    _zero: MetricValue
+    _lock: threading.Lock
+    # schema of new buckets, and `2 ** schema`
+    _schema: int
+    _scale: float
+    # buckets of the current schema, and the touched buckets downscaled to it
+    _buckets: Dict[Tuple[bool, int], MetricValue]
+    _touched: typing.Set[Tuple[bool, int]]
+    _values: List[MetricValue]
+
+    def __init__(
+        self,
+        *args,
+        schema: int = 3,
+        max_buckets: int = 160,
+        zero_threshold: float = 0.0,
+        buckets: Optional[Sequence[float]] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if not self.MIN_SCHEMA <= schema <= self.MAX_SCHEMA:
+            raise ValueError(
+                f"Schema must be between {self.MIN_SCHEMA} and {self.MAX_SCHEMA}"
+            )
+        if max_buckets < 1:
+            raise ValueError("Must have at least one bucket")
+        self._initial_schema = schema
+        self._max_buckets = max_buckets
+        self._zero_threshold = float(zero_threshold)
+        self.parameters.update(
+            schema=schema, max_buckets=max_buckets, zero_threshold=zero_threshold
+        )
+        # upper bounds of classic buckets for scrapers without native histograms,
+        # otherwise the touched buckets are exported
+        self._classic_bounds: Optional[List[float]] = None
+        if buckets is not None:
+            bounds = [float(b) for b in buckets]
+            if bounds != sorted(bounds):
+                raise ValueError("Buckets not in sorted order")
+            if not bounds or bounds[-1] != INF:
+                bounds.append(INF)
+            self._classic_bounds = bounds
+            self.parameters.update(buckets=bounds)
+        self.fixed_samples = buckets is not None
+
+    @staticmethod
+    def _index(amount: float, scale: float) -> int:
+        return math.ceil(math.log2(amount) * scale)
+
+    @staticmethod
+    def _downscale(index: int, delta: int) -> int:
+        # ceil(index / 2 ** delta)
+        return -(-index >> delta)
+
+    def observe(self, amount: float):
+        """Observe the given amount."""
+        if -self._zero_threshold <= amount <= self._zero_threshold:
+            self._zero.inc(1)
+        else:
+            try:
+                key = (amount < 0, self._index(abs(amount), self._scale))
+            except (OverflowError, ValueError):
+                # infinity or NaN have no bucket
+                raise ValueError(
+                    f"Cannot observe {amount} in an exponential histogram"
+                ) from None
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._touch(*key)
+            bucket.inc(1)
+        self._count.inc(1)
+        self._sum.inc(amount)
+
+    def _touch(self, negative: bool, index: int) -> MetricValue:
+        with self._lock:
+            if (negative, index) not in self._buckets:
+                self._touched.add((negative, index))
+                if len(self._touched) > self._max_buckets:
+                    # buckets already written keep their schema, they are merged at
+                    # collection time
+                    while (
+                        len(self._touched) > self._max_buckets
+                        and self._schema > self.MIN_SCHEMA
+                    ):
+                        self._schema -= 1
+                        self._touched = {
+                            (n, self._downscale(i, 1)) for n, i in self._touched
+                        }
+                        index = self._downscale(index, 1)
+                    self._scale = 2.0**self._schema
+                    self._buckets = {}
+                if (negative, index) not in self._buckets:
+                    field = f"{'-' if negative else '+'}{self._schema}/{index}"
+                    bucket = self._backend.value(self, field)
+                    self._values.append(bucket)
+                    self._buckets[(negative, index)] = bucket
+            return self._buckets[(negative, index)]
+
+    def time(self):
+        """Time a block of code or function, and observe the duration in seconds.
+
+        Can be used as a function decorator or context manager.
+        """
+        return Timer(self.observe)
+
+    def native(self) -> Tuple[int, Dict[int, float], Dict[int, float]]:
+        """`(schema, positive, negative)` buckets of all processes, counts by index."""
+        buckets: List[Tuple[bool, int, int, float]] = []
+        for field in self._backend.fields(self):
+            if field[:1] in ("+", "-"):
+                field_schema, _, field_index = field[1:].partition("/")
+                count = self._backend.value(self, field).get()
+                buckets.append(
+                    (field[0] == "-", int(field_schema), int(field_index), count)
+                )
+        schema = min((b[1] for b in buckets), default=self._initial_schema)
+        while True:
+            positive: Dict[int, float] = {}
+            negative: Dict[int, float] = {}
+            for is_negative, bucket_schema, index, count in buckets:
+                side = negative if is_negative else positive
+                index = self._downscale(index, bucket_schema - schema)
+                side[index] = side.get(index, 0.0) + count
+            if (
+                len(positive) + len(negative) <= self._max_buckets
+                or schema == self.MIN_SCHEMA
+            ):
+                return schema, positive, negative
+            schema -= 1
+
+    def help(self) -> str:
+        return f"# HELP {self.name} {self.document}"
+
+    def type(self) -> str:
+        return f"# TYPE {self.name} histogram"
+
+    def _classic(self) -> List[Tuple[float, float]]:
+        """`(upper bound, count)` of classic buckets, without the `+Inf` one."""
+        schema, positive, negative = self.native()
+        base = 2.0 ** (2.0**-schema)
+        buckets = [
+            (-(base ** (i - 1)), negative[i]) for i in sorted(negative, reverse=True)
+        ]
+        zero = self._zero.get()
+        if zero:
+            buckets.append((self._zero_threshold, zero))
+        buckets.extend((base**i, positive[i]) for i in sorted(positive))
+        if self._classic_bounds is None:
+            return buckets
+        counts = [0.0] * len(self._classic_bounds)
+        for bound, count in buckets:
+            # a native bucket is counted in the first classic bucket holding its upper bound
+            counts[
+                min(bisect_left(self._classic_bounds, bound), len(counts) - 1)
+            ] += count
+        return list(zip(self._classic_bounds[:-1], counts))
+
+    def samples(self) -> Iterable[Sample]:
+        acc = 0.0
+        for bound, count in self._classic():
+            acc += count
+            yield Sample(
+                name=f"{self.name}_bucket",
+                labels={**self._labels, "le": float_to_string(bound)},
+                value=acc,
+            )
+        count = self._count.get()
+        yield Sample(
+            name=f"{self.name}_bucket",
+            labels={**self._labels, "le": "+Inf"},
+            value=count,
+        )
+        yield Sample(name=f"{self.name}_count", labels=self._labels, value=count)
+        yield Sample(
+            name=f"{self.name}_sum", labels=self._labels, value=self._sum.get()
+        )
 
-    def init(self, m: SyncManager):
-        self._buckets = [getattr(m, "MetricValue")() for _ in self._upper_bounds]
-        self._sum = getattr(m, "MetricValue")()
+    def init(self, backend: Backend):
+        self._backend = backend
+        self._count = backend.value(self, "count")
+        self._sum = backend.value(self, "sum")
+        self._zero = backend.value(self, "zero")
+        self._schema = self._initial_schema
+        self._scale = 2.0**self._schema
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._touched = set()
+        self._values = []
+
+    def values(self) -> Iterable[MetricValue]:
+        return (self._count, self._sum, self._zero, *self._values)
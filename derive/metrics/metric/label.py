@@ -1,5 +1,23 @@
-from typing import Tuple, TypeVar, Generic, Type, Set
+from collections import OrderedDict
+from itertools import repeat
+from operator import itemgetter
+from threading import Lock
+from time import monotonic
+from typing import (
+    Tuple,
+    TypeVar,
+    Generic,
+    Type,
+    Set,
+    Dict,
+    Hashable,
+    Iterable,
+    Mapping,
+    Optional,
+    Union,
+)
 
+from derive.metrics.collector import GlobalCollector
 from derive.metrics.metric import base
 
 M = TypeVar("M", bound=base.Metric)
@@ -14,10 +32,40 @@ class _MetricMeta(type):
 
 class _Metric(Generic[M], metaclass=_MetricMeta):
     m_cls: Type[M]
+    OVERFLOW = "__overflow__"
+    # label sets sent to the overflow child and remembered, so each is counted once
+    MAX_REJECTED = 1024
+    # whether `GlobalCollector.max_series` applies to the children
+    _limited = True
 
-    def __init__(self, name: str, document: str, label_names: Set[str]):
+    def __init__(
+        self,
+        name: str,
+        document: str,
+        label_names: Set[str],
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+    ):
+        if on_limit not in ("evict", "overflow"):
+            raise ValueError("on_limit must be 'evict' or 'overflow'")
         self.label_names = label_names
         self.parameters = dict(name=name, document=document)
+        # label values in the sorted order of label names, a single value for one label
+        self._label_values = itemgetter(*sorted(label_names))
+        self._max_series = max_series
+        self._evict = on_limit == "evict"
+        # least recently used first when evicting
+        self._children: "OrderedDict[Hashable, M]" = OrderedDict()
+        self._overflow: Optional[M] = None
+        self._rejected: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._lock = Lock()
+        # monotonic time of the last `labels()` call of every child, with a ttl
+        self._ttl = ttl
+        self._last_touch: Dict[Hashable, float] = {}
+        self._last_expiry = monotonic()
+        if ttl is not None:
+            GlobalCollector.track_expiry(self)
 
     def labels(self, **kwargs: str) -> M:
         """
@@ -29,25 +77,227 @@ class _Metric(Generic[M], metaclass=_MetricMeta):
             c = Counter('my_requests_total', 'HTTP Failures', {"method","endpoint"})
             c.labels(method="get", endpoint="/").inc()
             c.labels(method='post', endpoint='/submit').inc()
+
+        Children are cached by label values, so calling labels() again is a dict lookup.
+
+        Past `max_series` children (or `GlobalCollector.max_series` metrics in total), the
+        least recently used child is removed, or with `on_limit="overflow"` new label values
+        share a single child with every label set to `__overflow__`.
+
+        With a `ttl`, children not returned by labels() for `ttl` seconds are removed at
+        collection time, so keep calling labels() rather than holding on to a child. Every
+        process tracks the children it uses: with the `manager` backend a child expired by
+        the collecting process is exported again, from zero, by the next update of a
+        process still using it.
         """
+        if len(kwargs) == len(self.label_names):
+            try:
+                key = self._label_values(kwargs)
+                cached = self._children[key]
+                if self._evict:
+                    # either limit may apply, also one set later
+                    self._children.move_to_end(key)
+            except KeyError:
+                overflow = self._overflow
+                if (
+                    overflow is not None
+                    and kwargs.keys() == self.label_names
+                    and self._label_values(kwargs) in self._rejected
+                    and self._over_limit()
+                ):
+                    return overflow
+            else:
+                if self._ttl is not None:
+                    self._last_touch[key] = monotonic()
+                return cached
         if self.label_names != kwargs.keys():
             raise ValueError("Incorrect label names")
-        return self.m_cls(**self.parameters, labels=kwargs)
+        key = self._label_values(kwargs)
+        evicted: Optional[M] = None
+        rejected = False
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                over_limit = self._over_limit()
+                if over_limit and (not self._evict or not self._children):
+                    child = self._overflow_child()
+                    if key not in self._rejected:
+                        rejected = True
+                        self._rejected[key] = None
+                        if len(self._rejected) > self.MAX_REJECTED:
+                            self._rejected.popitem(last=False)
+                else:
+                    self._rejected.pop(key, None)
+                    if over_limit:
+                        _, evicted = self._children.popitem(last=False)
+                    child = self.m_cls(**self.parameters, labels=kwargs)
+                    self._children[key] = child
+            if self._ttl is not None:
+                self._last_touch[key] = monotonic()
+        if evicted is not None:
+            GlobalCollector.unregister(evicted)
+        if evicted is not None or rejected:
+            REJECTED_SERIES.labels(metric=self.parameters["name"]).inc()
+        if self._ttl is not None and monotonic() - self._last_expiry > self._ttl:
+            # processes which never collect drop their stale children too
+            self.expire()
+        return child
+
+    def expire(self) -> None:
+        """Remove the children not returned by labels() for `ttl` seconds."""
+        if self._ttl is None:
+            return
+        now = monotonic()
+        deadline = now - self._ttl
+        with self._lock:
+            self._last_expiry = now
+            expired = [
+                key for key, touched in self._last_touch.items() if touched < deadline
+            ]
+            children = []
+            for key in expired:
+                del self._last_touch[key]
+                child = self._children.pop(key, None)
+                if child is not None:
+                    children.append(child)
+        for child in children:
+            GlobalCollector.unregister(child)
+
+    def _over_limit(self) -> bool:
+        if self._max_series is not None and len(self._children) >= self._max_series:
+            return True
+        max_series = GlobalCollector.max_series
+        if max_series is None or not self._limited:
+            return False
+        from derive.metrics.manager import get_backend
+
+        return len(get_backend().metrics_mapping) >= max_series
+
+    def _overflow_child(self) -> M:
+        if self._overflow is None:
+            self._overflow = self.m_cls(
+                **self.parameters,
+                labels={name: self.OVERFLOW for name in self.label_names},
+            )
+        return self._overflow
+
+    def remove(self, **kwargs: str) -> None:
+        """Remove the child with the given labels, it is not exported anymore.
+
+        Only the values of this process are removed: with the `mmap` backend other
+        processes keep exporting theirs, with the `manager` backend the values are shared
+        and the next update of any process holding the child exports it again, from zero.
+        """
+        if self.label_names != kwargs.keys():
+            raise ValueError("Incorrect label names")
+        key = self._label_values(kwargs)
+        with self._lock:
+            child = self._children.pop(key, None)
+            self._last_touch.pop(key, None)
+        if child is None:
+            child = self.m_cls(**self.parameters, labels=kwargs)
+        GlobalCollector.unregister(child)
+
+    def clear(self) -> None:
+        """Remove all children created by this metric."""
+        with self._lock:
+            children = list(self._children.values())
+            self._children.clear()
+            self._last_touch.clear()
+            if self._overflow is not None:
+                children.append(self._overflow)
+                self._overflow = None
+        for child in children:
+            GlobalCollector.unregister(child)
 
 
 class Counter(_Metric[base.Counter]):
-    pass
+    def inc_many(
+        self,
+        labels: Iterable[Mapping[str, str]],
+        amounts: Optional[Iterable[Union[float, int]]] = None,
+    ) -> None:
+        """Increment the child of every item of `labels` by the matching amount (1 by default),
+        with one update per distinct child.
+
+            c = Counter('my_requests_total', 'HTTP Failures', {"method"})
+            c.inc_many([{"method": "get"}, {"method": "post"}, {"method": "get"}])
+        """
+        totals: Dict[Hashable, list] = {}
+        for item, amount in zip(labels, repeat(1) if amounts is None else amounts):
+            try:
+                key = self._label_values(item)
+            except KeyError:
+                raise ValueError("Incorrect label names")
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [item, amount]
+            else:
+                total[1] += amount
+        for item, amount in totals.values():
+            self.labels(**item).inc(amount)
 
 
 class Gauge(_Metric[base.Gauge]):
-    pass
+    def __init__(
+        self,
+        name: str,
+        document: str,
+        label_names: Set[str],
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        multiprocess_mode: Optional[str] = None,
+    ):
+        super().__init__(name, document, label_names, max_series, on_limit, ttl)
+        if multiprocess_mode is not None:
+            if multiprocess_mode not in base.MULTIPROCESS_MODES:
+                raise ValueError(
+                    f"Unknown multiprocess mode {multiprocess_mode!r}, "
+                    f"expected one of {base.MULTIPROCESS_MODES}"
+                )
+            self.parameters.update(multiprocess_mode=multiprocess_mode)
 
 
 class Summary(_Metric[base.Summary]):
-    pass
+    def __init__(
+        self,
+        name: str,
+        document: str,
+        label_names: Set[str],
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        **options,
+    ):
+        super().__init__(name, document, label_names, max_series, on_limit, ttl)
+        self.parameters.update(options)
 
 
 class Histogram(_Metric[base.Histogram]):
     def __init__(self, *args, buckets=base.Histogram.DEFAULT_BUCKETS, **kwargs):
         super().__init__(*args, **kwargs)
         self.parameters.update(buckets=buckets)
+
+
+class ExponentialHistogram(_Metric[base.ExponentialHistogram]):
+    def __init__(
+        self,
+        name: str,
+        document: str,
+        label_names: Set[str],
+        max_series: Optional[int] = None,
+        on_limit: str = "evict",
+        ttl: Optional[float] = None,
+        **options,
+    ):
+        super().__init__(name, document, label_names, max_series, on_limit, ttl)
+        self.parameters.update(options)
+
+
+REJECTED_SERIES = Counter(
+    "derive_metrics_rejected_series",
+    "Label sets over the series limit of a metric, evicted or sent to its overflow series",
+    {"metric"},
+)
+REJECTED_SERIES._limited = False
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+import typing
+from time import monotonic
+from typing import Iterable, List, Mapping, Optional, Sequence, Union
+
+from derive.metrics.metric.base import (
+    PID_FIELD,
+    Metric,
+    MetricValue,
+    MetricVector,
+    Sample,
+    process_values,
+)
+
+if typing.TYPE_CHECKING:
+    from derive.metrics.backend import Backend
+
+
+class _ProcessMetric(Metric):
+    """A metric whose state lives in this process and is published to the backend in a
+    `pid/{pid}` vector, the vectors of running processes are combined at collection."""
+
+    _vector: MetricVector
+    _state_lock: threading.Lock
+    # length of the published vector
+    _size: int
+
+    def _reset(self):
+        pass
+
+    def _bind(self):
+        self._vector = self._backend.vector(
+            self, f"{PID_FIELD}{os.getpid()}", self._size
+        )
+
+    def init(self, backend: Backend):
+        self._backend = backend
+        self._bind()
+
+    def values(self) -> Iterable[Union[MetricValue, MetricVector]]:
+        return (self._vector,)
+
+    def after_fork(self):
+        # the child starts over in a field of its own, the parent keeps publishing
+        self._backend.forget([self._vector])
+        with self._state_lock:
+            self._reset()
+            self._bind()
+
+    @classmethod
+    def survives_exit(cls, parameters: Mapping[str, typing.Any], field: str) -> bool:
+        return False
+
+    def help(self) -> str:
+        return f"# HELP {self.name} {self.document}"
+
+    def type(self) -> str:
+        return f"# TYPE {self.name} gauge"
+
+
+class MeterRates(_ProcessMetric):
+    """Events per second as exponentially weighted moving averages over `windows`
+    seconds, exported as a gauge with a `window` label.
+
+    Events are counted in ticks of a fifth of the shortest window, and every rate moves
+    towards the rate of the last tick once per tick, so marking an event is a counter
+    increment and reading a rate a list lookup. Rates are published once per tick, and
+    decay from then on at collection.
+    """
+
+    _type = "meter_rate"
+
+    def __init__(self, *args, windows: Sequence[float] = (1.0, 5.0, 15.0), **kwargs):
+        super().__init__(*args, **kwargs)
+        if not windows or any(window <= 0 for window in windows):
+            raise ValueError("Windows must be positive")
+        self.windows = [float(window) for window in windows]
+        self.parameters.update(windows=self.windows)
+        self._tick = min(self.windows) / 5
+        self._alphas = [1.0 - math.exp(-self._tick / window) for window in self.windows]
+        # the rates and the time they were computed at
+        self._size = len(self.windows) + 1
+        self._state_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._rates = [0.0] * len(self.windows)
+        self._started = False
+        self._pending = 0.0
+        self._next_tick = monotonic() + self._tick
+
+    def _advance(self, now: float):
+        ticks = int((now - self._next_tick) // self._tick) + 1
+        instant = self._pending / self._tick
+        for i, alpha in enumerate(self._alphas):
+            rate = self._rates[i] + alpha * (instant - self._rates[i])
+            # the first tick starts every rate from its instant rate
+            rate = rate if self._started else instant
+            # later ticks counted nothing
+            self._rates[i] = rate * (1.0 - alpha) ** (ticks - 1)
+        self._started = True
+        self._pending = 0.0
+        self._next_tick += ticks * self._tick
+        self._vector.set([*self._rates, time.time()])
+
+    def mark(self, count: Union[float, int] = 1):
+        with self._state_lock:
+            now = monotonic()
+            if now >= self._next_tick:
+                self._advance(now)
+            self._pending += count
+
+    def rate(self, index: int) -> float:
+        """Rate of this process over `windows[index]`."""
+        with self._state_lock:
+            now = monotonic()
+            if now >= self._next_tick:
+                self._advance(now)
+            return self._rates[index]
+
+    def rates(self) -> List[float]:
+        """Rates of this process in the order of `windows`."""
+        with self._state_lock:
+            now = monotonic()
+            if now >= self._next_tick:
+                self._advance(now)
+            return list(self._rates)
+
+    def samples(self) -> Iterable[Sample]:
+        for window, value in zip(self.windows, self.sample_values()):
+            yield Sample(
+                name=self.name,
+                labels={**self._labels, "window": f"{window:g}"},
+                value=value,
+            )
+
+    def sample_values(self) -> List[float]:
+        totals = [0.0] * len(self.windows)
+        now = time.time()
+        for values in process_values(
+            self._backend.field_values(self), self._backend.local
+        ):
+            # rates decay since they were published
+            elapsed = max(now - values[-1], 0.0)
+            for i, window in enumerate(self.windows):
+                totals[i] += values[i] * math.exp(-elapsed / window)
+        return totals
+
+
+class MeterErrorRatio(_ProcessMetric):
+    """Share of errors among the events of the last `window` seconds, exported as a
+    gauge.
+
+    Events and errors are counted in `buckets` slices of the window kept in a ring, with
+    their sums over the ring, so reading the ratio is a division. The sums are published
+    with every event, and again without the expired slice once per slice.
+    """
+
+    _type = "meter_error_ratio"
+    # events and errors of the window, and the time they were summed at
+    _size = 3
+
+    def __init__(self, *args, window: float = 10.0, buckets: int = 10, **kwargs):
+        super().__init__(*args, **kwargs)
+        if window <= 0 or buckets < 1:
+            raise ValueError("Must have a positive window")
+        self.window = float(window)
+        self.buckets = int(buckets)
+        self.parameters.update(window=self.window, buckets=self.buckets)
+        self._bucket_seconds = self.window / self.buckets
+        self._state_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._totals = [0.0] * self.buckets
+        self._errors = [0.0] * self.buckets
+        self._total = self._error = 0.0
+        self._bucket = int(monotonic() // self._bucket_seconds)
+
+    def _bind(self):
+        super()._bind()
+        # events before the first rotation are published with a time as well
+        self._vector.set([self._total, self._error, time.time()])
+
+    def _rotate(self, bucket: int):
+        for expired in range(
+            max(self._bucket + 1, bucket - self.buckets + 1), bucket + 1
+        ):
+            self._totals[expired % self.buckets] = 0.0
+            self._errors[expired % self.buckets] = 0.0
+        self._bucket = bucket
+        self._total, self._error = math.fsum(self._totals), math.fsum(self._errors)
+        self._vector.set([self._total, self._error, time.time()])
+
+    def mark(self, count: Union[float, int] = 1, error: bool = False):
+        bucket = int(monotonic() // self._bucket_seconds)
+        with self._state_lock:
+            if bucket > self._bucket:
+                self._rotate(bucket)
+            index = bucket % self.buckets
+            self._totals[index] += count
+            self._total += count
+            if error:
+                self._errors[index] += count
+                self._error += count
+                self._vector.inc(((0, count), (1, count)))
+            else:
+                self._vector.inc(((0, count),))
+
+    def ratio(self) -> float:
+        """Error ratio of this process, 0 without events."""
+        bucket = int(monotonic() // self._bucket_seconds)
+        with self._state_lock:
+            if bucket > self._bucket:
+                self._rotate(bucket)
+            return self._error / self._total if self._total else 0.0
+
+    def samples(self) -> Iterable[Sample]:
+        yield Sample(name=self.name, labels=self._labels, value=self.sample_values()[0])
+
+    def sample_values(self) -> List[float]:
+        total = error = 0.0
+        now = time.time()
+        for values in process_values(
+            self._backend.field_values(self), self._backend.local
+        ):
+            # processes without events for a whole window have none left in it
+            if now - values[2] < self.window:
+                total += values[0]
+                error += values[1]
+        return [error / total if total else 0.0]
+
+
+class Meter:
+    """
+    Rates of events and the share of errors among them, readable in process, e.g. to
+    shed load or size batches.
+
+        from derive.metrics import Meter
+
+        m = Meter('http_requests', 'HTTP requests')
+        m.mark()            # an event
+        m.mark(error=True)  # a failed event
+        m.rate()            # events per second over the shortest window
+        m.rates()           # events per second over every window
+        m.error_ratio()     # errors / events over the last `error_window` seconds
+
+    Rates are exponentially weighted moving averages over `windows` seconds. Both are
+    kept in memory with a fixed size and read for this process, and exported over the
+    running processes as the gauges `{name}_rate` with a `window` label and
+    `{name}_error_ratio`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        document: str,
+        windows: Sequence[float] = (1.0, 5.0, 15.0),
+        error_window: float = 10.0,
+        error_buckets: int = 10,
+    ):
+        self.name = name
+        self._rates = typing.cast(
+            MeterRates,
+            MeterRates(f"{name}_rate", f"{document} per second", windows=windows),
+        )
+        self._errors = typing.cast(
+            MeterErrorRatio,
+            MeterErrorRatio(
+                f"{name}_error_ratio",
+                f"Error ratio of {document}",
+                window=error_window,
+                buckets=error_buckets,
+            ),
+        )
+        self.windows = self._rates.windows
+        self._shortest = self.windows.index(min(self.windows))
+
+    def mark(self, count: Union[float, int] = 1, error: bool = False):
+        """Count `count` events, failed ones with `error`."""
+        self._rates.mark(count)
+        self._errors.mark(count, error)
+
+    def rate(self, window: Optional[float] = None) -> float:
+        """Events per second over `window` seconds, the shortest window by default."""
+        if window is None:
+            return self._rates.rate(self._shortest)
+        return self._rates.rate(self.windows.index(float(window)))
+
+    def rates(self) -> List[float]:
+        """Events per second over every window, in the order of `windows`."""
+        return self._rates.rates()
+
+    def error_ratio(self) -> float:
+        return self._errors.ratio()
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import math
+from bisect import bisect_right
+from itertools import accumulate
+from typing import List, Sequence, Tuple, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # type: ignore[assignment]
+
+NaN = float("NaN")
+
+
+class DDSketch:
+    """A quantile sketch with a bounded relative error, after DDSketch.
+
+    Values are counted in logarithmic bins between `min_value` and `max_value`, smaller
+    values (including negative ones) fall into the first bin and larger ones (including
+    infinity) into the last, NaN raises a `ValueError`. The state is a fixed-size vector of counts, so sketches are merged by adding counts.
+    """
+
+    def __init__(self, relative_accuracy: float, min_value: float, max_value: float):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("Relative accuracy must be between 0 and 1")
+        if not 0 < min_value < max_value:
+            raise ValueError("Value range must be positive and not empty")
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.min_value = min_value
+        self.max_value = max_value
+        self._log_gamma = math.log(self.gamma)
+        self.size = math.ceil(math.log(max_value / min_value) / self._log_gamma) + 1
+
+    def index(self, value: float) -> int:
+        """Bin of `value`, bin `i > 0` holds values in `(min_value * gamma ** (i - 1),
+        min_value * gamma ** i]`."""
+        if value <= self.min_value:
+            return 0
+        if value >= self.max_value:
+            return self.size - 1
+        if value != value:
+            raise ValueError("Cannot observe NaN in a sketch")
+        return min(
+            math.ceil(math.log(value / self.min_value) / self._log_gamma),
+            self.size - 1,
+        )
+
+    def counts(
+        self, values: Union[Sequence[float], numpy.ndarray]
+    ) -> List[Tuple[int, int]]:
+        """`(bin, count)` of every bin holding some of `values`."""
+        if numpy is not None:
+            array = numpy.asarray(values, dtype=float).ravel()
+            if numpy.isnan(array).any():
+                raise ValueError("Cannot observe NaN in a sketch")
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                indexes = numpy.ceil(
+                    numpy.log(array / self.min_value) / self._log_gamma
+                )
+            indexes = numpy.clip(indexes, 0, self.size - 1)
+            counts = numpy.bincount(indexes.astype(int), minlength=self.size)
+            return [(i, int(count)) for i, count in enumerate(counts) if count]
+        bins: List[int] = [0] * self.size
+        for value in values:
+            bins[self.index(value)] += 1
+        return [(i, count) for i, count in enumerate(bins) if count]
+
+    def value(self, index: int) -> float:
+        """Estimate of the values in a bin, within the relative accuracy of all of them."""
+        if index == 0:
+            return self.min_value
+        return 2 * self.min_value * self.gamma**index / (self.gamma + 1)
+
+    def quantiles(
+        self, counts: Sequence[float], quantiles: Sequence[float]
+    ) -> List[float]:
+        """Estimates of `quantiles` from the counts of a sketch, NaN if it is empty."""
+        cumulative = list(accumulate(counts))
+        total = cumulative[-1] if cumulative else 0
+        if not total:
+            return [NaN] * len(quantiles)
+        return [
+            self.value(bisect_right(cumulative, q * (total - 1))) for q in quantiles
+        ]
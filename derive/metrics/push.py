@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+import gzip
+import http.client
+import logging
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Full, LifoQueue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Type
+from urllib.parse import urlsplit
+
+import derive
+from derive.metrics.exporter import PrometheusExporter
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 512 * 1024
+
+
+class PushError(Exception):
+    """The receiver answered a push with an error status."""
+
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"Push failed with status {status}: {body[:200]!r}")
+        self.status = status
+        self.body = body
+
+
+class ConnectionPool:
+    """Keeps up to `size` idle persistent connections to the host of `url`."""
+
+    def __init__(self, url: str, size: int = 2, timeout: float = 5.0):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported push url {url!r}")
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.timeout = timeout
+        self._idle: LifoQueue[http.client.HTTPConnection] = LifoQueue(size)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def request(
+        self, method: str, path: str, body: bytes, headers: Dict[str, str]
+    ) -> Tuple[int, bytes]:
+        """Sends a request on an idle connection, or a new one. A reused connection the
+        receiver already closed is replaced once without waiting."""
+        try:
+            connection, reused = self._idle.get_nowait(), True
+        except Empty:
+            connection, reused = self._connect(), False
+        while True:
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if not reused:
+                    raise
+                connection, reused = self._connect(), False
+                continue
+            break
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._idle.put_nowait(connection)
+            except Full:
+                connection.close()
+        return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+class PushExporter:
+    """Pushes the registry to a Pushgateway-style endpoint every `interval` seconds from a
+    background thread, and once more at exit.
+
+    Only families whose exposition changed since the last successful push are sent, with
+    `POST` a receiver replaces the pushed families and keeps the others. Every family is
+    sent again every `resend` seconds, in case the receiver restarted or dropped the group. Bodies are split
+    at family boundaries into batches of about `batch_size` bytes, compressed with gzip
+    and sent over pooled persistent connections. Failed requests, 5xx and 429 answers are
+    retried `retries` times with exponential backoff.
+
+    Values of a multiprocess backend are merged at collection, so a single process should
+    push them: forked children do not run the exporter of their parent.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        interval: float = 10.0,
+        exporter: Type[PrometheusExporter] = PrometheusExporter,
+        compress: bool = True,
+        batch_size: int = BATCH_SIZE,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        timeout: float = 5.0,
+        pool_size: int = 2,
+        resend: float = 300.0,
+        start: bool = True,
+    ):
+        self.url = url
+        self.interval = interval
+        self.exporter = exporter
+        self.compress = compress
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.resend = resend
+        parts = urlsplit(url)
+        self._path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self._pool = ConnectionPool(url, pool_size, timeout)
+        self._lock = Lock()
+        self._sent: Dict[str, bytes] = {}
+        self._next_resend = monotonic() + resend
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+        if start:
+            self._start()
+            # runs after buffered backends are flushed, before the `Manager` is shut down
+            derive.register_at_exit(self.close, 10)
+            derive.register_after_fork(self._after_fork)
+
+    def _start(self):
+        self._thread = Thread(
+            target=self._run, name="derive.metrics.PushExporter", daemon=True
+        )
+        self._thread.start()
+
+    def _after_fork(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.push()
+            except Exception:
+                logger.warning("Pushing metrics to %s failed", self.url, exc_info=True)
+
+    def _batches(
+        self, families: List[Tuple[str, bytes]]
+    ) -> Iterator[List[Tuple[str, bytes]]]:
+        batch: List[Tuple[str, bytes]] = []
+        size = 0
+        for name, block in families:
+            if batch and size + len(block) > self.batch_size:
+                yield batch
+                batch, size = [], 0
+            batch.append((name, block))
+            size += len(block)
+        if batch:
+            yield batch
+
+    def _send(self, body: bytes):
+        headers = {"Content-Type": self.exporter.content_type}
+        if self.compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                status, data = self._pool.request("POST", self._path, body, headers)
+            except (OSError, http.client.HTTPException) as e:
+                error: Exception = e
+            else:
+                if status < 300:
+                    return
+                error = PushError(status, data)
+                if status < 500 and status != 429:
+                    raise error
+            if attempt == self.retries:
+                raise error
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, self.max_backoff)
+
+    def push(self) -> int:
+        """Pushes the changed families now, returns how many were sent."""
+        with self._lock:
+            now = monotonic()
+            if now >= self._next_resend:
+                self._sent = {}
+                self._next_resend = now + self.resend
+            changed = [
+                (name, block)
+                for name, block in self.exporter.families()
+                if self._sent.get(name) != block
+            ]
+            for batch in self._batches(changed):
+                self._send(b"".join(block for _, block in batch) + self.exporter.footer)
+                self._sent.update(batch)
+            return len(changed)
+
+    def close(self):
+        """Stops the background thread after a last push."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.push()
+        except Exception:
+            logger.warning("Pushing metrics to %s failed", self.url, exc_info=True)
+        self._pool.close()
+
+
+class ReceivedRequest(NamedTuple):
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes
+    client_address: Tuple[str, int]
+
+
+def _family_blocks(body: bytes) -> Dict[str, List[bytes]]:
+    families: Dict[str, List[bytes]] = {}
+    current: Optional[List[bytes]] = None
+    for line in body.splitlines():
+        if line.startswith(b"# HELP ") or line.startswith(b"# TYPE "):
+            name = line.split(b" ", 3)[2].decode()
+            current = families.setdefault(name, [])
+            current.append(line)
+        elif line and not line.startswith(b"#"):
+            if current is None:
+                name = line.split(b" ", 1)[0].split(b"{", 1)[0].decode()
+                current = families.setdefault(name, [])
+            current.append(line)
+    return families
+
+
+class _ReceiverHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: _ReceiverServer
+
+    def _respond(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _receive(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        self._respond(
+            self.server.receiver._receive(
+                ReceivedRequest(
+                    self.command,
+                    self.path,
+                    dict(self.headers.items()),
+                    body,
+                    self.client_address,
+                )
+            )
+        )
+
+    do_POST = do_PUT = do_DELETE = _receive
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ReceiverServer(ThreadingHTTPServer):
+    daemon_threads = True
+    receiver: LocalReceiver
+
+
+class LocalReceiver:
+    """An in-process stand-in for a Pushgateway, for tests.
+
+    Like a Pushgateway, `POST` replaces the pushed families of the group at the request
+    path, `PUT` replaces the whole group and `DELETE` removes it. Every request is kept in
+    `requests`, with its body decompressed.
+    """
+
+    def __init__(self, addr: str = "127.0.0.1", port: int = 0):
+        self.requests: List[ReceivedRequest] = []
+        self.groups: Dict[str, Dict[str, List[bytes]]] = {}
+        self._failures: List[int] = []
+        self._lock = Lock()
+        self._server = _ReceiverServer((addr, port), _ReceiverHandler)
+        self._server.receiver = self
+        self._thread: Optional[Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.socket.getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def fail_next(self, count: int = 1, status: int = 503):
+        """Answers the next `count` requests with `status` and drops them."""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def _receive(self, request: ReceivedRequest) -> int:
+        with self._lock:
+            self.requests.append(request)
+            if self._failures:
+                return self._failures.pop(0)
+            if request.method == "DELETE":
+                self.groups.pop(request.path, None)
+                return 202
+            families = _family_blocks(request.body)
+            if request.method == "PUT":
+                self.groups[request.path] = families
+            else:
+                self.groups.setdefault(request.path, {}).update(families)
+            return 200
+
+    def series(self, path: str) -> Dict[str, float]:
+        """Values of the samples held for the group at `path`, by name and labels."""
+        with self._lock:
+            families = dict(self.groups.get(path, {}))
+        series: Dict[str, float] = {}
+        for lines in families.values():
+            for line in lines:
+                if not line.startswith(b"#"):
+                    sample, value = line.split(b" # ", 1)[0].rsplit(b" ", 1)
+                    series[sample.decode()] = float(value)
+        return series
+
+    def start(self) -> LocalReceiver:
+        self._thread = Thread(
+            target=self._server.serve_forever,
+            name="derive.metrics.LocalReceiver",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> LocalReceiver:
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.process import BaseProcess
+from threading import Thread
+from typing import Dict, List, Optional, Tuple, Type
+from urllib.parse import parse_qs, urlsplit
+
+from derive.metrics.exporter import OpenMetricsExporter, PrometheusExporter
+
+
+def _media_types(header: str) -> List[str]:
+    return [item.split(";")[0].strip().lower() for item in header.split(",")]
+
+
+def negotiate(
+    accept: str, accept_encoding: str
+) -> Tuple[Type[PrometheusExporter], bool]:
+    """The exporter for an `Accept` header, and whether `Accept-Encoding` allows gzip."""
+    if "application/openmetrics-text" in _media_types(accept):
+        exporter: Type[PrometheusExporter] = OpenMetricsExporter
+    else:
+        exporter = PrometheusExporter
+    return exporter, "gzip" in _media_types(accept_encoding)
+
+
+def query_names(path: str) -> Optional[List[str]]:
+    """Names of `name[]=` parameters, to export only part of the registry."""
+    return parse_qs(urlsplit(path).query).get("name[]")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Streams the exposition of the registry on every GET request."""
+
+    def do_GET(self):
+        exporter, compress = negotiate(
+            self.headers.get("Accept", ""), self.headers.get("Accept-Encoding", "")
+        )
+        names = query_names(self.path)
+        # HTTP/1.0, the end of the body is marked by closing the connection
+        self.send_response(200)
+        self.send_header("Content-Type", exporter.content_type)
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            with gzip.GzipFile(fileobj=self.wfile, mode="wb") as f:
+                exporter.write(f, names=names)
+        else:
+            self.end_headers()
+            exporter.write(self.wfile, names=names)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(port: int, addr: str = "") -> Tuple[MetricsServer, Thread]:
+    """Serve the registry from a daemon thread, so scrapes do not wait for application
+    requests. Call `server.shutdown()` to stop it."""
+    server = MetricsServer((addr, port), MetricsHandler)
+    thread = Thread(
+        target=server.serve_forever, name="derive.metrics.server", daemon=True
+    )
+    thread.start()
+    return server, thread
+
+
+def start_http_server_process(
+    port: int, addr: str = ""
+) -> Tuple[MetricsServer, BaseProcess]:
+    """Serve the registry from a forked daemon process, so collection does not hold the
+    GIL of the application.
+
+    The socket is bound before the fork, the returned server is closed in this process and
+    only tells its address. Values must live in a backend shared between processes.
+    """
+    server = MetricsServer((addr, port), MetricsHandler)
+    process = multiprocessing.get_context("fork").Process(
+        target=server.serve_forever, name="derive.metrics.server", daemon=True
+    )
+    process.start()
+    server.server_close()
+    return server, process
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if len(request_line) < 2 or request_line[0] != "GET":
+            writer.write(b"HTTP/1.0 405 Method Not Allowed\r\nAllow: GET\r\n\r\n")
+            return
+        exporter, compress = negotiate(
+            headers.get("accept", ""), headers.get("accept-encoding", "")
+        )
+        names = query_names(request_line[1])
+        # collection blocks on the backend, keep it off the event loop
+        body = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: b"".join(exporter.stream(names=names))
+        )
+        head = [
+            "HTTP/1.0 200 OK",
+            f"Content-Type: {exporter.content_type}",
+        ]
+        if compress:
+            body = gzip.compress(body)
+            head.append("Content-Encoding: gzip")
+        head.append(f"Content-Length: {len(body)}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_asyncio_server(port: int, addr: Optional[str] = None):
+    """Serve the registry from the running event loop, collection runs in its default
+    executor. Returns the `asyncio.Server`."""
+    return await asyncio.start_server(_handle, addr, port)
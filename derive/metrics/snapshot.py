@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import gc
+import json
+import struct
+import sys
+import time
+from array import array
+from contextlib import contextmanager
+from itertools import accumulate, chain, count
+from operator import add
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from derive.metrics.backend import (
+    SEPARATOR,
+    FrozenBackend,
+    decode_key,
+    merge_values,
+)
+from derive.metrics.collector import GlobalCollector
+from derive.metrics.metric.base import (
+    EXEMPLAR_FIELD,
+    PID_FIELD,
+    Exemplar,
+    Metric,
+    Sample,
+    process_alive,
+)
+
+Entry = Tuple[
+    Metric, List[float], Optional[List[Sample]], Optional[Dict[int, Exemplar]]
+]
+
+# collected metrics are reused between collections, their values are read under it
+collection_lock = Lock()
+
+
+@contextmanager
+def collecting() -> Iterator[None]:
+    """Hold `collection_lock` with the cyclic garbage collector paused.
+
+    A collection allocates objects for every series which live until the next one, so
+    they would trigger several full collections of the heap along the way.
+    """
+    with collection_lock:
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            yield
+        finally:
+            if enabled:
+                gc.enable()
+
+
+class Snapshot:
+    """Values of every metric of the registry, read at one moment.
+
+    The backend is read with a single bulk call and the values of every metric are copied
+    into flat lists, in the order of `metric.sample_values()`. Metrics of a snapshot only
+    tell names and labels, later collections refresh their values. Samples are kept as
+    well for metrics whose samples change between collections, and exemplars by sample
+    index for metrics which have some.
+    """
+
+    __slots__ = ("timestamp", "metrics", "values", "samples", "exemplars")
+
+    def __init__(
+        self,
+        timestamp: float,
+        metrics: List[Metric],
+        values: List[List[float]],
+        samples: List[Optional[List[Sample]]],
+        exemplars: List[Optional[Dict[int, Exemplar]]],
+    ):
+        self.timestamp = timestamp
+        self.metrics = metrics
+        self.values = values
+        self.samples = samples
+        self.exemplars = exemplars
+
+    @classmethod
+    def of(cls, metrics: Iterable[Metric], timestamp: float) -> Snapshot:
+        """A snapshot of the current values of `metrics`."""
+        snapshot = cls(timestamp, [], [], [], [])
+        for metric in metrics:
+            snapshot.metrics.append(metric)
+            if metric.fixed_samples:
+                snapshot.values.append(metric.sample_values())
+                snapshot.samples.append(None)
+            else:
+                metric_samples = list(metric.samples())
+                snapshot.values.append([sample.value for sample in metric_samples])
+                snapshot.samples.append(metric_samples)
+            snapshot.exemplars.append(metric.sample_exemplars() or None)
+        return snapshot
+
+    @classmethod
+    def take(cls) -> Snapshot:
+        with collecting():
+            return cls.of(GlobalCollector.collect(), time.time())
+
+    def __len__(self) -> int:
+        return len(self.metrics)
+
+    def __iter__(self) -> Iterator[Entry]:
+        return zip(self.metrics, self.values, self.samples, self.exemplars)
+
+
+# magic, version, flags, timestamp
+_prefix = struct.Struct("<4sHHd")
+# then keys, specs, fields, bytes of specs and fields in version 1, and keys, families,
+# series, fields, bytes of families, series and fields since version 2
+_counts = {1: struct.Struct("<IIIII"), 2: struct.Struct("<IIIIIII")}
+MAGIC = b"DRVS"
+VERSION = 2
+
+_PID_KEY = SEPARATOR + PID_FIELD
+_EXEMPLAR_KEY = SEPARATOR + EXEMPLAR_FIELD
+# between the parameters and the labels of a spec, `[type, parameters, labels]`
+_LABELS = "}, {"
+_decoder = json.JSONDecoder()
+
+
+def _split_key(key: str) -> Tuple[str, str, str]:
+    """`key` split into the type and parameters, the labels and the field."""
+    spec, _, field = key.rpartition(SEPARATOR)
+    end = _decoder.raw_decode(spec, spec.index(", ") + 2)[1] - 1
+    return spec[:end], spec[end + len(_LABELS) :], field
+
+
+class BinarySnapshot:
+    """Stored values of the backend at one moment, to merge the state of several hosts
+    without going through the text exposition.
+
+    `values` holds the values of every field by backend key, as `Backend.items()` yields
+    them. Snapshots are merged like the values of processes: counts, histogram buckets
+    and summary sketches are summed, the latest exemplar wins. Values kept per process
+    are taken only from running processes, values of collectors are not stored.
+
+    The binary format stores the type and parameters of every metric family once, the
+    labels of every series and every field name once, followed by packed arrays of
+    family, series and field indexes, value counts and doubles, all little-endian.
+    """
+
+    __slots__ = ("timestamp", "values")
+
+    def __init__(self, timestamp: float, values: Dict[str, List[float]]):
+        self.timestamp = timestamp
+        self.values = values
+
+    @classmethod
+    def take(cls) -> BinarySnapshot:
+        from derive.metrics.manager import get_backend
+
+        timestamp = time.time()
+        values = {}
+        for key, key_values in get_backend().items():
+            if _PID_KEY in key and not process_alive(
+                int(key[key.rindex(_PID_KEY) + len(_PID_KEY) :])
+            ):
+                continue
+            values[key] = list(key_values)
+        return cls(timestamp, values)
+
+    def dumps(self) -> bytes:
+        # neither specs nor fields contain a newline, and every spec holds `_LABELS` once
+        # unless a label or parameter does too: split every key at once
+        parts = SEPARATOR.join(self.values).replace(_LABELS, SEPARATOR).split(SEPARATOR)
+        if len(parts) != 3 * len(self.values):
+            parts = list(chain.from_iterable(map(_split_key, self.values)))
+        families = dict(zip(dict.fromkeys(parts[::3]), count()))
+        series_names = list(zip(map(families.__getitem__, parts[::3]), parts[1::3]))
+        series = dict(zip(dict.fromkeys(series_names), count()))
+        field_names = parts[2::3]
+        fields = dict(zip(dict.fromkeys(field_names), count()))
+        family_bytes = SEPARATOR.join(families).encode("utf-8")
+        label_bytes = SEPARATOR.join([labels for _, labels in series]).encode("utf-8")
+        field_bytes = SEPARATOR.join(fields).encode("utf-8")
+        arrays: List[array] = [
+            array("I", [family for family, _ in series]),
+            array("I", map(series.__getitem__, series_names)),
+            array("I", map(fields.__getitem__, field_names)),
+            array("I", map(len, self.values.values())),
+            array("d", chain.from_iterable(self.values.values())),
+        ]
+        if sys.byteorder == "big":
+            for values_array in arrays:
+                values_array.byteswap()
+        return b"".join(
+            [
+                _prefix.pack(MAGIC, VERSION, 0, self.timestamp),
+                _counts[VERSION].pack(
+                    len(self.values),
+                    len(families),
+                    len(series),
+                    len(fields),
+                    len(family_bytes),
+                    len(label_bytes),
+                    len(field_bytes),
+                ),
+                family_bytes,
+                label_bytes,
+                field_bytes,
+                *(values_array.tobytes() for values_array in arrays),
+            ]
+        )
+
+    @classmethod
+    def loads(cls, data: bytes) -> BinarySnapshot:
+        if len(data) < _prefix.size or data[:4] != MAGIC:
+            raise ValueError("Not a derive snapshot")
+        _, version, _, timestamp = _prefix.unpack_from(data)
+        if version > VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        counts = _counts[version]
+        if len(data) < _prefix.size + counts.size:
+            raise ValueError("Truncated snapshot")
+        if version == 1:
+            # whole specs in place of the labels of the series
+            (
+                key_count,
+                spec_count,
+                field_count,
+                spec_size,
+                field_size,
+            ) = counts.unpack_from(data, _prefix.size)
+            family_count = family_size = 0
+        else:
+            (
+                key_count,
+                family_count,
+                spec_count,
+                field_count,
+                family_size,
+                spec_size,
+                field_size,
+            ) = counts.unpack_from(data, _prefix.size)
+        pos = _prefix.size + counts.size
+        sections = []
+        for size in (family_size, spec_size, field_size):
+            sections.append(data[pos : pos + size].decode("utf-8").split(SEPARATOR))
+            pos += size
+        families, specs, fields = sections
+        arrays: List[array] = []
+        for size in (
+            spec_count if family_count else 0,
+            key_count,
+            key_count,
+            key_count,
+        ):
+            arrays.append(array("I", data[pos : pos + 4 * size]))
+            pos += 4 * size
+        arrays.append(array("d", data[pos:]))
+        if sys.byteorder == "big":
+            for values_array in arrays:
+                values_array.byteswap()
+        series_families, spec_ids, field_ids, sizes, doubles = arrays
+        if (
+            len(sizes) != key_count
+            or len(families) != max(family_count, 1)
+            or len(specs) != max(spec_count, 1)
+            or len(fields) != max(field_count, 1)
+            or sum(sizes) * 8 != len(data) - pos
+        ):
+            raise ValueError("Truncated snapshot")
+        if family_count:
+            specs = list(
+                map(
+                    _LABELS.join, zip(map(families.__getitem__, series_families), specs)
+                )
+            )
+        fields = [SEPARATOR + field for field in fields]
+        ends = list(accumulate(sizes))
+        flat = doubles.tolist()
+        keys = map(
+            add, map(specs.__getitem__, spec_ids), map(fields.__getitem__, field_ids)
+        )
+        values = map(flat.__getitem__, map(slice, [0, *ends], ends))
+        return cls(timestamp, dict(zip(keys, values)))
+
+    @classmethod
+    def merge(cls, snapshots: Iterable[BinarySnapshot]) -> BinarySnapshot:
+        """A snapshot of the values of all `snapshots`, at the latest timestamp.
+
+        Values are never updated in place, lists of values left unmerged are shared with
+        `snapshots`."""
+        timestamp = 0.0
+        totals: Dict[str, List[float]] = {}
+        renamed = 0
+        for snapshot in snapshots:
+            timestamp = max(timestamp, snapshot.timestamp)
+            values = snapshot.values
+            common = totals.keys() & values.keys()
+            if not common:
+                totals.update(values)
+                continue
+            totals.update(
+                (key, key_values)
+                for key, key_values in values.items()
+                if key not in common
+            )
+            for key in common:
+                if _PID_KEY in key:
+                    # processes of different hosts with the same pid stay apart, under
+                    # negative pids
+                    spec = key.rpartition(SEPARATOR)[0]
+                    while True:
+                        renamed += 1
+                        new_key = f"{spec}{_PID_KEY}{-renamed}"
+                        if new_key not in totals:
+                            break
+                    totals[new_key] = values[key]
+                elif _EXEMPLAR_KEY in key:
+                    total = totals[key] = list(totals[key])
+                    merge_values(key, total, values[key])
+                else:
+                    totals[key] = list(map(add, totals[key], values[key]))
+        return cls(timestamp, totals)
+
+    def snapshot(self) -> Snapshot:
+        """A `Snapshot` of the metrics rebuilt from the values, for the exporters."""
+        specs: Dict[str, Dict[str, Sequence[float]]] = {}
+        for key, values in self.values.items():
+            spec, field = decode_key(key)
+            specs.setdefault(spec, {})[field] = values
+        metrics = []
+        for spec, fields in specs.items():
+            _type, parameters, labels = json.loads(spec)
+            metrics.append(
+                Metric.restore(
+                    _type, parameters, labels, FrozenBackend(fields, local=False)
+                )
+            )
+        return Snapshot.of(metrics, self.timestamp)
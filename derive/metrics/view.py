@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import typing
+import weakref
+from dataclasses import dataclass
+from threading import Lock
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+from derive.metrics.backend import FrozenBackend
+from derive.metrics.metric.base import Exemplar, Metric, Sample
+from derive.metrics.snapshot import Snapshot
+
+# types whose values can be summed sample by sample, summaries only without quantiles
+SUMMABLE = ("counter", "gauge", "histogram", "summary", "meter_rate")
+
+_MISSING = object()
+
+
+@dataclass(frozen=True)
+class View:
+    """Exports the series of the metrics named `name` aggregated: without the labels of
+    `drop_labels`, or with only those of `keep_labels`, under the name `rename`. Series
+    left with the same labels are summed."""
+
+    name: str
+    drop_labels: Collection[str] = ()
+    keep_labels: Optional[Collection[str]] = None
+    rename: Optional[str] = None
+
+    def labels(self, labels: Dict[str, str]) -> Dict[str, str]:
+        return {
+            key: value
+            for key, value in labels.items()
+            if key not in self.drop_labels
+            and (self.keep_labels is None or key in self.keep_labels)
+        }
+
+
+def summable(metric: Metric) -> bool:
+    return (
+        metric.fixed_samples
+        and metric._type in SUMMABLE
+        and not metric.parameters.get("quantiles")
+    )
+
+
+class Views:
+    """Applies views to snapshots, for an exporter with `views` or a snapshot of its own.
+
+    The aggregated series of every collected metric is looked up once and kept while the
+    metric is collected, so every snapshot only sums values into aggregated series whose
+    rendering is cached as well. Metrics without a view, and those whose values cannot be
+    summed such as quantiles, are exported unchanged.
+    """
+
+    def __init__(self, views: Iterable[View]):
+        self.views = {view.name: view for view in views}
+        self._lock = Lock()
+        # aggregated series of every collected metric, None without a view
+        self._targets: weakref.WeakKeyDictionary[
+            Metric, Optional[Metric]
+        ] = weakref.WeakKeyDictionary()
+        self._aggregated: Dict[
+            Tuple[str, str, Tuple[Tuple[str, str], ...]], Metric
+        ] = {}
+
+    def _target(self, metric: Metric) -> Optional[Metric]:
+        target = self._targets.get(metric, _MISSING)
+        if target is not _MISSING:
+            return typing.cast(Optional[Metric], target)
+        view = self.views.get(metric.name)
+        if view is None or not summable(metric):
+            target = None
+        else:
+            name = view.rename or metric.name
+            labels = view.labels(dict(metric._labels))
+            key = (metric._type, name, tuple(sorted(labels.items())))
+            target = self._aggregated.get(key)
+            if target is None:
+                target = self._aggregated[key] = Metric.restore(
+                    metric._type,
+                    dict(metric.parameters, name=name),
+                    labels,
+                    FrozenBackend({}),
+                )
+        self._targets[metric] = target
+        return target
+
+    def _prune(self, collected: Collection[Metric]):
+        # aggregated series left without collected metrics, e.g. removed or evicted ones
+        self._aggregated = {
+            key: target
+            for key, target in self._aggregated.items()
+            if target in collected
+        }
+        for metric, target in list(self._targets.items()):
+            if target is not None and target not in collected:
+                del self._targets[metric]
+
+    def apply(self, snapshot: Snapshot) -> Snapshot:
+        """A snapshot with the series of `snapshot` aggregated by the views."""
+        metrics: List[Metric] = []
+        values: List[List[float]] = []
+        samples: List[Optional[List[Sample]]] = []
+        exemplars: List[Optional[Dict[int, Exemplar]]] = []
+        positions: Dict[Metric, int] = {}
+        with self._lock:
+            for metric, metric_values, metric_samples, metric_exemplars in snapshot:
+                target = self._target(metric)
+                if target is None:
+                    metrics.append(metric)
+                    values.append(metric_values)
+                    samples.append(metric_samples)
+                    exemplars.append(metric_exemplars)
+                    continue
+                position = positions.get(target)
+                if position is None:
+                    positions[target] = len(metrics)
+                    metrics.append(target)
+                    values.append(list(metric_values))
+                    samples.append(None)
+                    exemplars.append(dict(metric_exemplars or {}) or None)
+                    continue
+                total = values[position]
+                for index, value in enumerate(metric_values):
+                    total[index] += value
+                if metric_exemplars:
+                    # the latest exemplar of the summed series
+                    merged = exemplars[position] or {}
+                    for index, exemplar in metric_exemplars.items():
+                        latest = merged.get(index)
+                        if latest is None or exemplar.timestamp > latest.timestamp:
+                            merged[index] = exemplar
+                    exemplars[position] = merged
+            if len(positions) < len(self._aggregated):
+                self._prune(positions)
+        return Snapshot(snapshot.timestamp, metrics, values, samples, exemplars)
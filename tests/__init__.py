@@ -1,6 +1,13 @@
 import asyncio
+import tempfile
+import unittest
 from functools import wraps
 
+from derive.metrics.backend import Backend
+from derive.metrics.backend.inprocess import InProcessBackend
+from derive.metrics.backend.multiprocess import MmapBackend
+from derive.metrics.manager import get_backend, set_backend
+
 
 def async_test(func):
     @wraps(func)
@@ -11,3 +18,25 @@ def async_test(func):
         asyncio.run(_())
 
     return wrapped
+
+
+class MetricsTestCase(unittest.TestCase):
+    """Stores the metrics of every test in a backend of its own, from `create_backend`,
+    and restores the previous backend afterwards."""
+
+    def create_backend(self) -> Backend:
+        return InProcessBackend()
+
+    def setUp(self):
+        self.addCleanup(set_backend, get_backend())
+        self.backend = self.create_backend()
+        set_backend(self.backend)
+
+
+class MmapTestCase(MetricsTestCase):
+    """Stores the metrics of every test in memory-mapped files of `self.directory`."""
+
+    def create_backend(self) -> Backend:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        return MmapBackend(self.directory.name)
@@ -0,0 +1,127 @@
+import unittest
+
+from opentelemetry.sdk.metrics.export import (
+    AggregationTemporality,
+    MetricExporter,
+    MetricExportResult,
+)
+
+from derive.integrations.otlp_metrics import DeltaMetricsBridge
+from derive.metrics import Counter, ExponentialHistogram, Gauge, Histogram, Summary
+from tests import MetricsTestCase
+
+
+class CollectingExporter(MetricExporter):
+    def __init__(self):
+        super().__init__()
+        self.exported = []
+        self.result = MetricExportResult.SUCCESS
+
+    def export(self, metrics_data, timeout_millis=10_000, **kwargs):
+        self.exported.append(metrics_data)
+        return self.result
+
+    def force_flush(self, timeout_millis=10_000):
+        return True
+
+    def shutdown(self, timeout_millis=30_000, **kwargs):
+        pass
+
+    def metrics(self):
+        (resource_metrics,) = self.exported[-1].resource_metrics
+        (scope_metrics,) = resource_metrics.scope_metrics
+        return {metric.name: metric.data for metric in scope_metrics.metrics}
+
+
+class DeltaMetricsBridgeTestCase(MetricsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.exporter = CollectingExporter()
+        self.bridge = DeltaMetricsBridge(self.exporter, start=False)
+
+    def test_counter_and_gauge(self):
+        c = Counter("test_otlp_counter", "Description of counter", {"method"})
+        g = Gauge("test_otlp_gauge", "Description of gauge")
+        c.labels(method="get").inc(2)
+        c.labels(method="post").inc()
+        g.set(5)
+        self.assertEqual(3, self.bridge.export())
+        data = self.exporter.metrics()
+        self.assertEqual(
+            AggregationTemporality.DELTA,
+            data["test_otlp_counter"].aggregation_temporality,
+        )
+        self.assertTrue(data["test_otlp_counter"].is_monotonic)
+        self.assertEqual(
+            {"get": 2.0, "post": 1.0},
+            {
+                point.attributes["method"]: point.value
+                for point in data["test_otlp_counter"].data_points
+            },
+        )
+        self.assertEqual(5.0, data["test_otlp_gauge"].data_points[0].value)
+
+        self.assertEqual(0, self.bridge.export())
+        self.assertEqual(1, len(self.exporter.exported))
+
+        c.labels(method="get").inc(3)
+        self.assertEqual(1, self.bridge.export())
+        data = self.exporter.metrics()
+        self.assertEqual(["test_otlp_counter"], list(data))
+        (point,) = data["test_otlp_counter"].data_points
+        self.assertEqual(3.0, point.value)
+        previous = self.exporter.exported[0].resource_metrics[0].scope_metrics[0]
+        self.assertEqual(
+            previous.metrics[0].data.data_points[0].time_unix_nano,
+            point.start_time_unix_nano,
+        )
+
+    def test_failed_export(self):
+        c = Counter("test_otlp_failed", "Description of counter")
+        c.inc()
+        self.exporter.result = MetricExportResult.FAILURE
+        with self.assertRaises(RuntimeError):
+            self.bridge.export()
+        c.inc()
+        self.exporter.result = MetricExportResult.SUCCESS
+        self.bridge.export()
+        (point,) = self.exporter.metrics()["test_otlp_failed"].data_points
+        self.assertEqual(2.0, point.value)
+
+    def test_histograms(self):
+        h = Histogram("test_otlp_histogram", "Latency", buckets=(1, 2))
+        s = Summary("test_otlp_summary", "Size")
+        e = ExponentialHistogram("test_otlp_exponential", "Latency", schema=0)
+        for value in (0.5, 1.5, 3):
+            h.observe(value)
+            s.observe(value)
+            e.observe(value)
+        self.bridge.export()
+        data = self.exporter.metrics()
+        (point,) = data["test_otlp_histogram"].data_points
+        self.assertEqual([1.0, 2.0], list(point.explicit_bounds))
+        self.assertEqual([1, 1, 1], list(point.bucket_counts))
+        self.assertEqual((3, 5.0), (point.count, point.sum))
+        (point,) = data["test_otlp_summary"].data_points
+        self.assertEqual((3, 5.0), (point.count, point.sum))
+        (point,) = data["test_otlp_exponential"].data_points
+        self.assertEqual(0, point.scale)
+        # (0.25, 0.5], (0.5, 1], (1, 2], (2, 4]
+        self.assertEqual(-2, point.positive.offset)
+        self.assertEqual([1, 0, 1, 1], list(point.positive.bucket_counts))
+
+        h.observe(1.5)
+        e.observe(1.5)
+        self.bridge.export()
+        data = self.exporter.metrics()
+        self.assertEqual({"test_otlp_histogram", "test_otlp_exponential"}, set(data))
+        (point,) = data["test_otlp_histogram"].data_points
+        self.assertEqual([0, 1, 0], list(point.bucket_counts))
+        (point,) = data["test_otlp_exponential"].data_points
+        self.assertEqual((1, 1.5), (point.count, point.sum))
+        self.assertEqual(0, point.positive.offset)
+        self.assertEqual([1], list(point.positive.bucket_counts))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,55 @@
 import unittest
+
+from opentelemetry.sdk.resources import Resource
+
+import derive
 from derive import logging
+from derive.log.record import DeriveLogRecord
 
 
 class LoggingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.resources = derive.get_global_resources()
+
+    def tearDown(self):
+        derive._global_resources = self.resources
+        derive._global_resource_attributes = None
+
     def test_log(self):
         logging.info("test")
 
+    def test_to_log_data(self):
+        record = DeriveLogRecord(
+            "test",
+            logging.INFO,
+            "/app/test.py",
+            10,
+            "message",
+            (),
+            None,
+            "f",
+            None,
+            {"user": 1},
+        )
+        data = record.to_log_data()
+        self.assertEqual("message", data["Body"])
+        self.assertEqual("10", data["Attributes"]["builtin_lineno"])
+        self.assertEqual("test.py", data["Attributes"]["builtin_filename"])
+        self.assertEqual("1", data["Attributes"]["user"])
+        self.assertNotIn("builtin_exc_info", data["Attributes"])
+
+        # every record gets its own copy of the resources
+        data["Resource"]["test.copy"] = "1"
+        self.assertNotIn("test.copy", record.to_log_data()["Resource"])
+        derive.update_global_resources(Resource({"test.resource": 1}))
+        self.assertEqual("1", record.to_log_data()["Resource"]["test.resource"])
+
+        class Record(DeriveLogRecord):
+            BUILTIN_RECORD_ATTRS = frozenset(("lineno",))
+
+        record = Record("test", logging.INFO, "/app/test.py", 10, "message", (), None)
+        self.assertEqual({"builtin_lineno": "10"}, record.to_log_data()["Attributes"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,456 @@
+import atexit
+import multiprocessing
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from time import monotonic
+from unittest import mock
+
+from opentelemetry.sdk.trace import TracerProvider
+
+from derive.metrics import Counter, ExponentialHistogram, Gauge, Histogram, Summary
+from derive.metrics.backend.buffered import BufferedBackend
+from derive.metrics.backend.manager import ManagerBackend
+from derive.metrics.backend.multiprocess import MmapBackend, MmapedDict, read_file
+from derive.metrics.collector import GlobalCollector
+from derive.metrics.metric import label
+from derive.metrics.manager import (
+    get_backend,
+    get_manager,
+    mark_process_dead,
+    set_backend,
+)
+from tests import MetricsTestCase, MmapTestCase
+
+name = "test_mmap_backend"
+document = "Description of counter"
+
+
+tracer = TracerProvider().get_tracer(__name__)
+
+
+def process_task(_):
+    Counter(name, document).inc(1)
+
+
+def exemplar_task(_):
+    with tracer.start_as_current_span("child"):
+        Counter(name, document).inc(1)
+
+
+def exponential_task(i):
+    h = ExponentialHistogram(
+        "test_mmap_exponential", "Latency", schema=2, max_buckets=2
+    )
+    for amount in (2, 1.5, 3):
+        h.observe(amount)
+
+
+def gauge_task(mode):
+    Gauge(f"test_gauge_{mode}", "Description of gauge", multiprocess_mode=mode).set(4)
+    return os.getpid()
+
+
+def persistent_task(directory, help=document, buckets=(1,)):
+    # a run of the application
+    set_backend(MmapBackend(directory, persistent=True))
+    Counter("test_persistent", help, {"method"}).labels(method="get").inc(2)
+    Histogram("test_persistent_histogram", "Latency", buckets=buckets).observe(0.5)
+
+
+def observe_task(_):
+    Summary("test_mmap_summary", "Latency", quantiles=(0.5,)).observe_many([0.2] * 10)
+
+
+class MmapBackendTestCase(MmapTestCase):
+    def test_aggregate_processes(self):
+        counter = Counter(name, document)
+        counter.inc(2)
+        with ProcessPoolExecutor(2) as worker:
+            list(worker.map(process_task, range(4)))
+        self.assertEqual(2.0, counter._count.get())
+
+        metrics = list(GlobalCollector.collect())
+        self.assertEqual(1, len(metrics))
+        self.assertEqual(f"{name}_total 6.0", list(metrics[0].samples())[0].data())
+
+    def test_latest_exemplar(self):
+        counter = Counter(name, document)
+        with ProcessPoolExecutor(1) as worker:
+            list(worker.map(exemplar_task, range(1)))
+        with tracer.start_as_current_span("parent") as span:
+            counter.inc(2)
+        (metric,) = GlobalCollector.collect()
+        (exemplar,) = metric.sample_exemplars().values()
+        self.assertEqual(
+            format(span.get_span_context().trace_id, "032x"), exemplar.trace_id
+        )
+        self.assertEqual(2.0, exemplar.value)
+
+    def test_gauge_modes(self):
+        # without a mode, every process writes to its own file as well
+        expected = {"sum": 5.0, "max": 4.0, "min": 1.0, "mostrecent": 4.0, None: 5.0}
+        for mode in expected:
+            Gauge(
+                f"test_gauge_{mode}", "Description of gauge", multiprocess_mode=mode
+            ).set(1)
+        with ProcessPoolExecutor(1) as worker:
+            list(worker.map(gauge_task, expected))
+        values = {
+            metric.parameters.get("multiprocess_mode"): metric.sample_values()[0]
+            for metric in GlobalCollector.collect()
+        }
+        self.assertEqual(expected, values)
+
+    def test_gauge_livesum(self):
+        gauge = Gauge(
+            "test_gauge_livesum", "Description of gauge", multiprocess_mode="livesum"
+        )
+        gauge.inc(1)
+        with ProcessPoolExecutor(1) as worker:
+            worker.submit(gauge_task, "livesum").result()
+            (metric,) = GlobalCollector.collect()
+            self.assertEqual("test_gauge_livesum 5.0", list(metric.samples())[0].data())
+        # the worker exited
+        (metric,) = GlobalCollector.collect()
+        self.assertEqual([1.0], metric.sample_values())
+
+        with self.assertRaises(ValueError):
+            Gauge("test_gauge_unknown", "Description of gauge", multiprocess_mode="avg")
+
+    def test_archive_exited_processes(self):
+        counter = Counter(name, document)
+        counter.inc(2)
+        with ProcessPoolExecutor(2) as worker:
+            list(worker.map(process_task, range(4)))
+            list(worker.map(gauge_task, ["sum"]))
+        self.assertEqual(2, len(get_backend().cleanup()))
+        self.assertEqual(
+            [f"metrics_{os.getpid()}.db", "metrics_archive.db", "metrics_archive.lock"],
+            sorted(os.listdir(self.directory.name)),
+        )
+        # counts are kept, gauges are dropped
+        (metric,) = GlobalCollector.collect()
+        self.assertEqual([6.0], metric.sample_values())
+
+        with ProcessPoolExecutor(1) as worker:
+            list(worker.map(process_task, range(1)))
+        # the next forked child archives the files of exited processes
+        with ProcessPoolExecutor(1) as worker:
+            list(worker.map(process_task, range(1)))
+        self.assertEqual(3, len(os.listdir(self.directory.name)) - 1)
+        (metric,) = GlobalCollector.collect()
+        self.assertEqual([8.0], metric.sample_values())
+
+    def test_persistent(self):
+        context = multiprocessing.get_context("fork")
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(2):
+                run = context.Process(target=persistent_task, args=(directory,))
+                run.start()
+                run.join()
+            set_backend(MmapBackend(directory, persistent=True))
+            # the files left by previous runs are archived
+            self.assertEqual(
+                [f"metrics_{os.getpid()}.db", "metrics_archive.db"],
+                sorted(path for path in os.listdir(directory) if path.endswith(".db")),
+            )
+            values = {
+                metric.name: metric.sample_values()
+                for metric in GlobalCollector.collect()
+            }
+            self.assertEqual([4.0], values["test_persistent"])
+            self.assertEqual([2.0, 2.0, 2.0, 1.0], values["test_persistent_histogram"])
+
+    def test_persistent_changes(self):
+        context = multiprocessing.get_context("fork")
+        with tempfile.TemporaryDirectory() as directory:
+            run = context.Process(target=persistent_task, args=(directory,))
+            run.start()
+            run.join()
+            # a restart with another help and other buckets
+            run = context.Process(
+                target=persistent_task, args=(directory, "Changed", (1, 10))
+            )
+            run.start()
+            run.join()
+            persistent_task(directory, "Changed", (1, 10))
+            samples = [
+                sample.data()
+                for metric in GlobalCollector.collect()
+                for sample in metric.samples()
+            ]
+            self.assertIn('test_persistent_total{method="get"} 6.0', samples)
+            self.assertEqual(
+                1, sum(sample.startswith("test_persistent_total") for sample in samples)
+            )
+            # counts of the old buckets are dropped
+            self.assertIn("test_persistent_histogram_count 2.0", samples)
+            self.assertEqual(
+                1,
+                sum(
+                    sample.startswith("test_persistent_histogram_count")
+                    for sample in samples
+                ),
+            )
+
+    def test_restore_histogram(self):
+        h = Histogram("test_mmap_histogram", "Request size (bytes)", buckets=(1, 10))
+        h.observe(5)
+        (metric,) = GlobalCollector.collect()
+        self.assertEqual(
+            [
+                'test_mmap_histogram_bucket{le="1.0"} 0.0',
+                'test_mmap_histogram_bucket{le="10.0"} 1.0',
+                'test_mmap_histogram_bucket{le="+Inf"} 1.0',
+                "test_mmap_histogram_count 1.0",
+                "test_mmap_histogram_sum 5.0",
+            ],
+            [sample.data() for sample in metric.samples()],
+        )
+
+    def test_restore_exponential_histogram(self):
+        h = ExponentialHistogram(
+            "test_mmap_exponential", "Latency", schema=2, max_buckets=2
+        )
+        with ProcessPoolExecutor(2) as worker:
+            list(worker.map(exponential_task, range(2)))
+        h.observe(0.5)
+        (metric,) = GlobalCollector.collect()
+        schema, positive, negative = metric.native()
+        # processes downscaled to schema 1 on their own, the merged buckets further
+        self.assertEqual(-1, schema)
+        self.assertEqual({0: 1.0, 1: 6.0}, positive)
+        self.assertEqual(7.0, metric.sample_values()[-2])
+
+    def test_remove(self):
+        c = Counter("test_mmap_remove", "Description of counter", {"method"})
+        c.labels(method="get").inc()
+        c.remove(method="get")
+        self.assertEqual([], list(GlobalCollector.collect()))
+
+        c.labels(method="get").inc(2)
+        (metric,) = GlobalCollector.collect()
+        self.assertEqual(
+            'test_mmap_remove_total{method="get"} 2.0',
+            list(metric.samples())[0].data(),
+        )
+
+        # a removed child still held does not write into the entry of its successor
+        c = Counter("test_mmap_evict", "Description of counter", {"user"}, max_series=1)
+        evicted = c.labels(user="a")
+        c.labels(user="b")
+        # takes the entry of the first child
+        c.labels(user="c").inc(7)
+        evicted.inc(100)
+        values = {
+            sample.labels["user"]: sample.value
+            for metric in GlobalCollector.collect()
+            if metric.name == "test_mmap_evict"
+            for sample in metric.samples()
+        }
+        self.assertEqual({"c": 7.0}, values)
+
+    def test_mmaped_dict(self):
+        path = f"{self.directory.name}/test.db"
+        d = MmapedDict(path)
+        positions = [d.position(f"key_{i}" * 100) for i in range(5000)]
+        for i, pos in enumerate(positions):
+            d.write(pos, i)
+        d.close()
+
+        d = MmapedDict(path)
+        self.assertEqual((4999.0,), d.read(d.position("key_4999" * 100)))
+        d.remove("key_4999" * 100)
+        d.close()
+
+        d = MmapedDict(path)
+        self.assertEqual((0.0,), d.read(d.position("key_4999" * 100)))
+        # removed entries are reused by keys of the same shape
+        pos = d.position("window_1", 3)
+        d.remove("window_1", 3)
+        used = d._used
+        self.assertEqual(pos, d.position("window_2", 3))
+        self.assertEqual(used, d._used)
+        d.close()
+        self.assertEqual(
+            [("window_2", (0.0, 0.0, 0.0))],
+            [item for item in read_file(path) if item[0].startswith("window")],
+        )
+
+    def test_summary_quantiles(self):
+        s = Summary("test_mmap_summary", "Latency", quantiles=(0.5,))
+        s.observe_many([0.1] * 10)
+        with ProcessPoolExecutor(2) as worker:
+            list(worker.map(observe_task, range(4)))
+        (metric,) = GlobalCollector.collect()
+        p50, count, _ = metric.sample_values()
+        self.assertAlmostEqual(0.2, p50, delta=0.2 * 0.01)
+        self.assertEqual(50.0, count)
+
+
+class ManagerBackendTestCase(MetricsTestCase):
+    def create_backend(self):
+        return ManagerBackend(get_manager())
+
+    def samples(self, name):
+        return [
+            sample.data()
+            for metric in GlobalCollector.collect()
+            if metric.name == name
+            for sample in metric.samples()
+        ]
+
+    def test_ttl(self):
+        c = Counter("test_manager_ttl", "Description of counter", {"tenant"}, ttl=60)
+        c.labels(tenant="a").inc()
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.read(r, 1)
+                c.labels(tenant="a").inc(2)
+            finally:
+                os._exit(0)
+        os.close(r)
+        # stale in this process, which removes the shared values
+        later = monotonic() + 120
+        with mock.patch.object(label, "monotonic", return_value=later):
+            self.assertEqual([], self.samples("test_manager_ttl"))
+        # another process still updating the child exports it again
+        os.write(w, b"x")
+        os.close(w)
+        os.waitpid(pid, 0)
+        with mock.patch.object(label, "monotonic", return_value=later + 1):
+            for _ in range(2):
+                self.assertEqual(
+                    ['test_manager_ttl_total{tenant="a"} 2.0'],
+                    self.samples("test_manager_ttl"),
+                )
+
+
+class BufferedBackendTestCase(MetricsTestCase):
+    def create_backend(self):
+        backend = BufferedBackend(ManagerBackend(get_manager()), interval=3600)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_flush(self):
+        c = Counter("test_buffered_counter", "Description of counter")
+        g = Gauge("test_buffered_gauge", "Description of gauge")
+        c.inc()
+        c.inc(2)
+        g.inc(5)
+        g.set(1)
+        g.inc()
+        self.assertEqual(3.0, c._count.get())
+        self.assertEqual(2.0, g._count.get())
+        self.assertEqual(0.0, c._count._value.get())
+        self.assertEqual(2, len(self.backend.pending))
+
+        self.backend.flush()
+        self.assertEqual({}, self.backend.pending)
+        self.assertEqual(3.0, c._count._value.get())
+        self.assertEqual(3.0, c._count.get())
+        self.assertEqual(2.0, g._count.get())
+
+    def test_remove(self):
+        c = Counter("test_buffered_remove", "Description of counter", {"method"})
+        child = c.labels(method="get")
+        child.inc()
+        self.backend.flush()
+
+        def keys():
+            return [
+                key for key, _ in self.backend.items() if "test_buffered_remove" in key
+            ]
+
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.read(r, 1)
+                # this process still holds the child
+                child.inc(3)
+            finally:
+                atexit._run_exitfuncs()
+                os._exit(0)
+        os.close(r)
+        # the pending update of this process is dropped with the child
+        child.inc(2)
+        c.remove(method="get")
+        self.backend.flush()
+        self.assertEqual([], keys())
+
+        # the values are shared, the next update of another process exports them again
+        os.write(w, b"x")
+        os.close(w)
+        os.waitpid(pid, 0)
+        self.assertEqual(1, len(keys()))
+        self.assertEqual(3.0, c.labels(method="get")._count.get())
+
+    def test_exemplar(self):
+        h = Histogram("test_buffered_histogram", "Latency", buckets=(1,))
+        with tracer.start_as_current_span("test"):
+            h.observe(0.5)
+        self.assertEqual(2, len(self.backend.pending))
+        self.backend.flush()
+        (metric,) = [
+            m for m in GlobalCollector.collect() if m.name == "test_buffered_histogram"
+        ]
+        self.assertEqual([0], list(metric.sample_exemplars()))
+        self.assertEqual(0.5, metric.sample_exemplars()[0].value)
+
+    def test_aggregate_processes(self):
+        counter = Counter(name, document)
+        with ProcessPoolExecutor(2) as worker:
+            list(worker.map(process_task, range(4)))
+        # children flush at exit
+        self.assertEqual(4.0, counter._count.get())
+
+        # also children forked without `multiprocessing`
+        pid = os.fork()
+        if pid == 0:
+            try:
+                counter.inc()
+            finally:
+                # what a normal exit does, without leaving the test run
+                atexit._run_exitfuncs()
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(5.0, counter._count.get())
+
+    def test_gauge_modes(self):
+        gauge = Gauge("test_gauge_max", "Description of gauge", multiprocess_mode="max")
+        gauge.set(1)
+        with ProcessPoolExecutor(1) as worker:
+            (pid,) = worker.map(gauge_task, ["max"])
+        # the value of the parent is shared with its children, not removed by them
+        (metric,) = [
+            metric
+            for metric in GlobalCollector.collect()
+            if metric.name == "test_gauge_max"
+        ]
+        self.assertEqual([4.0], metric.sample_values())
+        mark_process_dead(pid)
+        (metric,) = [
+            metric
+            for metric in GlobalCollector.collect()
+            if metric.name == "test_gauge_max"
+        ]
+        self.assertEqual([1.0], metric.sample_values())
+
+    def test_collect(self):
+        c = Counter("test_buffered_collect", "Description of counter")
+        c.inc(4)
+        samples = [
+            sample.data()
+            for metric in GlobalCollector.collect()
+            for sample in metric.samples()
+        ]
+        self.assertIn("test_buffered_collect_total 4.0", samples)
+
+
+if __name__ == "__main__":
+    unittest.main()
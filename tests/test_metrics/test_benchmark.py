@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks import metrics
+from tests import MetricsTestCase
+
+
+class BenchmarkTestCase(MetricsTestCase):
+    def test_results(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            args = [
+                "--backend",
+                "mmap",
+                "--operations",
+                "counter.inc",
+                "labels",
+                "--workers",
+                "2",
+                "--iterations",
+                "100",
+                "--batch",
+                "10",
+                "--series",
+                "10",
+                "--repeat",
+                "2",
+            ]
+            results = metrics.main([*args, "--output", output])
+            with open(output) as f:
+                self.assertEqual(results, json.load(f))
+            self.assertEqual(
+                [
+                    ("counter.inc", "single"),
+                    ("counter.inc", "threads"),
+                    ("counter.inc", "processes"),
+                    ("labels", "single"),
+                    ("labels", "threads"),
+                    ("labels", "processes"),
+                ],
+                [(r["operation"], r["mode"]) for r in results["operations"]],
+            )
+            self.assertEqual(200, results["operations"][1]["ops"])
+            self.assertEqual([10], [r["series"] for r in results["scrape"]])
+            self.assertEqual(7, len(metrics.compare(results, results, 0.1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
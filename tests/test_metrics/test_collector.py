@@ -2,8 +2,9 @@ import unittest
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
-from derive.metrics.metric import Counter
-from derive.metrics.collector import GlobalCollector
+from derive.metrics.metric import Counter, Gauge, base
+from derive.metrics.collector import Collector, GlobalCollector
+from tests import MetricsTestCase
 
 name = "test_collector"
 document = "Description of counter"
@@ -33,5 +34,49 @@ class CollectorTestCase(unittest.TestCase):
         self.assertEqual(1, len(list(GlobalCollector.collect())))
 
 
+class QueueCollector(Collector):
+    def __init__(self, queue):
+        self.queue = queue
+
+    def collect(self):
+        g = base.Gauge.detached("test_queue_depth", "Queue depth", {"queue": "jobs"})
+        g.set(len(self.queue))
+        yield g
+
+
+class CallbackTestCase(MetricsTestCase):
+    def exported(self):
+        return [
+            sample.data()
+            for metric in GlobalCollector.collect()
+            for sample in metric.samples()
+        ]
+
+    def test_collector(self):
+        queue = [1, 2]
+        collector = QueueCollector(queue)
+        GlobalCollector.register_collector(collector)
+        try:
+            self.assertEqual(['test_queue_depth{queue="jobs"} 2.0'], self.exported())
+            queue.append(3)
+            self.assertEqual(['test_queue_depth{queue="jobs"} 3.0'], self.exported())
+        finally:
+            GlobalCollector.unregister_collector(collector)
+        self.assertEqual([], self.exported())
+
+    def test_set_function(self):
+        cache = {"a": 1}
+        g = Gauge("test_cache_size", "Cache size", {"cache"})
+        child = g.labels(cache="users")
+        child.set_function(lambda: len(cache))
+        try:
+            cache["b"] = 2
+            self.assertEqual(['test_cache_size{cache="users"} 2.0'], self.exported())
+            child.set_function(lambda: -1)
+            self.assertEqual(['test_cache_size{cache="users"} -1.0'], self.exported())
+        finally:
+            GlobalCollector.unregister_collector(child._function_collector)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,262 @@
+import gc
+import io
+import socket
+import struct
+import unittest
+from unittest import mock
+
+from derive.metrics import Counter, ExponentialHistogram, Histogram, Summary
+from derive.metrics.collector import Collector, GlobalCollector
+from derive.metrics.metric import base
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.trace import INVALID_SPAN_CONTEXT, NonRecordingSpan, use_span
+
+from derive.metrics.exporter import OpenMetricsExporter, PrometheusExporter
+from derive.metrics.snapshot import BinarySnapshot, Snapshot
+from derive.metrics.view import View, Views
+from tests import MmapTestCase
+
+
+class PrometheusExporterTestCase(MmapTestCase):
+    def test_generate_latest(self):
+        c = Counter("test_export_counter", "Description of counter", {"method"})
+        c.labels(method="get").inc(2)
+        h = Histogram("test_export_histogram", "Request size", buckets=(1, 10))
+        h.observe(5)
+        Summary("test_export_summary", "Request size").observe(3)
+
+        expected = "".join(
+            f"{line}\n"
+            for metric in GlobalCollector.collect()
+            for line in metric.export()
+        )
+        self.assertEqual(expected, PrometheusExporter.generate_latest())
+        self.assertIn('test_export_counter_total{method="get"} 2.0\n', expected)
+        self.assertIn('test_export_histogram_bucket{le="10.0"} 1.0\n', expected)
+
+        # collected metrics and their rendered prefixes are reused, values are refreshed
+        c.labels(method="get").inc()
+        h.observe(20)
+        output = PrometheusExporter.generate_latest()
+        self.assertIn('test_export_counter_total{method="get"} 3.0\n', output)
+        self.assertIn('test_export_histogram_bucket{le="+Inf"} 2.0\n', output)
+        self.assertIn("test_export_histogram_sum 25.0\n", output)
+
+        c.remove(method="get")
+        self.assertNotIn("test_export_counter", PrometheusExporter.generate_latest())
+
+    def test_stream(self):
+        for i in range(100):
+            Counter(f"test_export_stream_{i}", "Description of counter").inc(i)
+        chunks = list(PrometheusExporter.stream(chunk_size=1024))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(chunk.endswith(b"\n") for chunk in chunks))
+        self.assertEqual(
+            PrometheusExporter.generate_latest().encode("utf-8"), b"".join(chunks)
+        )
+
+    def test_snapshot(self):
+        c = Counter("test_export_snapshot", "Description of counter", {"method"})
+        c.labels(method="get").inc()
+        e = ExponentialHistogram("test_export_snapshot_exponential", "Latency")
+        e.observe(1)
+        snapshot = Snapshot.take()
+        self.assertEqual(2, len(snapshot))
+        self.assertEqual(
+            {
+                "test_export_snapshot": [1.0],
+                "test_export_snapshot_exponential": [1.0, 1.0, 1.0, 1.0],
+            },
+            {metric.name: values for metric, values, *_ in snapshot},
+        )
+        expected = PrometheusExporter.generate_latest(snapshot=snapshot)
+
+        # later updates and collections do not change a snapshot
+        c.labels(method="get").inc()
+        c.labels(method="post").inc()
+        e.observe(100)
+        self.assertIn(
+            'test_export_snapshot_total{method="get"} 2.0\n',
+            PrometheusExporter.generate_latest(),
+        )
+        self.assertEqual(
+            expected, PrometheusExporter.generate_latest(snapshot=snapshot)
+        )
+        self.assertIn('test_export_snapshot_total{method="get"} 1.0\n', expected)
+        self.assertNotIn("post", expected)
+
+        # the garbage collector is paused while collecting only
+        paused = base.Gauge.detached(
+            "test_export_snapshot_paused", "Whether gc is paused"
+        )
+        collector = mock.Mock(spec=Collector)
+        collector.collect.side_effect = lambda: [] if gc.isenabled() else [paused]
+        GlobalCollector.register_collector(collector)
+        try:
+            self.assertIn(paused, Snapshot.take().metrics)
+        finally:
+            GlobalCollector.unregister_collector(collector)
+        self.assertTrue(gc.isenabled())
+
+    def test_binary_snapshot(self):
+        c = Counter("test_export_binary", "Description of counter", {"method"})
+        c.labels(method="get").inc(2)
+        h = Histogram("test_export_binary_histogram", "Latency", buckets=(1, 10))
+        h.observe(5)
+        data = BinarySnapshot.take().dumps()
+        snapshot = BinarySnapshot.loads(data)
+        self.assertEqual(BinarySnapshot.take().values, snapshot.values)
+
+        # another host
+        c.labels(method="get").inc()
+        c.labels(method="post").inc()
+        h.observe(0.5)
+        merged = BinarySnapshot.merge([snapshot, BinarySnapshot.take()])
+        output = PrometheusExporter.generate_latest(snapshot=merged.snapshot())
+        self.assertIn('test_export_binary_total{method="get"} 5.0\n', output)
+        self.assertIn('test_export_binary_total{method="post"} 1.0\n', output)
+        self.assertIn('test_export_binary_histogram_bucket{le="1.0"} 1.0\n', output)
+        self.assertIn('test_export_binary_histogram_bucket{le="10.0"} 3.0\n', output)
+        self.assertIn("test_export_binary_histogram_sum 10.5\n", output)
+
+        with self.assertRaises(ValueError):
+            BinarySnapshot.loads(b"DRVX" + data[4:])
+        with self.assertRaises(ValueError):
+            BinarySnapshot.loads(data[:-8])
+
+        # labels holding what separates them from the parameters
+        c.labels(method='"}, {"').inc()
+        snapshot = BinarySnapshot.take()
+        self.assertEqual(snapshot.values, BinarySnapshot.loads(snapshot.dumps()).values)
+
+        # version 1 stored every spec whole
+        spec, _, field = next(
+            key for key in snapshot.values if '"get"' in key
+        ).rpartition("\n")
+        data = b"".join(
+            [
+                struct.pack(
+                    "<4sHHdIIIII", b"DRVS", 1, 0, 1.0, 1, 1, 1, len(spec), len(field)
+                ),
+                spec.encode("utf-8"),
+                field.encode("utf-8"),
+                struct.pack("<IIId", 0, 0, 1, 3.0),
+            ]
+        )
+        self.assertEqual({f"{spec}\n{field}": [3.0]}, BinarySnapshot.loads(data).values)
+
+    def test_exemplars(self):
+        tracer = TracerProvider().get_tracer(__name__)
+        Counter("test_export_no_exemplar", "Description of counter").inc()
+        # e.g. a span of an incoming request without a usable trace context
+        with use_span(NonRecordingSpan(INVALID_SPAN_CONTEXT)):
+            Counter("test_export_invalid_exemplar", "Description of counter").inc()
+        self.assertNotIn("trace_id", OpenMetricsExporter.generate_latest())
+
+        c = Counter("test_export_exemplar", "Description of counter")
+        h = Histogram("test_export_exemplar_histogram", "Latency", buckets=(1, 10))
+        with tracer.start_as_current_span("test") as span:
+            c.inc(2)
+            h.observe(5)
+            h.observe(7)  # the bucket records at most one exemplar per second
+        c.inc()
+        h.observe(0.5)
+        trace_id = format(span.get_span_context().trace_id, "032x")
+        output = OpenMetricsExporter.generate_latest()
+        self.assertIn(
+            f'test_export_exemplar_total 3.0 # {{trace_id="{trace_id}"}} 2.0 ', output
+        )
+        self.assertIn(
+            'test_export_exemplar_histogram_bucket{le="10.0"} 3.0 '
+            f'# {{trace_id="{trace_id}"}} 5.0 ',
+            output,
+        )
+        self.assertIn('test_export_exemplar_histogram_bucket{le="1.0"} 1.0\n', output)
+        self.assertNotIn("trace_id", PrometheusExporter.generate_latest())
+
+    def test_views(self):
+        class AggregatedExporter(PrometheusExporter):
+            views = Views(
+                [
+                    View("test_export_view", drop_labels={"path"}),
+                    View(
+                        "test_export_view_histogram",
+                        keep_labels=(),
+                        rename="test_export_view_latency",
+                    ),
+                    View("test_export_view_summary", drop_labels={"method"}),
+                ]
+            )
+
+        c = Counter("test_export_view", "Requests", {"method", "path"})
+        c.labels(method="get", path="/a").inc()
+        c.labels(method="get", path="/b").inc(2)
+        c.labels(method="post", path="/a").inc()
+        h = Histogram("test_export_view_histogram", "Latency", {"path"}, buckets=(1,))
+        h.labels(path="/a").observe(0.5)
+        h.labels(path="/b").observe(2)
+        s = Summary("test_export_view_summary", "Size", {"method"}, quantiles=(0.5,))
+        s.labels(method="get").observe(1)
+        s.labels(method="post").observe(1)
+        self.assertEqual(
+            "# HELP test_export_view_total Requests\n"
+            "# TYPE test_export_view_total counter\n"
+            'test_export_view_total{method="get"} 3.0\n'
+            'test_export_view_total{method="post"} 1.0\n'
+            "# HELP test_export_view_latency Latency\n"
+            "# TYPE test_export_view_latency histogram\n"
+            'test_export_view_latency_bucket{le="1.0"} 1.0\n'
+            'test_export_view_latency_bucket{le="+Inf"} 2.0\n'
+            "test_export_view_latency_count 2.0\n"
+            "test_export_view_latency_sum 2.5\n",
+            AggregatedExporter.generate_latest(
+                names=["test_export_view_total", "test_export_view_latency_count"]
+            ),
+        )
+        # quantiles cannot be summed, the series are exported unchanged
+        output = AggregatedExporter.generate_latest(names=["test_export_view_summary"])
+        self.assertIn('test_export_view_summary_count{method="post"} 1.0', output)
+
+        c.labels(method="get", path="/c").inc()
+        self.assertIn(
+            'test_export_view_total{method="get"} 4.0\n',
+            AggregatedExporter.generate_latest(),
+        )
+        self.assertIn(
+            'test_export_view_total{method="get",path="/c"} 1.0\n',
+            PrometheusExporter.generate_latest(),
+        )
+
+        # aggregated series of removed series are dropped
+        c.remove(method="post", path="/a")
+        self.assertNotIn(
+            'test_export_view_total{method="post"}',
+            AggregatedExporter.generate_latest(),
+        )
+        self.assertEqual(
+            [(("method", "get"),)],
+            [
+                labels
+                for _, name, labels in AggregatedExporter.views._aggregated
+                if name == "test_export_view"
+            ],
+        )
+
+    def test_write(self):
+        Counter("test_export_write", "Description of counter").inc()
+        expected = PrometheusExporter.generate_latest().encode("utf-8")
+
+        f = io.BytesIO()
+        PrometheusExporter.write(f)
+        self.assertEqual(expected, f.getvalue())
+
+        a, b = socket.socketpair()
+        with a, b:
+            PrometheusExporter.write(a)
+            a.shutdown(socket.SHUT_WR)
+            received = b"".join(iter(lambda: b.recv(4096), b""))
+        self.assertEqual(expected, received)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import derive
+from derive.config import DefaultConfig
+from derive.metrics import Counter, Histogram
+from derive.metrics.backend.buffered import BufferedBackend
+from derive.metrics.backend.inprocess import InProcessBackend
+from derive.metrics.backend.multiprocess import MmapBackend
+from derive.metrics.collector import GlobalCollector
+from derive.metrics.manager import configure, create_backend, get_backend
+from tests import MetricsTestCase
+
+
+class ManagerTestCase(MetricsTestCase):
+    def test_lazy_import(self):
+        code = (
+            "import multiprocessing, derive.metrics;"
+            "assert not multiprocessing.active_children()"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+    def test_create_backend(self):
+        self.assertIsInstance(create_backend("inprocess"), InProcessBackend)
+        backend = create_backend("inprocess", buffer_interval=3600)
+        self.assertIsInstance(backend, BufferedBackend)
+        backend.close()
+        with self.assertRaises(ValueError):
+            create_backend("mmap")
+        with self.assertRaises(ValueError):
+            create_backend("redis")
+        with self.assertRaises(ValueError):
+            create_backend("manager", persistent=True)
+
+    def test_inprocess(self):
+        c = Counter("test_inprocess_counter", "Description of counter", {"method"})
+        c.labels(method="get").inc(2)
+        c.labels(method="post").inc()
+        Histogram("test_inprocess_histogram", "Latency", buckets=(1,)).observe(0.5)
+        c.remove(method="post")
+        self.assertEqual(
+            [
+                'test_inprocess_counter_total{method="get"} 2.0',
+                'test_inprocess_histogram_bucket{le="1.0"} 1.0',
+                'test_inprocess_histogram_bucket{le="+Inf"} 1.0',
+                "test_inprocess_histogram_count 1.0",
+                "test_inprocess_histogram_sum 0.5",
+            ],
+            [
+                sample.data()
+                for metric in GlobalCollector.collect()
+                for sample in metric.samples()
+            ],
+        )
+
+    def test_configure(self):
+        c = Counter("test_configure", "Description of counter")
+        c.inc()
+        with tempfile.TemporaryDirectory() as directory:
+            config = DefaultConfig()
+            config.METRICS_BACKEND = "mmap"
+            config.METRICS_DIRECTORY = directory
+            derive.init(config)
+            backend = get_backend()
+            self.assertIsInstance(backend, MmapBackend)
+            # metrics created before are moved to the configured backend
+            self.assertIs(c, backend.metrics_mapping["test_configure"])
+            c.inc(2)
+            (metric,) = GlobalCollector.collect()
+            self.assertEqual(
+                "test_configure_total 2.0", list(metric.samples())[0].data()
+            )
+
+            configure(config)
+            self.assertIs(backend, get_backend())
+            config.METRICS_BACKEND = ""
+            configure(config)
+            self.assertIs(backend, get_backend())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,21 @@
+import math
 import unittest
 from time import sleep
+from unittest import mock
+
 from derive.metrics import (
     Counter,
     Summary,
     Gauge,
     Histogram,
+    ExponentialHistogram,
+    Meter,
 )
+from derive.metrics.collector import GlobalCollector
+from derive.metrics.metric import base, label, meter
 from derive.metrics.metric.base import Sample, float_to_string
+from derive.metrics.metric.sketch import DDSketch
+from tests import MetricsTestCase
 
 
 class MetricTestCase(unittest.TestCase):
@@ -144,6 +153,175 @@ class MetricTestCase(unittest.TestCase):
         self.assertEqual(f"{name}_sum", sum_sample.name)
         self.assertEqual(512.0, sum_sample.value)
 
+    def test_histogram_buckets(self):
+        h = Histogram("test_histogram_buckets", "Latency", {"method"}, buckets=(1, 2))
+        child = h.labels(method="get")
+        for amount in (0.5, 1, 1.5, 2, 3):
+            child.observe(amount)
+        self.assertEqual(
+            [
+                'test_histogram_buckets_bucket{le="1.0",method="get"} 2.0',
+                'test_histogram_buckets_bucket{le="2.0",method="get"} 4.0',
+                'test_histogram_buckets_bucket{le="+Inf",method="get"} 5.0',
+                'test_histogram_buckets_count{method="get"} 5.0',
+                'test_histogram_buckets_sum{method="get"} 8.0',
+            ],
+            [sample.data() for sample in child.samples()],
+        )
+
+    def test_observe_many(self):
+        amounts = [0.5, 1, 1.5, 2, 3]
+        for use_numpy in (True, False):
+            h = Histogram(f"test_observe_many_{use_numpy}", "Latency", buckets=(1, 2))
+            s = Summary(f"test_observe_many_summary_{use_numpy}", "Latency")
+            with mock.patch.object(base, "numpy", base.numpy if use_numpy else None):
+                h.observe_many(amounts)
+                h.observe_many([])
+                s.observe_many(amounts)
+            self.assertEqual(
+                [2.0, 4.0, 5.0, 5.0, 8.0], [sample.value for sample in h.samples()]
+            )
+            self.assertEqual([5.0, 8.0], [sample.value for sample in s.samples()])
+
+    def test_observe_nan(self):
+        nan = float("nan")
+        for use_numpy in (True, False):
+            h = Histogram(f"test_observe_nan_{use_numpy}", "Latency", buckets=(1, 2))
+            s = Summary(f"test_observe_nan_summary_{use_numpy}", "Latency")
+            with mock.patch.object(base, "numpy", base.numpy if use_numpy else None):
+                h.observe(0.5)
+                s.observe(0.5)
+                for metric in (h, s):
+                    with self.assertRaises(ValueError):
+                        metric.observe(nan)
+                    with self.assertRaises(ValueError):
+                        metric.observe_many([1.5, nan])
+                    if use_numpy:
+                        with self.assertRaises(ValueError):
+                            metric.observe_many(base.numpy.array([1.5, nan]))
+            # no bucket, count or sum took the NaN or the amounts observed with it
+            self.assertEqual(
+                [1.0, 1.0, 1.0, 1.0, 0.5], [sample.value for sample in h.samples()]
+            )
+            self.assertEqual([1.0, 0.5], [sample.value for sample in s.samples()])
+
+    def test_summary_quantiles(self):
+        s = Summary(
+            "test_summary_quantiles",
+            "Latency",
+            {"method"},
+            quantiles=(0.5, 0.99),
+            max_age_seconds=60,
+            age_buckets=3,
+        )
+        child = s.labels(method="get")
+        with mock.patch.object(base.time, "time", return_value=1000.0):
+            for i in range(1, 1001):
+                child.observe(i / 1000)
+            child.observe_many([0.5] * 1000)
+            samples = list(child.samples())
+        self.assertEqual(
+            [
+                'test_summary_quantiles{method="get",quantile="0.5"}',
+                'test_summary_quantiles{method="get",quantile="0.99"}',
+            ],
+            [sample.data().rpartition(" ")[0] for sample in samples[:2]],
+        )
+        self.assertAlmostEqual(0.5, samples[0].value, delta=0.5 * 0.01)
+        self.assertAlmostEqual(0.98, samples[1].value, delta=0.98 * 0.01)
+        self.assertEqual(2000.0, samples[2].value)
+
+        # observations older than `max_age_seconds` are dropped window by window
+        with mock.patch.object(base.time, "time", return_value=1030.0):
+            child.observe(2)
+            self.assertAlmostEqual(0.5, child.sample_values()[0], delta=0.5 * 0.01)
+        with mock.patch.object(base.time, "time", return_value=1070.0):
+            values = child.sample_values()
+        self.assertAlmostEqual(2, values[0], delta=2 * 0.01)
+        self.assertEqual(2001.0, values[2])
+
+    def test_sketch_merge(self):
+        sketch = DDSketch(0.01, 1e-6, 1e4)
+        a, b = [0.0] * sketch.size, [0.0] * sketch.size
+        for value in range(1, 501):
+            a[sketch.index(value)] += 1
+        for index, count in sketch.counts(range(501, 1001)):
+            b[index] += count
+        merged = [x + y for x, y in zip(a, b)]
+        p50, p90 = sketch.quantiles(merged, (0.5, 0.9))
+        self.assertAlmostEqual(500, p50, delta=500 * 0.01)
+        self.assertAlmostEqual(900, p90, delta=900 * 0.01)
+        self.assertEqual(0, sketch.index(-1))
+        self.assertEqual(sketch.size - 1, sketch.index(1e9))
+        self.assertEqual(sketch.size - 1, sketch.index(float("inf")))
+
+    def test_summary_non_finite(self):
+        s = Summary("test_summary_non_finite", "Latency", quantiles=(0.5,))
+        s.observe(float("inf"))
+        s.observe_many([float("inf")])
+        # NaN is rejected before the count or the sum is updated
+        with self.assertRaises(ValueError):
+            s.observe(float("nan"))
+        with self.assertRaises(ValueError):
+            s.observe_many([1.0, float("nan")])
+        self.assertEqual(2.0, s._count.get())
+        self.assertEqual(float("inf"), s._sum.get())
+
+    def test_exponential_histogram(self):
+        h = ExponentialHistogram("test_exponential_histogram", "Latency", schema=0)
+        for amount in (1, 2, 3, 4, 0, -1):
+            h.observe(amount)
+        self.assertEqual((0, {0: 1.0, 1: 1.0, 2: 2.0}, {0: 1.0}), h.native())
+        self.assertEqual(
+            [
+                'test_exponential_histogram_bucket{le="-0.5"} 1.0',
+                'test_exponential_histogram_bucket{le="0.0"} 2.0',
+                'test_exponential_histogram_bucket{le="1.0"} 3.0',
+                'test_exponential_histogram_bucket{le="2.0"} 4.0',
+                'test_exponential_histogram_bucket{le="4.0"} 6.0',
+                'test_exponential_histogram_bucket{le="+Inf"} 6.0',
+                "test_exponential_histogram_count 6.0",
+                "test_exponential_histogram_sum 9.0",
+            ],
+            [sample.data() for sample in h.samples()],
+        )
+        for amount in (float("inf"), float("-inf"), float("nan")):
+            with self.assertRaises(ValueError):
+                h.observe(amount)
+        self.assertEqual(6.0, h._count.get())
+
+    def test_exponential_histogram_downscale(self):
+        h = ExponentialHistogram(
+            "test_exponential_histogram_downscale",
+            "Latency",
+            {"method"},
+            schema=0,
+            max_buckets=2,
+            buckets=(1, 3),
+        )
+        child = h.labels(method="get")
+        for amount in (1, 2, 4):
+            child.observe(amount)
+        self.assertEqual(-1, child._schema)
+        self.assertEqual((-1, {0: 1.0, 1: 2.0}, {}), child.native())
+        child.observe(3)
+        self.assertEqual(
+            [1.0, 1.0, 4.0, 4.0, 10.0], [sample.value for sample in child.samples()]
+        )
+        self.assertEqual(
+            'test_exponential_histogram_downscale_bucket{le="3.0",method="get"} 1.0',
+            list(child.samples())[1].data(),
+        )
+
+    def test_inc_many(self):
+        c = Counter("test_inc_many", "HTTP Failures", {"method"})
+        c.inc_many([{"method": "get"}, {"method": "post"}, {"method": "get"}])
+        c.inc_many([{"method": "get"}], [2.5])
+        self.assertEqual(4.5, c.labels(method="get")._count.get())
+        self.assertEqual(1.0, c.labels(method="post")._count.get())
+        with self.assertRaises(ValueError):
+            c.inc_many([{"endpoint": "/"}])
+
     def test_label(self):
         c = Counter("my_requests_total", "HTTP Failures", {"method", "endpoint"})
         get_counter = c.labels(method="get", endpoint="/")
@@ -155,6 +333,217 @@ class MetricTestCase(unittest.TestCase):
         self.assertEqual(
             'my_requests_total_total{endpoint="/",method="get"} 1.0', sample.data()
         )
+        self.assertIs(get_counter, c.labels(endpoint="/", method="get"))
+        with self.assertRaises(ValueError):
+            c.labels(method="get")
+        with self.assertRaises(ValueError):
+            c.labels(method="get", endpoint="/", extra="")
+
+    def test_label_remove(self):
+        c = Counter("test_label_remove", "HTTP Failures", {"method"})
+        c.labels(method="get").inc()
+        c.labels(method="post").inc()
+
+        def exported():
+            return {
+                sample.data()
+                for metric in GlobalCollector.collect()
+                if metric.name == "test_label_remove"
+                for sample in metric.samples()
+            }
+
+        self.assertEqual(
+            {
+                'test_label_remove_total{method="get"} 1.0',
+                'test_label_remove_total{method="post"} 1.0',
+            },
+            exported(),
+        )
+        c.remove(method="get")
+        self.assertEqual({'test_label_remove_total{method="post"} 1.0'}, exported())
+        self.assertEqual(0.0, c.labels(method="get")._count.get())
+
+        c.clear()
+        self.assertEqual(set(), exported())
+
+
+class LabeledSeriesTestCase(MetricsTestCase):
+    def tearDown(self):
+        GlobalCollector.max_series = None
+
+    def exported(self, name):
+        return [
+            sample.data()
+            for metric in GlobalCollector.collect()
+            if metric.name == name
+            for sample in metric.samples()
+        ]
+
+    def test_evict(self):
+        c = Counter(
+            "test_limit_evict", "Description of counter", {"user"}, max_series=2
+        )
+        c.labels(user="a").inc()
+        c.labels(user="b").inc()
+        c.labels(user="a").inc()
+        c.labels(user="c").inc()
+        self.assertEqual(
+            [
+                'test_limit_evict_total{user="a"} 2.0',
+                'test_limit_evict_total{user="c"} 1.0',
+            ],
+            sorted(self.exported("test_limit_evict")),
+        )
+        self.assertEqual(
+            ['derive_metrics_rejected_series_total{metric="test_limit_evict"} 1.0'],
+            self.exported("derive_metrics_rejected_series"),
+        )
+
+    def test_overflow(self):
+        h = Histogram(
+            "test_limit_overflow",
+            "Latency",
+            {"user", "method"},
+            max_series=1,
+            on_limit="overflow",
+            buckets=(1,),
+        )
+        h.labels(user="a", method="get").observe(0.5)
+        h.labels(user="b", method="get").observe(0.5)
+        h.labels(user="c", method="get").observe(2)
+        overflow = h.labels(user="c", method="get")
+        with mock.patch.object(h, "_lock") as lock:
+            self.assertIs(overflow, h.labels(user="b", method="get"))
+        lock.__enter__.assert_not_called()
+        self.assertEqual(
+            ['derive_metrics_rejected_series_total{metric="test_limit_overflow"} 2.0'],
+            self.exported("derive_metrics_rejected_series"),
+        )
+        self.assertEqual(
+            [
+                'test_limit_overflow_count{method="__overflow__",user="__overflow__"} 2.0',
+                'test_limit_overflow_count{method="get",user="a"} 1.0',
+            ],
+            sorted(
+                line
+                for line in self.exported("test_limit_overflow")
+                if "_count" in line
+            ),
+        )
+        with self.assertRaises(ValueError):
+            Counter("test_limit_policy", "Description", {"user"}, on_limit="drop")
+
+    def test_global_limit(self):
+        Counter("test_limit_global_a", "Description of counter").inc()
+        GlobalCollector.max_series = 2
+        c = Counter("test_limit_global", "Description of counter", {"user"})
+        c.labels(user="a").inc()
+        c.labels(user="b").inc()
+        c.labels(user="c").inc()
+        self.assertEqual(
+            ['test_limit_global_total{user="c"} 1.0'],
+            self.exported("test_limit_global"),
+        )
+
+        # the least recently used child is evicted, not the oldest one
+        GlobalCollector.max_series = len(self.backend.metrics_mapping) + 1
+        c.labels(user="d").inc()
+        c.labels(user="c").inc()
+        c.labels(user="e").inc()
+        self.assertEqual(
+            [
+                'test_limit_global_total{user="c"} 2.0',
+                'test_limit_global_total{user="e"} 1.0',
+            ],
+            sorted(self.exported("test_limit_global")),
+        )
+
+    def test_ttl(self):
+        g = Gauge("test_ttl", "Description of gauge", {"peer"}, ttl=60)
+        with mock.patch.object(label, "monotonic", return_value=1000.0):
+            g.labels(peer="a").set(1)
+            g.labels(peer="b").set(2)
+        with mock.patch.object(label, "monotonic", return_value=1050.0):
+            g.labels(peer="a").inc()
+        with mock.patch.object(label, "monotonic", return_value=1070.0):
+            self.assertEqual(['test_ttl{peer="a"} 2.0'], self.exported("test_ttl"))
+        with mock.patch.object(label, "monotonic", return_value=1200.0):
+            # a new child sweeps stale ones without waiting for a collection
+            g.labels(peer="c").set(3)
+            self.assertEqual({"c"}, set(g._children))
+            self.assertEqual(['test_ttl{peer="c"} 3.0'], self.exported("test_ttl"))
+
+
+class MeterTestCase(MetricsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        patcher = mock.patch.object(meter, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rates(self):
+        m = Meter("test_meter", "Requests", windows=(1.25, 5))
+        self.assertEqual([0.0, 0.0], m.rates())
+        self.now += 0.125
+        m.mark(10)
+        # rates start from the rate of the first tick of 0.25 seconds
+        self.now += 0.125
+        self.assertEqual(40.0, m.rate())
+        self.assertEqual([40.0, 40.0], m.rates())
+        # then move towards the rate of every tick
+        self.now += 0.5
+        self.assertAlmostEqual(40 * math.exp(-0.5 / 1.25), m.rate(1.25))
+        self.assertAlmostEqual(40 * math.exp(-0.5 / 5), m.rate(5))
+
+        samples = {
+            sample.data().rpartition(" ")[0]: sample.value
+            for metric in GlobalCollector.collect()
+            for sample in metric.samples()
+        }
+        self.assertEqual(
+            ['test_meter_rate{window="1.25"}', 'test_meter_rate{window="5"}'],
+            [name for name in samples if name.startswith("test_meter_rate")],
+        )
+        self.assertAlmostEqual(
+            40 * math.exp(-0.5 / 1.25),
+            samples['test_meter_rate{window="1.25"}'],
+            delta=0.1,
+        )
+
+        with self.assertRaises(ValueError):
+            Meter("test_meter_invalid", "Requests", windows=())
+
+    def test_error_ratio(self):
+        m = Meter("test_meter_errors", "Requests", error_window=10, error_buckets=5)
+        self.assertEqual(0.0, m.error_ratio())
+        m.mark(3)
+        self.now += 4
+        m.mark(error=True)
+        self.assertEqual(0.25, m.error_ratio())
+        self.now += 4
+        (metric,) = [
+            metric
+            for metric in GlobalCollector.collect()
+            if metric.name == "test_meter_errors_error_ratio"
+        ]
+        self.assertEqual("# TYPE test_meter_errors_error_ratio gauge", metric.type())
+        self.assertEqual([0.25], metric.sample_values())
+        # the first events left the window
+        self.now += 4
+        self.assertEqual(1.0, m.error_ratio())
+        self.now += 10
+        self.assertEqual(0.0, m.error_ratio())
+
+        # events of the first slice are exported before any rotation
+        first = Meter("test_meter_first", "Requests")
+        first.mark(error=True)
+        (metric,) = [
+            metric
+            for metric in GlobalCollector.collect()
+            if metric.name == "test_meter_first_error_ratio"
+        ]
+        self.assertEqual([1.0], metric.sample_values())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+import multiprocessing.util
+import os
+import time
+import unittest
+from unittest import mock
+
+from derive.metrics import Counter, Gauge
+from derive.metrics import push
+from derive.metrics.exporter import OpenMetricsExporter
+from derive.metrics.push import LocalReceiver, PushError, PushExporter
+from tests import MmapTestCase
+
+
+class PushTestCase(MmapTestCase):
+    def setUp(self):
+        super().setUp()
+        self.receiver = LocalReceiver().start()
+        self.url = self.receiver.url + "/metrics/job/test"
+
+    def tearDown(self):
+        self.receiver.stop()
+
+    def test_push_changed(self):
+        c = Counter("test_push_counter", "Description of counter", {"method"})
+        g = Gauge("test_push_gauge", "Description of gauge")
+        c.labels(method="get").inc()
+        c.labels(method="post").inc(2)
+        g.set(3)
+        exporter = PushExporter(self.url, start=False, backoff=0.01)
+        self.assertEqual(2, exporter.push())
+        self.assertEqual(
+            {
+                'test_push_counter_total{method="get"}': 1.0,
+                'test_push_counter_total{method="post"}': 2.0,
+                "test_push_gauge": 3.0,
+            },
+            self.receiver.series("/metrics/job/test"),
+        )
+        (request,) = self.receiver.requests
+        self.assertEqual("gzip", request.headers["Content-Encoding"])
+        self.assertEqual(
+            1, request.body.count(b"# TYPE test_push_counter_total counter\n")
+        )
+
+        self.assertEqual(0, exporter.push())
+        c.labels(method="get").inc()
+        self.assertEqual(1, exporter.push())
+        body = self.receiver.requests[-1].body
+        self.assertIn(b'test_push_counter_total{method="get"} 2.0\n', body)
+        self.assertNotIn(b"test_push_gauge", body)
+        self.assertEqual(
+            3.0, self.receiver.series("/metrics/job/test")["test_push_gauge"]
+        )
+        # one persistent connection
+        self.assertEqual(
+            1, len({request.client_address for request in self.receiver.requests})
+        )
+        exporter.close()
+
+    def test_resend(self):
+        Counter("test_push_resend", "Description of counter").inc()
+        exporter = PushExporter(self.url, start=False, resend=60)
+        self.assertEqual(1, exporter.push())
+        self.assertEqual(0, exporter.push())
+        # e.g. the receiver restarted
+        self.receiver.groups.clear()
+        with mock.patch.object(push, "monotonic", return_value=time.monotonic() + 60):
+            self.assertEqual(1, exporter.push())
+        self.assertEqual(
+            {"test_push_resend_total": 1.0}, self.receiver.series("/metrics/job/test")
+        )
+        exporter.close()
+
+    def test_batches_and_retries(self):
+        for i in range(3):
+            Gauge(f"test_push_batch_{i}", "Description of gauge").set(i)
+        exporter = PushExporter(
+            self.url,
+            exporter=OpenMetricsExporter,
+            compress=False,
+            batch_size=1,
+            backoff=0.01,
+            start=False,
+        )
+        self.receiver.fail_next(2)
+        self.assertEqual(3, exporter.push())
+        self.assertEqual(5, len(self.receiver.requests))
+        for request in self.receiver.requests:
+            self.assertTrue(request.body.endswith(b"# EOF\n"))
+        self.assertEqual(3, len(self.receiver.series("/metrics/job/test")))
+
+        Gauge("test_push_batch_0", "Description of gauge").set(5)
+        self.receiver.fail_next(1, status=400)
+        with self.assertRaises(PushError):
+            exporter.push()
+        # not acknowledged, sent again
+        self.assertEqual(1, exporter.push())
+        self.assertEqual(
+            5.0, self.receiver.series("/metrics/job/test")["test_push_batch_0"]
+        )
+        exporter.close()
+
+    def test_background(self):
+        c = Counter("test_push_background", "Description of counter")
+        c.inc()
+        exporter = PushExporter(self.url, interval=3600)
+
+        # a forked child does not push, its values are merged into those of the parent
+        pid = os.fork()
+        if pid == 0:
+            try:
+                c.inc()
+            finally:
+                # the exit functions of `multiprocessing`, without removing the directory
+                multiprocessing.util._exit_function()
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual([], self.receiver.requests)
+
+        exporter.close()
+        self.assertEqual(
+            {"test_push_background_total": 2.0},
+            self.receiver.series("/metrics/job/test"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import unittest
+from urllib.request import Request, urlopen
+
+from derive.metrics import Counter, Gauge
+from derive.metrics.exporter import CONTENT_TYPE_LATEST, CONTENT_TYPE_OPENMETRICS
+from derive.metrics.server import (
+    start_asyncio_server,
+    start_http_server,
+    start_http_server_process,
+)
+from tests import MmapTestCase
+
+
+def scrape(port, path="/metrics", **headers):
+    with urlopen(Request(f"http://127.0.0.1:{port}{path}", headers=headers)) as r:
+        return r.headers, r.read()
+
+
+class ServerTestCase(MmapTestCase):
+    def setUp(self):
+        super().setUp()
+        Counter("test_server_counter", "Description of counter").inc(3)
+        Gauge("test_server_gauge", "Description of gauge").set(2)
+
+    def test_http_server(self):
+        server, thread = start_http_server(0, "127.0.0.1")
+        port = server.server_address[1]
+        try:
+            headers, body = scrape(port)
+            self.assertEqual(CONTENT_TYPE_LATEST, headers["Content-Type"])
+            self.assertIn(b"# TYPE test_server_counter_total counter\n", body)
+            self.assertIn(b"test_server_gauge 2.0\n", body)
+
+            headers, body = scrape(
+                port, Accept="application/openmetrics-text; version=1.0.0"
+            )
+            self.assertEqual(CONTENT_TYPE_OPENMETRICS, headers["Content-Type"])
+            self.assertIn(b"# TYPE test_server_counter counter\n", body)
+            self.assertTrue(body.endswith(b"# EOF\n"))
+
+            headers, body = scrape(
+                port, "/metrics?name[]=test_server_gauge", **{"Accept-Encoding": "gzip"}
+            )
+            self.assertEqual("gzip", headers["Content-Encoding"])
+            body = gzip.decompress(body)
+            self.assertIn(b"test_server_gauge 2.0\n", body)
+            self.assertNotIn(b"test_server_counter", body)
+        finally:
+            server.shutdown()
+            server.server_close()
+        thread.join()
+
+    def test_http_server_process(self):
+        server, process = start_http_server_process(0, "127.0.0.1")
+        try:
+            Counter("test_server_counter", "Description of counter").inc()
+            _, body = scrape(server.server_address[1])
+            self.assertIn(b"test_server_counter_total 4.0\n", body)
+        finally:
+            process.terminate()
+            process.join()
+
+    def test_asyncio_server(self):
+        async def main():
+            server = await start_asyncio_server(0, "127.0.0.1")
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    lambda: scrape(
+                        port, "/?name[]=test_server_counter_total", Accept="text/plain"
+                    ),
+                )
+
+        headers, body = asyncio.run(main())
+        self.assertEqual(CONTENT_TYPE_LATEST, headers["Content-Type"])
+        self.assertIn(b"test_server_counter_total 3.0\n", body)
+        self.assertNotIn(b"test_server_gauge", body)
+
+
+if __name__ == "__main__":
+    unittest.main()